@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'countries.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -72,24 +74,21 @@ TEMPLATES = [
 WSGI_APPLICATION = 'config.wsgi.application'
 
 # DATABASE CONFIGURATION - MANUAL SETUP REQUIRED
-print("=== DATABASE SETUP ===")
-print("If you see this, you need to manually add PostgreSQL environment variables in Railway")
-
 if os.getenv('DATABASE_URL'):
     import dj_database_url
     DATABASES = {
         'default': dj_database_url.config(
             default=os.getenv('DATABASE_URL'),
             conn_max_age=600,
-            ssl_require=True
+            # SQLite stand-ins (local benchmarks, tests) do not accept sslmode
+            ssl_require=not os.getenv('DATABASE_URL').startswith('sqlite')
         )
     }
-    print("SUCCESS: Using DATABASE_URL")
 else:
-    print("ERROR: No DATABASE_URL found")
-    print("Please add PostgreSQL connection variables in Railway dashboard")
-    # This will fail but show clear error
-    raise Exception("PostgreSQL configuration missing. Add DATABASE_URL environment variable.")
+    raise Exception(
+        "PostgreSQL configuration missing. Add the DATABASE_URL environment variable "
+        "(Railway: add the PostgreSQL connection variables in the dashboard)."
+    )
 
 # Rest of your settings...
 AUTH_PASSWORD_VALIDATORS = [
@@ -121,12 +120,98 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 CACHE_DIR = os.path.join(BASE_DIR, 'cache')
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# File based so every worker on the host shares cached responses and the
+# dataset version used to invalidate them; needs no external service
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'django'),
+    }
+}
+
+# Cache rendered GET /countries responses until the next refresh or delete
+COUNTRY_LIST_CACHE_ENABLED = os.getenv('COUNTRY_LIST_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Serve list/detail/stats reads from an in-memory copy of the countries
+# table, reloaded whenever the dataset version changes
+COUNTRY_REPLICA_ENABLED = os.getenv('COUNTRY_REPLICA_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Mixed into the per-country hash that picks the estimated GDP multiplier;
+# change it to reshuffle every multiplier, keep it to get reproducible GDP
+GDP_MULTIPLIER_SEED = os.getenv('GDP_MULTIPLIER_SEED', '')
+
+# Seconds GET /countries/image waits for another worker that is rendering
+# the summary image before answering 503 with Retry-After
+SUMMARY_IMAGE_RENDER_WAIT = float(os.getenv('SUMMARY_IMAGE_RENDER_WAIT', '3'))
+
+# Run POST /countries/refresh jobs in the request thread instead of the
+# background job runner (handy for tests and one-off scripts)
+REFRESH_JOBS_INLINE = os.getenv('REFRESH_JOBS_INLINE', '').lower() in ('1', 'true', 'yes')
+
+# Bundled countries snapshot used by `manage.py load_countries` on deploy
+COUNTRIES_SEED_PATH = os.getenv(
+    'COUNTRIES_SEED_PATH', str(BASE_DIR / 'countries' / 'data' / 'countries_seed.jsonl.gz')
+)
+
+# Parse the countries payload while it downloads and upsert it in batches,
+# instead of loading the whole document first
+REFRESH_STREAMING = os.getenv('REFRESH_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+
+# Where refreshes fetch from: 'live' (the public APIs), 'recording' (a file
+# written by `manage.py upstream record`) or 'stub' (`manage.py upstream serve`)
+UPSTREAM_SOURCE = os.getenv('UPSTREAM_SOURCE', 'live')
+UPSTREAM_RECORDING_PATH = os.getenv('UPSTREAM_RECORDING_PATH', '')
+UPSTREAM_STUB_URL = os.getenv('UPSTREAM_STUB_URL', 'http://127.0.0.1:8001')
+
+# Replay the last good payload (or the bundled seed) when the live APIs fail
+UPSTREAM_FALLBACK = os.getenv('UPSTREAM_FALLBACK', 'true').lower() in ('1', 'true', 'yes')
+
+# 'wsgi' (sync gunicorn workers) or 'asgi' (gunicorn with uvicorn workers,
+# config.asgi); with 'asgi' the read endpoints are served by async views
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi').lower()
+if SERVER_MODE == 'asgi':
+    # WhiteNoise's middleware is sync-only and would put every request on a
+    # worker thread; config.asgi serves static files in front of Django instead
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
+# Per-route latency/query histograms and stage timings at GET /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Who may read /metrics and /metrics/profile: requests carrying
+# "Authorization: Bearer <METRICS_TOKEN>" or coming from one of
+# METRICS_ALLOWED_IPS (REMOTE_ADDR, comma separated). Nobody when both are empty.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# Sample every worker's stacks (served folded at GET /metrics/profile)
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.005'))
+
+# Level of the countries.* loggers; records below it are dropped before
+# their message is formatted
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'countries': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
+    # JSON is the only renderer; ?format= is free for endpoints such as the image
+    'URL_FORMAT_OVERRIDE': None,
 }
 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
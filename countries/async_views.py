@@ -0,0 +1,188 @@
+"""
+Async versions of the read endpoints, routed instead of the DRF views when
+settings.SERVER_MODE is 'asgi' (uvicorn workers).
+
+DRF views are sync only, so these are plain Django async views built on
+the same helpers as countries.views and returning the same bodies. Queries
+use the async ORM; cache and replica hits never leave the event loop, and
+file reads and image variant rendering run in worker threads.
+"""
+import functools
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from .cache import etag_matches, get_dataset_version, list_response_cache
+from .image_service import ImageNotReady, SummaryImageGenerator
+from .models import Country, CountryStats, RefreshJob
+from .pagination import COUNTRY_FIELDS, InvalidPageParameter
+from .replica import COLUMNS as REPLICA_COLUMNS, CountryReplica
+from .serializers import CountrySerializer
+from .snapshot_service import SnapshotNotFound
+from .views import (
+    _as_of_params, _as_of_response, _image_params, _image_response, _is_number, _job_data,
+    _list_params, _list_query, _render_list,
+)
+
+logger = logging.getLogger(__name__)
+
+_renderer = JSONRenderer()
+
+
+def _json(data, status_code=status.HTTP_200_OK):
+    """Rendered like a DRF Response"""
+    return HttpResponse(_renderer.render(data), content_type='application/json', status=status_code)
+
+
+def _not_found():
+    return _json({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+
+
+def _method_not_allowed(request):
+    response = _json({'detail': f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+    response['Allow'] = 'GET, HEAD'
+    return response
+
+
+def get_only(view):
+    """Reject other methods like @api_view(['GET']) does"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return _method_not_allowed(request)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@sync_to_async
+def _list_countries_as_of(request):
+    try:
+        snapshot, fields = _as_of_params(request)
+    except (ValueError, InvalidPageParameter) as e:
+        return _json({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+    except SnapshotNotFound as e:
+        return _json({'error': str(e)}, status.HTTP_404_NOT_FOUND)
+    return _as_of_response(request, snapshot, fields)
+
+
+async def _list_countries_body(version, region, currency, sort, fields, limit=None, after=None):
+    if settings.COUNTRY_REPLICA_ENABLED:
+        replica = await CountryReplica.afor_version(version)
+        rows = replica.query(region, currency, sort, limit, after)
+        if rows is not None:
+            return _render_list(version, sort, fields, REPLICA_COLUMNS, rows, limit)
+    countries, columns = _list_query(region, currency, sort, fields, limit, after)
+    rows = [row async for row in countries]
+    return _render_list(version, sort, fields, columns, rows, limit)
+
+
+@get_only
+async def list_countries(request):
+    if 'as_of' in request.GET:
+        return await _list_countries_as_of(request)
+
+    try:
+        params = _list_params(request)
+    except InvalidPageParameter as e:
+        return _json({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+    version = get_dataset_version()
+
+    if not settings.COUNTRY_LIST_CACHE_ENABLED:
+        body = await _list_countries_body(version, *params)
+        return HttpResponse(body, content_type='application/json')
+
+    entry = await list_response_cache.aget(version, params)
+    if entry is None:
+        entry = await list_response_cache.aset(version, params, await _list_countries_body(version, *params))
+    etag, body = entry
+
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+
+@get_only
+async def get_country_by_name(request, name):
+    version = get_dataset_version()
+    if settings.COUNTRY_REPLICA_ENABLED:
+        columns = REPLICA_COLUMNS
+        row = (await CountryReplica.afor_version(version)).get(name)
+    else:
+        columns = CountrySerializer.columns(COUNTRY_FIELDS)
+        row = await Country.objects.iexact('name', name).order_by().values_list(*columns).afirst()
+    if row is None:
+        return _not_found()
+    body = CountrySerializer.render_one(COUNTRY_FIELDS, columns, row, version)
+    return HttpResponse(body, content_type='application/json')
+
+
+@get_only
+async def get_status(request):
+    if settings.COUNTRY_REPLICA_ENABLED:
+        stats = (await CountryReplica.afor_version(get_dataset_version())).stats
+    else:
+        stats = await CountryStats.acurrent()
+
+    job_id = request.GET.get('job')
+    if job_id is not None:
+        if not _is_number(job_id):
+            return _json({'error': 'Invalid job id'}, status.HTTP_400_BAD_REQUEST)
+        job = await RefreshJob.objects.filter(pk=job_id).afirst()
+        if job is None:
+            return _not_found()
+    else:
+        job = await RefreshJob.objects.afirst()
+
+    return _json({
+        'total_countries': stats.total_countries,
+        'last_refreshed_at': stats.last_refreshed_at,
+        'refresh_job': _job_data(job) if job else None
+    })
+
+
+@get_only
+async def get_countries_image(request):
+    """Serve the generated summary image; ?format=png|webp|svg and ?width= select a variant"""
+    try:
+        image_format, width = _image_params(request)
+    except ValueError as e:
+        return _json({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+    # A stat() of the manifest; rendering only happens when there is no image
+    image = SummaryImageGenerator.current_image()
+    if image is None:
+        try:
+            image = await sync_to_async(SummaryImageGenerator.ensure_image)(
+                wait=settings.SUMMARY_IMAGE_RENDER_WAIT
+            )
+        except ImageNotReady:
+            response = _json(
+                {'error': 'Summary image is being generated, try again shortly'},
+                status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = '2'
+            return response
+
+    if image is None:
+        return _json(
+            {'error': 'Summary image not found and could not be generated'},
+            status.HTTP_404_NOT_FOUND
+        )
+
+    try:
+        # No database access, so it need not run on the shared sync thread
+        return await sync_to_async(_image_response, thread_sensitive=False)(request, image, image_format, width)
+    except OSError:
+        logger.exception("Could not open summary image %s", image['path'])
+        return _json(
+            {'error': 'Could not open image file'},
+            status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
@@ -0,0 +1,557 @@
+"""
+Benchmarks for the hot paths of the API.
+
+Every scenario runs inside a transaction that is rolled back afterwards,
+and with a throwaway CACHE_DIR, so they can be pointed at any database (a
+local SQLite stand-in is enough) without leaving rows behind or bumping
+the dataset version a server on the same checkout uses. The server load
+test only reads, from real gunicorn processes, so it uses whatever the
+database already holds.
+
+The api suite (benchmark_api) covers every read endpoint and a full
+refresh replayed from a recording; its report can be saved as a JSON
+baseline and compared with later runs (compare_reports).
+"""
+import itertools
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote, urlencode
+
+import requests as http
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import recordings
+from .cache import bump_dataset_version
+from .image_service import SummaryImageGenerator
+from .metrics import QueryCounter
+from .models import Country
+from .pagination import COUNTRY_FIELDS, SORTS
+from .refresh_service import RefreshService
+from .serializers import CountrySerializer
+from .services import CountryService
+from .sources import RecordingSource
+
+CURRENCIES = ['USD', 'EUR', 'GBP', 'NGN', 'JPY', 'INR', 'BRL', 'ZAR']
+REGIONS = ['Africa', 'Americas', 'Asia', 'Europe', 'Oceania']
+
+
+def synthetic_countries_payload(count: int) -> List[Dict]:
+    """Build a payload shaped like the restcountries v2 response"""
+    return [
+        {
+            'name': f'Country {i:06d}',
+            'capital': f'Capital {i}',
+            'region': REGIONS[i % len(REGIONS)],
+            'population': 1000 + i * 7919,
+            'flag': f'https://flagcdn.com/c{i}.svg',
+            'currencies': [{'code': CURRENCIES[i % len(CURRENCIES)]}],
+        }
+        for i in range(count)
+    ]
+
+
+def synthetic_exchange_rates() -> Dict:
+    return {code: 1.0 + index * 0.37 for index, code in enumerate(CURRENCIES)}
+
+
+def legacy_refresh(countries_data: List[Dict], exchange_rates: Dict) -> None:
+    """The per-row update_or_create loop refresh_countries used to run"""
+    with transaction.atomic():
+        for country_data in countries_data:
+            processed_data = CountryService.process_country_data(country_data, exchange_rates)
+            Country.objects.update_or_create(
+                name=processed_data['name'],
+                defaults={
+                    'capital': processed_data['capital'],
+                    'region': processed_data['region'],
+                    'population': processed_data['population'] or 0,
+                    'currency_code': processed_data['currency_code'],
+                    'exchange_rate': processed_data['exchange_rate'],
+                    'flag_url': processed_data['flag_url']
+                }
+            )
+
+
+def bulk_refresh(countries_data: List[Dict], exchange_rates: Dict) -> None:
+    RefreshService.upsert_countries(countries_data, exchange_rates)
+
+
+def measure(fn: Callable[[], None]) -> Dict:
+    """Run fn once and report its database round trips and wall time"""
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+    return {'queries': counter.count, 'seconds': elapsed}
+
+
+def latency_stats(latencies: Sequence[float], seconds: float) -> Dict:
+    """Throughput and p50/p90/p99 latency of requests that took seconds in total"""
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    else:
+        p50 = p90 = p99 = latencies[0]
+    return {
+        'requests': len(latencies),
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds,
+        'p50_ms': p50 * 1000,
+        'p90_ms': p90 * 1000,
+        'p99_ms': p99 * 1000,
+    }
+
+
+def benchmark_refresh(count: int = 250) -> List[Dict]:
+    """
+    Compare the legacy and bulk refresh paths.
+
+    Each path is measured three times in a row: against an empty table
+    (every row is created), with the same payload again (nothing changed)
+    and with every population bumped (every row changed).
+    """
+    countries_data = synthetic_countries_payload(count)
+    changed_data = [dict(country, population=country['population'] + 1) for country in countries_data]
+    exchange_rates = synthetic_exchange_rates()
+    phases = (('create', countries_data), ('unchanged', countries_data), ('changed', changed_data))
+    results = []
+
+    for label, refresh in (('legacy', legacy_refresh), ('bulk', bulk_refresh)):
+        with transaction.atomic():
+            Country.objects.all().delete()
+            for phase, payload in phases:
+                stats = measure(lambda: refresh(payload, exchange_rates))
+                results.append({'path': label, 'phase': phase, 'countries': count, **stats})
+            transaction.set_rollback(True)
+
+    return results
+
+
+LIST_QUERIES = [
+    '/countries',
+    '/countries?sort=gdp_desc',
+    '/countries?region=Africa',
+    '/countries?region=europe&sort=population_asc',
+    '/countries?currency=EUR&sort=name_desc',
+]
+
+
+@contextmanager
+def throwaway_cache_dir():
+    """
+    Point CACHE_DIR (dataset version, images, HTTP cache) and the Django
+    cache, whose location settings resolved from the real CACHE_DIR, at a
+    temporary directory
+    """
+    with tempfile.TemporaryDirectory() as cache_dir, override_settings(
+        CACHE_DIR=cache_dir,
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(cache_dir, 'django'),
+        }},
+    ):
+        yield cache_dir
+
+
+def seed_countries(count: int) -> None:
+    """Insert count synthetic countries through the bulk refresh path"""
+    RefreshService.upsert_countries(synthetic_countries_payload(count), synthetic_exchange_rates())
+
+
+def benchmark_list(count: int = 250, requests: int = 500) -> List[Dict]:
+    """Requests/sec of GET /countries with the response cache off and on"""
+    client = Client(HTTP_HOST='localhost')
+    results = []
+
+    with throwaway_cache_dir(), transaction.atomic():
+        Country.objects.all().delete()
+        seed_countries(count)
+
+        for enabled in (False, True):
+            bump_dataset_version()
+            paths = itertools.islice(itertools.cycle(LIST_QUERIES), requests)
+            with override_settings(COUNTRY_LIST_CACHE_ENABLED=enabled):
+                started = time.perf_counter()
+                for path in paths:
+                    client.get(path, secure=True)
+                elapsed = time.perf_counter() - started
+            results.append({
+                'cache': 'on' if enabled else 'off',
+                'countries': count,
+                'requests': requests,
+                'seconds': elapsed,
+                'requests_per_second': requests / elapsed,
+            })
+
+        transaction.set_rollback(True)
+
+    return results
+
+
+def legacy_render_list() -> bytes:
+    """Model instances, per-row dicts and DRF's JSONRenderer, as list_countries used to do"""
+    data = []
+    for country in Country.objects.order_by('name'):
+        data.append({
+            'id': country.id,
+            'name': country.name,
+            'capital': country.capital,
+            'region': country.region,
+            'population': country.population,
+            'currency_code': country.currency_code,
+            'exchange_rate': float(country.exchange_rate) if country.exchange_rate else None,
+            'estimated_gdp': float(country.estimated_gdp) if country.estimated_gdp else None,
+            'flag_url': country.flag_url,
+            'last_refreshed_at': country.last_refreshed_at,
+        })
+    return JSONRenderer().render(data)
+
+
+def fast_render_list(version=None) -> bytes:
+    columns = CountrySerializer.columns(COUNTRY_FIELDS)
+    rows = Country.objects.order_by('name').values_list(*columns)
+    return CountrySerializer.render_list(COUNTRY_FIELDS, columns, rows, version)
+
+
+SERIALIZATION_SIZES = (250, 25000)
+
+
+def benchmark_serialization(sizes: Sequence[int] = SERIALIZATION_SIZES, repeat: int = 5) -> List[Dict]:
+    """
+    Best-of-repeat time to render the full list: the legacy view path,
+    the values_list serializer without row cache, and with a warm row cache.
+    """
+    results = []
+    for count in sizes:
+        with throwaway_cache_dir(), transaction.atomic():
+            Country.objects.all().delete()
+            seed_countries(count)
+            version = bump_dataset_version()
+            fast_render_list(version)  # warm the row cache
+
+            variants = (
+                ('legacy', legacy_render_list),
+                ('fast', fast_render_list),
+                ('fast+row-cache', lambda: fast_render_list(version)),
+            )
+            for label, render in variants:
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    body = render()
+                    timings.append(time.perf_counter() - started)
+                results.append({
+                    'path': label,
+                    'countries': count,
+                    'seconds': min(timings),
+                    'bytes': len(body),
+                })
+            transaction.set_rollback(True)
+    return results
+
+
+SERVER_PATHS = [
+    '/countries',
+    '/countries?region=Africa&sort=gdp_desc',
+    '/status',
+    '/countries/image',
+]
+
+SERVER_COMMANDS = {
+    'wsgi': ['config.wsgi'],
+    'asgi': ['config.asgi', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """gunicorn serving config.wsgi or config.asgi on a free local port"""
+
+    # Plain HTTP locally; this is what the proxy sends in production
+    HEADERS = {'X-Forwarded-Proto': 'https'}
+
+    def __init__(self, mode: str, workers: int = 3):
+        self.mode = mode
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.command = [
+            sys.executable, '-m', 'gunicorn', *SERVER_COMMANDS[mode],
+            '--bind', f'127.0.0.1:{self.port}', '--workers', str(workers), '--log-level', 'warning',
+        ]
+        self.process = None
+
+    def __enter__(self) -> 'ServerProcess':
+        env = dict(os.environ, SERVER_MODE=self.mode)
+        self.process = subprocess.Popen(self.command, env=env, stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{self.mode} server exited with status {self.process.returncode}')
+            try:
+                http.get(f'{self.base_url}/status', headers=self.HEADERS, timeout=1)
+                return self
+            except http.ConnectionError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError(f'{self.mode} server did not start within 30s')
+
+    def __exit__(self, *exc_info) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def run_load(base_url: str, path: str, requests: int, concurrency: int,
+             headers: Dict[str, str] = ServerProcess.HEADERS) -> Dict:
+    """
+    requests GETs of path from concurrency keep-alive clients; reports
+    throughput and latency percentiles. 5xx answers and failures count as errors.
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client(count: int) -> None:
+        nonlocal errors
+        session = http.Session()
+        own_latencies, own_errors = [], 0
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                response = session.get(base_url + path, headers=headers, timeout=30)
+                failed = response.status_code >= 500
+            except http.RequestException:
+                failed = True
+            own_latencies.append(time.perf_counter() - started)
+            own_errors += failed
+        with lock:
+            latencies.extend(own_latencies)
+            errors += own_errors
+
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, counts))
+    elapsed = time.perf_counter() - started
+
+    return {**latency_stats(latencies, elapsed), 'errors': errors}
+
+
+def benchmark_servers(paths: Sequence[str] = SERVER_PATHS, requests: int = 2000, concurrency: int = 32,
+                      workers: int = 3, modes: Sequence[str] = ('wsgi', 'asgi')) -> List[Dict]:
+    """
+    Load-test the read endpoints under sync gunicorn workers (WSGI views)
+    and under uvicorn workers (async views), with the same worker count.
+    """
+    results = []
+    for mode in modes:
+        with ServerProcess(mode, workers) as server:
+            for path in paths:
+                run_load(server.base_url, path, min(requests, 100), concurrency)  # warm caches
+                stats = run_load(server.base_url, path, requests, concurrency)
+                results.append({'mode': mode, 'path': path, 'workers': workers, **stats})
+    return results
+
+
+def list_paths(limit: Optional[int] = None) -> List[str]:
+    """GET /countries with no filter, a region, a currency and both, in every sort order"""
+    filters = ({}, {'region': 'Africa'}, {'currency': 'EUR'}, {'region': 'Africa', 'currency': 'EUR'})
+    paths = []
+    for params in filters:
+        for sort in SORTS:
+            query = {**params, 'sort': sort}
+            if limit is not None:
+                query['limit'] = limit
+            paths.append(f'/countries?{urlencode(query)}')
+    return paths
+
+
+def api_scenarios(count: int, limit: Optional[int] = None) -> List[Tuple[str, List[str]]]:
+    """(scenario, paths) pairs; a scenario's requests cycle through its paths"""
+    step = max(1, count // 100)
+    names = [f"/countries/{quote(f'Country {i:06d}')}" for i in range(0, count, step)]
+    return [
+        *((f'GET {path}', [path]) for path in list_paths(limit)),
+        ('GET /countries/<name>', names),
+        ('GET /status', ['/status']),
+        ('GET /countries/image', ['/countries/image']),
+        ('GET /countries/image?format=webp&width=400', ['/countries/image?format=webp&width=400']),
+    ]
+
+
+def traced_peak(fn: Callable[[], object]) -> int:
+    """Peak bytes allocated through Python while fn runs"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure_endpoint(client: Client, paths: Sequence[str], requests: int) -> Dict:
+    """
+    requests sequential GETs cycling through paths, after one untimed pass
+    to warm the caches. Peak memory is traced separately, over one more
+    request, since tracing slows everything down. 4xx and 5xx answers count
+    as errors.
+    """
+    for path in paths:
+        client.get(path, secure=True)
+
+    latencies = []
+    errors = 0
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        started = time.perf_counter()
+        for path in itertools.islice(itertools.cycle(paths), requests):
+            request_started = time.perf_counter()
+            response = client.get(path, secure=True)
+            latencies.append(time.perf_counter() - request_started)
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+
+    peak = traced_peak(lambda: client.get(paths[0], secure=True))
+    return {
+        **latency_stats(latencies, elapsed),
+        'errors': errors,
+        'queries': counter.count / requests,
+        'peak_kb': peak / 1024,
+    }
+
+
+def benchmark_refresh_replay(path: str) -> List[Dict]:
+    """
+    RefreshService.run_refresh (fetch, upsert, summary image) replaying the
+    recording at path: into an empty table, then with nothing changed.
+    Each phase runs once timed and once under tracemalloc.
+    """
+    source = RecordingSource(path)
+    results = []
+
+    def refresh() -> Dict:
+        return RefreshService.run_refresh(force=True, source=source)
+
+    for phase in ('create', 'unchanged'):
+        row = {'scenario': f'refresh {phase}'}
+        for traced in (False, True):
+            with transaction.atomic():
+                Country.objects.all().delete()
+                if phase == 'unchanged':
+                    refresh()
+                if traced:
+                    row['peak_kb'] = traced_peak(refresh) / 1024
+                else:
+                    outcome = {}
+                    row.update(measure(lambda: outcome.update(refresh())))
+                    row['countries'] = outcome['countries_processed']
+                    row.update({f'{stage}_seconds': seconds for stage, seconds in outcome['timings'].items()})
+                transaction.set_rollback(True)
+        results.append(row)
+
+    return results
+
+
+def benchmark_api(count: int = 250, requests: int = 500, limit: Optional[int] = None,
+                  recording: Optional[str] = None) -> Dict:
+    """
+    Throughput, latency percentiles, queries per request and peak memory
+    of every read endpoint on count synthetic countries, and of a full
+    refresh replaying recording (default: the same synthetic countries).
+
+    Runs with a throwaway CACHE_DIR, so the summary image, dataset version
+    and recordings it creates never reach the real ones. Returns a report
+    that can be saved as JSON and passed to compare_reports later.
+    """
+    with throwaway_cache_dir() as cache_dir:
+        if recording is None:
+            recording = os.path.join(cache_dir, 'synthetic.jsonl.gz')
+            recordings.write(recording, synthetic_countries_payload(count), synthetic_exchange_rates())
+
+        results = []
+        client = Client(HTTP_HOST='localhost')
+        with transaction.atomic():
+            Country.objects.all().delete()
+            seed_countries(count)
+            bump_dataset_version()
+            SummaryImageGenerator.generate_summary_image()
+            for scenario, paths in api_scenarios(count, limit):
+                results.append({'scenario': scenario, **measure_endpoint(client, paths, requests)})
+            transaction.set_rollback(True)
+
+        results.extend(benchmark_refresh_replay(recording))
+
+    return {
+        'created_at': timezone.now().isoformat(),
+        'countries': count,
+        'requests': requests,
+        'limit': limit,
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'settings': {
+            name: getattr(settings, name)
+            for name in ('COUNTRY_LIST_CACHE_ENABLED', 'COUNTRY_REPLICA_ENABLED', 'REFRESH_STREAMING')
+        },
+        'results': results,
+    }
+
+
+# Compared per scenario kind; True when higher is better
+ENDPOINT_METRICS = {'requests_per_second': True, 'p50_ms': False, 'p99_ms': False, 'queries': False, 'peak_kb': False}
+REFRESH_METRICS = {'seconds': False, 'queries': False, 'peak_kb': False}
+
+
+def compare_reports(baseline: Dict, report: Dict, tolerance: float = 0.1) -> List[Dict]:
+    """
+    Metric by metric changes between two benchmark_api reports, for the
+    scenarios both contain. A change worse than tolerance (0.1 = 10%) is
+    marked as a regression.
+    """
+    before_rows = {row['scenario']: row for row in baseline['results']}
+    changes = []
+    for after in report['results']:
+        before = before_rows.get(after['scenario'])
+        if before is None:
+            continue
+        compared = ENDPOINT_METRICS if 'requests_per_second' in after else REFRESH_METRICS
+        for metric, higher_is_better in compared.items():
+            if metric not in before or metric not in after:
+                continue
+            old, new = before[metric], after[metric]
+            if old:
+                change = new / old - 1
+            else:
+                change = 0.0 if not new else float('inf')
+            changes.append({
+                'scenario': after['scenario'],
+                'metric': metric,
+                'before': old,
+                'after': new,
+                'change': change,
+                'regressed': change < -tolerance if higher_is_better else change > tolerance,
+            })
+    return changes
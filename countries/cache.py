@@ -0,0 +1,206 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+
+class GenerationCounter:
+    """
+    A 64-bit value in a small memory-mapped file.
+
+    Every process that maps the same file shares the page, so a write in one
+    gunicorn worker is visible to the others on their next read, and a read
+    is a memory access instead of a cache lookup. Zero means unset.
+    """
+
+    SIZE = 8
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < self.SIZE:
+                # Zero-filled; concurrent creators extend it to the same size
+                os.ftruncate(fd, self.SIZE)
+            self._map = mmap.mmap(fd, self.SIZE)
+        finally:
+            os.close(fd)
+
+    def read(self) -> int:
+        return struct.unpack_from('<Q', self._map)[0]
+
+    def write(self, value: int) -> None:
+        struct.pack_into('<Q', self._map, 0, value)
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+_version_listeners: List[Callable[[int], None]] = []
+_last_seen_version = None
+
+
+def _version_counter() -> GenerationCounter:
+    path = os.path.join(settings.CACHE_DIR, 'dataset.version')
+    counter = _counters.get(path)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.get(path)
+            if counter is None:
+                counter = _counters[path] = GenerationCounter(path)
+    return counter
+
+
+def on_dataset_version_change(listener: Callable[[int], None]) -> Callable[[int], None]:
+    """
+    Call listener(new_version) the first time this process sees a new
+    version, to drop state that is only valid for older versions. State
+    keyed by version reloads by itself; this only frees memory sooner.
+    """
+    _version_listeners.append(listener)
+    return listener
+
+
+def get_dataset_version() -> int:
+    """
+    Current dataset version; changes whenever countries are written or deleted.
+
+    Shared by every worker on the host through a memory-mapped counter in
+    settings.CACHE_DIR, so it is cheap enough to check on every request.
+    """
+    global _last_seen_version
+    counter = _version_counter()
+    version = counter.read()
+    if not version:
+        # First use on this host; a concurrent initialiser may win, which
+        # only costs one extra reload of version-keyed state
+        counter.write(time.time_ns())
+        version = counter.read()
+    if version != _last_seen_version:
+        _last_seen_version = version
+        for listener in _version_listeners:
+            listener(version)
+    return version
+
+
+def bump_dataset_version() -> int:
+    """
+    Invalidate everything derived from the countries table, in every worker.
+
+    A fresh timestamp is used rather than incrementing, so two concurrent
+    bumps can never produce the same version.
+    """
+    version = time.time_ns()
+    _version_counter().write(version)
+    return version
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def etag_matches(request, etag: str) -> bool:
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+
+class LRUCache:
+    """Small thread-safe in-process LRU"""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def set(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResponseCache:
+    """
+    Rendered response bodies keyed by dataset version and normalized params.
+
+    Lookups hit the in-process LRU first and fall back to Django's cache
+    (file based, so every worker on the host shares it). Entries from older
+    dataset versions are never read again and simply age out.
+    """
+
+    TIMEOUT = 24 * 60 * 60
+
+    def __init__(self, prefix: str, maxsize: int = 128):
+        self.prefix = prefix
+        self.local = LRUCache(maxsize)
+
+    def _key(self, version: int, params: tuple) -> str:
+        digest = hashlib.sha1(repr(params).encode()).hexdigest()
+        return f'{self.prefix}:{version}:{digest}'
+
+    def get(self, version: int, params: tuple) -> Optional[tuple]:
+        key = self._key(version, params)
+        entry = self.local.get(key)
+        if entry is None:
+            entry = cache.get(key)
+            if entry is not None:
+                self.local.set(key, entry)
+        return entry
+
+    def set(self, version: int, params: tuple, body: bytes) -> tuple:
+        """Store body and return the (etag, body) entry"""
+        key = self._key(version, params)
+        entry = (make_etag(body), body)
+        self.local.set(key, entry)
+        cache.set(key, entry, timeout=self.TIMEOUT)
+        return entry
+
+    async def aget(self, version: int, params: tuple) -> Optional[tuple]:
+        key = self._key(version, params)
+        entry = self.local.get(key)
+        if entry is None:
+            entry = await cache.aget(key)
+            if entry is not None:
+                self.local.set(key, entry)
+        return entry
+
+    async def aset(self, version: int, params: tuple, body: bytes) -> tuple:
+        key = self._key(version, params)
+        entry = (make_etag(body), body)
+        self.local.set(key, entry)
+        await cache.aset(key, entry, timeout=self.TIMEOUT)
+        return entry
+
+
+list_response_cache = ResponseCache('countries:list')
+
+
+@on_dataset_version_change
+def _drop_local_list_responses(version: int) -> None:
+    list_response_cache.local.clear()
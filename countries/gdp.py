@@ -0,0 +1,70 @@
+"""
+Estimated GDP computation.
+
+estimated_gdp = population * multiplier / exchange_rate, where the
+multiplier in [1000, 2000) is derived from a stable hash of the country
+name (and settings.GDP_MULTIPLIER_SEED), so unchanged inputs always give
+unchanged outputs.
+
+Multipliers are floats scaled from the hash bits; the GDP itself is
+computed in Decimal from the multiplier's repr and rounded half-up to
+cents, like the rest of Country's money fields.
+"""
+import hashlib
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Optional, Sequence
+
+from django.conf import settings
+
+MULTIPLIER_MIN = 1000.0
+MULTIPLIER_RANGE = 1000.0
+GDP_QUANTUM = Decimal('0.01')
+
+
+def _hash_bits(name: str, seed: str) -> int:
+    """53 stable bits for a country name"""
+    key = f'{seed}:{(name or "").strip().lower()}'.encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') >> 11
+
+
+def gdp_multiplier(name: str, seed: Optional[str] = None) -> float:
+    """Multiplier in [1000, 2000) for a country, stable across processes and refreshes"""
+    if seed is None:
+        seed = getattr(settings, 'GDP_MULTIPLIER_SEED', '')
+    return MULTIPLIER_MIN + MULTIPLIER_RANGE * (_hash_bits(name, seed) / 2 ** 53)
+
+
+def gdp_multipliers(names: Sequence[str], seed: Optional[str] = None) -> List[float]:
+    """gdp_multiplier for every name, reading the seed setting once"""
+    if seed is None:
+        seed = getattr(settings, 'GDP_MULTIPLIER_SEED', '')
+    return [gdp_multiplier(name, seed) for name in names]
+
+
+def estimate_gdp(population: Optional[int], multiplier: float, exchange_rate) -> Optional[Decimal]:
+    """population * multiplier / exchange_rate in Decimal, rounded half-up to cents"""
+    if not population or not exchange_rate:
+        return None
+    try:
+        rate = exchange_rate if isinstance(exchange_rate, Decimal) else Decimal(str(exchange_rate))
+        gdp = Decimal(population) * Decimal(repr(multiplier)) / rate
+        return gdp.quantize(GDP_QUANTUM, rounding=ROUND_HALF_UP)
+    except (TypeError, ValueError, ArithmeticError):
+        return None
+
+
+def compute_gdp_batch(
+    names: Sequence[str],
+    populations: Sequence[Optional[int]],
+    exchange_rates: Sequence[Optional[Decimal]],
+    seed: Optional[str] = None,
+) -> List[Optional[Decimal]]:
+    """
+    Estimated GDP for each country; None where population or exchange rate
+    is missing or zero.
+    """
+    multipliers = gdp_multipliers(names, seed)
+    return [
+        estimate_gdp(population, multiplier, rate)
+        for population, multiplier, rate in zip(populations, multipliers, exchange_rates)
+    ]
@@ -1,83 +1,363 @@
 from PIL import Image, ImageDraw, ImageFont
+from contextlib import contextmanager
+import hashlib
+import io
+import json
+import logging
 import os
+import threading
+import time
+from xml.sax.saxutils import escape
 from django.conf import settings
-from .models import Country
+from .cache import LRUCache
+from .metrics import span
+from .models import Country, CountryStats
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class ImageNotReady(Exception):
+    """Another process is rendering the summary image and did not finish in time"""
+
+
+@contextmanager
+def file_lock(path, timeout):
+    """
+    Exclusive cross-process lock on path; yields whether it was acquired
+    within timeout seconds (timeout=0 tries once without waiting).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock_file:
+        if fcntl is None:
+            yield True
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    yield False
+                    return
+                time.sleep(0.05)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 
 class SummaryImageGenerator:
-    
+    """
+    Render the summary PNG only when its inputs change.
+
+    Images are content-addressed (cache/summary-<hash>.png) and written
+    atomically; cache/summary.json points at the current one together with
+    the inputs it was rendered from. Other formats and widths are derived
+    from those inputs on demand (see variant()).
+    """
+
+    MANIFEST_NAME = 'summary.json'
+    LOCK_NAME = 'summary.lock'
+    IMAGE_PREFIX = 'summary-'
+
+    BASE_WIDTH, BASE_HEIGHT = 600, 400
+    MIN_WIDTH, MAX_WIDTH = 100, 2400
+    CONTENT_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+    VARIANTS_DIR = 'summary-variants'
+
+    _fonts = {}
+    # (inputs digest, format, width) -> {'body', 'etag'}; spills to disk under VARIANTS_DIR
+    _variants = LRUCache(maxsize=32)
+    # (manifest path, mtime_ns) -> parsed manifest, so serving costs one stat()
+    _manifest_cache = (None, None)
+    # image path -> (mtime_ns, bytes)
+    _bytes_cache = {}
+    _bytes_lock = threading.Lock()
+
+    @classmethod
+    def fonts(cls, scale=1.0):
+        """(large, medium, small) fonts for a scale, loaded once per process"""
+        sizes = tuple(max(1, round(size * scale)) for size in (24, 18, 14))
+        if sizes not in cls._fonts:
+            try:
+                cls._fonts[sizes] = tuple(ImageFont.truetype("arial.ttf", size) for size in sizes)
+            except OSError:
+                if scale == 1.0:
+                    default = ImageFont.load_default()
+                    cls._fonts[sizes] = (default, default, default)
+                else:
+                    cls._fonts[sizes] = tuple(ImageFont.load_default(size=size) for size in sizes)
+        return cls._fonts[sizes]
+
+    @staticmethod
+    def summary_inputs():
+        """Everything the image shows: total count, top 5 by GDP and last refresh time"""
+        stats = CountryStats.current()
+        return {
+            'total_countries': stats.total_countries,
+            'top_countries': [[entry['name'], entry['estimated_gdp']] for entry in stats.top_by_gdp[:5]],
+            'last_refreshed_at': stats.last_refreshed_at.isoformat() if stats.last_refreshed_at else None,
+        }
+
     @staticmethod
-    def generate_summary_image():
-        """Generate and save summary image"""
+    def inputs_digest(inputs):
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def layout(inputs):
+        """Text lines of the summary as (x, y, text, colour, font index) on the 600x400 canvas"""
+        lines = [
+            (20, 15, "Countries Summary", (255, 255, 255), 0),
+            (20, 70, f"Total Countries: {inputs['total_countries']}", (0, 0, 0), 1),
+            (20, 110, "Top 5 Countries by Estimated GDP:", (0, 0, 0), 1),
+        ]
+
+        y_position = 140
+        for i, (name, gdp) in enumerate(inputs['top_countries'], 1):
+            gdp_str = f"${float(gdp):,.2f}" if float(gdp) else "N/A"
+            lines.append((40, y_position, f"{i}. {name}: {gdp_str}", (0, 100, 0), 2))
+            y_position += 25
+
+        if inputs['last_refreshed_at']:
+            refresh_time = Country._meta.get_field('last_refreshed_at').to_python(inputs['last_refreshed_at'])
+            lines.append((
+                20, y_position + 20,
+                f"Last Updated: {refresh_time.strftime('%Y-%m-%d %H:%M:%S UTC')}",
+                (128, 128, 128), 2,
+            ))
+        return lines
+
+    @classmethod
+    def render(cls, inputs, width=BASE_WIDTH, image_format='png'):
+        """Draw the summary for inputs at the given width; returns PNG or WebP bytes"""
+        scale = width / cls.BASE_WIDTH
+        img_width, img_height = width, round(cls.BASE_HEIGHT * scale)
+        image = Image.new('RGB', (img_width, img_height), color=(240, 240, 240))
+        draw = ImageDraw.Draw(image)
+        fonts = cls.fonts(scale)
+
+        # Title background
+        draw.rectangle([0, 0, img_width, round(50 * scale)], fill=(70, 130, 180))
+
+        for x, y, text, colour, font_index in cls.layout(inputs):
+            draw.text((round(x * scale), round(y * scale)), text, fill=colour, font=fonts[font_index])
+
+        # Add border
+        draw.rectangle([0, 0, img_width-1, img_height-1], outline='gray', width=max(1, round(2 * scale)))
+
+        buffer = io.BytesIO()
+        if image_format == 'webp':
+            image.save(buffer, format='WEBP', lossless=True, method=6)
+        else:
+            # Few distinct colours: a palette PNG is several times smaller
+            image.quantize(colors=256).save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+    @classmethod
+    def render_svg(cls, inputs, width=BASE_WIDTH):
+        """The summary as SVG, built straight from the inputs (no Pillow)"""
+        height = round(cls.BASE_HEIGHT * width / cls.BASE_WIDTH)
+        font_sizes = (24, 18, 14)
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {cls.BASE_WIDTH} {cls.BASE_HEIGHT}" font-family="Arial, sans-serif">',
+            f'<rect width="{cls.BASE_WIDTH}" height="{cls.BASE_HEIGHT}" fill="rgb(240,240,240)" '
+            f'stroke="gray" stroke-width="2"/>',
+            f'<rect width="{cls.BASE_WIDTH}" height="50" fill="rgb(70,130,180)"/>',
+        ]
+        for x, y, text, (r, g, b), font_index in cls.layout(inputs):
+            size = font_sizes[font_index]
+            # Pillow positions text by its top; SVG by the baseline
+            parts.append(
+                f'<text x="{x}" y="{y + size}" font-size="{size}" fill="rgb({r},{g},{b})">{escape(text)}</text>'
+            )
+        parts.append('</svg>')
+        return ''.join(parts).encode('utf-8')
+
+    @staticmethod
+    def write_atomic(path, content):
+        """Write through a temp file and rename, so readers never see a partial file"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def manifest_path(cls):
+        return os.path.join(settings.CACHE_DIR, cls.MANIFEST_NAME)
+
+    @classmethod
+    def lock_path(cls):
+        return os.path.join(settings.CACHE_DIR, cls.LOCK_NAME)
+
+    @classmethod
+    def current_image(cls):
+        """
+        Manifest of the current image ({'path', 'etag', 'inputs_digest',
+        'inputs'}), or None when no rendered image is available.
+        """
+        manifest_path = cls.manifest_path()
+        try:
+            mtime_ns = os.stat(manifest_path).st_mtime_ns
+        except OSError:
+            return None
+
+        cached_key, cached_manifest = cls._manifest_cache
+        if cached_key == (manifest_path, mtime_ns):
+            return cached_manifest
+
         try:
-            print("=== IMAGE GENERATION STARTED ===")
-            
-            # Get data for image
-            total_countries = Country.objects.count()
-            print(f"Total countries: {total_countries}")
-            
-            top_countries = Country.objects.exclude(estimated_gdp__isnull=True).order_by('-estimated_gdp')[:5]
-            print(f"Top countries found: {top_countries.count()}")
-            
-            last_country = Country.objects.order_by('-last_refreshed_at').first()
-            print(f"Last country: {last_country}")
-            
-            # Create image
-            img_width, img_height = 600, 400
-            image = Image.new('RGB', (img_width, img_height), color=(240, 240, 240))
-            draw = ImageDraw.Draw(image)
-            
-            # Try to use fonts (fallback to default if not available)
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            path = os.path.join(settings.CACHE_DIR, manifest['file'])
+        except (OSError, ValueError, KeyError):
+            return None
+        if not os.path.exists(path):
+            return None
+
+        image = {
+            'path': path,
+            'etag': manifest['etag'],
+            'inputs_digest': manifest['inputs_digest'],
+            'inputs': manifest['inputs'],
+        }
+        cls._manifest_cache = ((manifest_path, mtime_ns), image)
+        return image
+
+    @classmethod
+    def image_bytes(cls, path):
+        """Contents of an image file, cached in memory until its mtime changes"""
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = cls._bytes_cache.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        with open(path, 'rb') as f:
+            body = f.read()
+        with cls._bytes_lock:
+            # Content-addressed files never change, so keep only the latest
+            cls._bytes_cache = {path: (mtime_ns, body)}
+        return body
+
+    @classmethod
+    def ensure_image(cls, wait=5.0):
+        """
+        Return the current image, rendering it if there is none.
+
+        Only one process renders at a time (cross-process file lock); the
+        others wait up to `wait` seconds for it and then raise ImageNotReady.
+        Returns None if rendering failed.
+        """
+        image = cls.current_image()
+        if image is not None:
+            return image
+
+        with file_lock(cls.lock_path(), timeout=wait) as acquired:
+            if not acquired:
+                raise ImageNotReady()
+            # Whoever held the lock before us has probably rendered it already
+            image = cls.current_image()
+            if image is None:
+                cls._generate_locked()
+                image = cls.current_image()
+        return image
+
+    @classmethod
+    def remove_stale_images(cls, keep, inputs_digest):
+        """Delete images and variants that belong to older inputs"""
+        stale = [
+            os.path.join(settings.CACHE_DIR, filename)
+            for filename in os.listdir(settings.CACHE_DIR)
+            if filename.startswith(cls.IMAGE_PREFIX) and filename.endswith('.png') and filename != keep
+        ]
+        variants_dir = os.path.join(settings.CACHE_DIR, cls.VARIANTS_DIR)
+        if os.path.isdir(variants_dir):
+            stale.extend(
+                os.path.join(variants_dir, filename)
+                for filename in os.listdir(variants_dir)
+                if not filename.startswith(inputs_digest)
+            )
+        for path in stale:
             try:
-                font_large = ImageFont.truetype("arial.ttf", 24)
-                font_medium = ImageFont.truetype("arial.ttf", 18)
-                font_small = ImageFont.truetype("arial.ttf", 14)
-                print("Using Arial font")
-            except:
-                font_large = ImageFont.load_default()
-                font_medium = ImageFont.load_default()
-                font_small = ImageFont.load_default()
-                print("Using default font")
-            
-            # Draw title with background
-            draw.rectangle([0, 0, img_width, 50], fill=(70, 130, 180))
-            draw.text((20, 15), "Countries Summary", fill='white', font=font_large)
-            
-            # Draw total countries
-            draw.text((20, 70), f"Total Countries: {total_countries}", fill='black', font=font_medium)
-            
-            # Draw top 5 countries by GDP
-            draw.text((20, 110), "Top 5 Countries by Estimated GDP:", fill='black', font=font_medium)
-            
-            y_position = 140
-            for i, country in enumerate(top_countries, 1):
-                gdp_str = f"${country.estimated_gdp:,.2f}" if country.estimated_gdp else "N/A"
-                text = f"{i}. {country.name}: {gdp_str}"
-                draw.text((40, y_position), text, fill=(0, 100, 0), font=font_small)
-                y_position += 25
-                print(f"Added country to image: {country.name}")
-            
-            # Draw last refresh time
-            if last_country:
-                refresh_time = last_country.last_refreshed_at.strftime("%Y-%m-%d %H:%M:%S UTC")
-                draw.text((20, y_position + 20), f"Last Updated: {refresh_time}", fill='gray', font=font_small)
-            
-            # Add border
-            draw.rectangle([0, 0, img_width-1, img_height-1], outline='gray', width=2)
-            
-            # Save image
-            image_path = os.path.join(settings.CACHE_DIR, 'summary.png')
-            print(f"Saving image to: {image_path}")
-            
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(image_path), exist_ok=True)
-            
-            image.save(image_path)
-            print("=== IMAGE GENERATION COMPLETED SUCCESSFULLY ===")
-            
+                os.remove(path)
+            except OSError:
+                pass
+
+    @classmethod
+    def variant(cls, image, image_format, width):
+        """
+        The current image rendered as image_format at width: {'body', 'etag'}.
+
+        Each variant is rendered once per set of inputs, kept in a bounded
+        in-process LRU and spilled to disk so other workers can reuse it.
+        """
+        key = (image['inputs_digest'], image_format, width)
+        entry = cls._variants.get(key)
+        if entry is not None:
+            return entry
+
+        path = os.path.join(
+            settings.CACHE_DIR, cls.VARIANTS_DIR, f"{image['inputs_digest']}-{width}.{image_format}"
+        )
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            with span('image.variant'):
+                if image_format == 'svg':
+                    body = cls.render_svg(image['inputs'], width)
+                else:
+                    body = cls.render(image['inputs'], width, image_format)
+            cls.write_atomic(path, body)
+
+        entry = {'body': body, 'etag': hashlib.sha1(body).hexdigest()[:16]}
+        cls._variants.set(key, entry)
+        return entry
+
+    @classmethod
+    def generate_summary_image(cls, force=False, wait=60.0):
+        """Render the summary image if its inputs changed; returns its path or None on failure"""
+        with file_lock(cls.lock_path(), timeout=wait) as acquired:
+            if not acquired:
+                logger.warning("Summary image lock not acquired within %ss; skipping render", wait)
+                return None
+            return cls._generate_locked(force=force)
+
+    @classmethod
+    def _generate_locked(cls, force=False):
+        try:
+            inputs = cls.summary_inputs()
+            digest = cls.inputs_digest(inputs)
+
+            current = cls.current_image()
+            if current and current['inputs_digest'] == digest and not force:
+                logger.debug("Summary image is up to date (%s)", current['etag'])
+                return current['path']
+
+            with span('image.render'):
+                body = cls.render(inputs)
+            content_hash = hashlib.sha1(body).hexdigest()[:16]
+            filename = f'{cls.IMAGE_PREFIX}{content_hash}.png'
+            image_path = os.path.join(settings.CACHE_DIR, filename)
+
+            cls.write_atomic(image_path, body)
+            cls.write_atomic(cls.manifest_path(), json.dumps({
+                'file': filename,
+                'etag': content_hash,
+                'inputs_digest': digest,
+                'inputs': inputs,
+            }).encode())
+            cls.remove_stale_images(keep=filename, inputs_digest=digest)
+
+            logger.info("Summary image rendered to %s", image_path)
             return image_path
-            
-        except Exception as e:
-            print(f"=== IMAGE GENERATION FAILED: {e} ===")
-            import traceback
-            print(f"Error details: {traceback.format_exc()}")
-            return None
\ No newline at end of file
+
+        except Exception:
+            logger.exception("Summary image generation failed")
+            return None
@@ -0,0 +1,145 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import RefreshJob
+from .refresh_service import RefreshService
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshJobRunner:
+    """
+    Run refreshes in a background thread, tracked in the refresh_jobs table.
+
+    Only one job can be queued or running at a time across all worker
+    processes (enforced by the single_active_refresh_job constraint);
+    a refresh requested while one is in flight is merged into it.
+    """
+
+    # A running job without a heartbeat for this long, or a job still
+    # queued this long after it was created, belongs to a dead process
+    STALE_AFTER = timedelta(minutes=10)
+    HEARTBEAT_INTERVAL = 30  # seconds
+
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='refresh-job')
+
+    @classmethod
+    def expire_stale_jobs(cls) -> None:
+        cutoff = timezone.now() - cls.STALE_AFTER
+        RefreshJob.objects.filter(
+            Q(started_at__isnull=True, created_at__lt=cutoff) | Q(heartbeat_at__lt=cutoff),
+            is_active=True,
+        ).update(
+            is_active=False,
+            status=RefreshJob.STATUS_FAILED,
+            error='Abandoned: the worker running this job went away',
+            finished_at=timezone.now(),
+        )
+
+    @classmethod
+    def submit(cls, force: bool = False, prune: bool = False) -> Tuple[RefreshJob, bool]:
+        """Queue a refresh, or return the job already in flight. Returns (job, created)"""
+        cls.expire_stale_jobs()
+
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    job = RefreshJob.objects.create(options={'force': force, 'prune': prune})
+            except IntegrityError:
+                job = RefreshJob.objects.filter(is_active=True).first()
+                if job is not None:
+                    return job, False
+                # The active job finished between our insert and lookup
+                continue
+
+            if getattr(settings, 'REFRESH_JOBS_INLINE', False):
+                cls.run(job.pk)
+                job.refresh_from_db()
+            else:
+                transaction.on_commit(lambda: cls._executor.submit(cls.run_in_thread, job.pk))
+            return job, True
+
+        raise RuntimeError('Could not acquire the refresh job lock')
+
+    @classmethod
+    def run_in_thread(cls, job_id: int) -> None:
+        try:
+            cls.run(job_id)
+        finally:
+            # Threads get their own connections; don't leak them
+            connections.close_all()
+
+    @classmethod
+    @contextmanager
+    def heartbeat(cls, job_id: int):
+        """Touch the job's heartbeat_at every HEARTBEAT_INTERVAL from a side thread while the block runs"""
+        stop = threading.Event()
+
+        def beat() -> None:
+            try:
+                while not stop.wait(cls.HEARTBEAT_INTERVAL):
+                    try:
+                        RefreshJob.objects.filter(pk=job_id, is_active=True).update(heartbeat_at=timezone.now())
+                    except DatabaseError as e:
+                        # e.g. SQLite busy with the refresh's own write; the next beat retries
+                        logger.debug("Refresh job %s heartbeat failed: %s", job_id, e)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=beat, name=f'refresh-job-{job_id}-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    @classmethod
+    def run(cls, job_id: int) -> None:
+        job = RefreshJob.objects.get(pk=job_id)
+        now = timezone.now()
+        RefreshJob.objects.filter(pk=job_id).update(
+            status=RefreshJob.STATUS_RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+        )
+
+        def progress(stage: str, percent: int) -> None:
+            RefreshJob.objects.filter(pk=job_id).update(stage=stage, progress=percent, heartbeat_at=timezone.now())
+
+        try:
+            with cls.heartbeat(job_id):
+                result = RefreshService.run_refresh(
+                    force=job.options.get('force', False),
+                    prune=job.options.get('prune', False),
+                    progress=progress,
+                )
+        except Exception as e:
+            logger.exception("Refresh job %s failed", job_id)
+            RefreshJob.objects.filter(pk=job_id).update(
+                status=RefreshJob.STATUS_FAILED,
+                is_active=False,
+                error=str(e),
+                finished_at=timezone.now(),
+            )
+            return
+
+        timings = result.pop('timings', {})
+        RefreshJob.objects.filter(pk=job_id).update(
+            status=RefreshJob.STATUS_SUCCEEDED,
+            is_active=False,
+            stage='done',
+            progress=100,
+            result=result,
+            timings=timings,
+            finished_at=timezone.now(),
+        )
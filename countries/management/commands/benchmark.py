@@ -0,0 +1,142 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from countries import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks against the configured database (changes are rolled back)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=['refresh', 'list', 'serialize', 'server', 'api'])
+        parser.add_argument('--countries', type=int,
+                            help='Number of synthetic countries (default: 250; serialize: 250 and 25000)')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests per run (list and server suites) or per scenario (api suite)')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients (server suite)')
+        parser.add_argument('--workers', type=int, default=3, help='gunicorn workers per server (server suite)')
+        parser.add_argument('--limit', type=int, help='Page size for the list requests (api suite; default: no paging)')
+        parser.add_argument('--recording', help='Recording to replay for the refresh scenarios (api suite; '
+                                                'default: the synthetic countries)')
+        parser.add_argument('--save', metavar='PATH', help='Write the api report to PATH as JSON')
+        parser.add_argument('--compare', metavar='PATH', help='Compare the api report with a saved one')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Relative change counted as a regression when comparing (default: 0.1)')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error when the comparison finds a regression')
+    
+    def handle(self, *args, **options):
+        # serialize renders every default size unless --countries picks one
+        if options['countries'] is None:
+            serialize_sizes = benchmarks.SERIALIZATION_SIZES
+            options['countries'] = 250
+        else:
+            serialize_sizes = (options['countries'],)
+
+        if options['suite'] == 'refresh':
+            results = benchmarks.benchmark_refresh(options['countries'])
+            self.stdout.write(f"{'path':<8} {'phase':<10} {'countries':>9} {'queries':>8} {'seconds':>9}")
+            for row in results:
+                self.stdout.write(
+                    f"{row['path']:<8} {row['phase']:<10} {row['countries']:>9} "
+                    f"{row['queries']:>8} {row['seconds']:>9.3f}"
+                )
+
+        elif options['suite'] == 'list':
+            results = benchmarks.benchmark_list(options['countries'], options['requests'])
+            self.stdout.write(f"{'cache':<6} {'countries':>9} {'requests':>8} {'seconds':>9} {'req/s':>9}")
+            for row in results:
+                self.stdout.write(
+                    f"{row['cache']:<6} {row['countries']:>9} {row['requests']:>8} "
+                    f"{row['seconds']:>9.3f} {row['requests_per_second']:>9.1f}"
+                )
+
+        elif options['suite'] == 'serialize':
+            results = benchmarks.benchmark_serialization(serialize_sizes)
+            self.stdout.write(f"{'path':<16} {'countries':>9} {'seconds':>9} {'bytes':>10}")
+            for row in results:
+                self.stdout.write(
+                    f"{row['path']:<16} {row['countries']:>9} {row['seconds']:>9.4f} {row['bytes']:>10}"
+                )
+
+        elif options['suite'] == 'server':
+            results = benchmarks.benchmark_servers(
+                requests=options['requests'], concurrency=options['concurrency'], workers=options['workers']
+            )
+            self.stdout.write(
+                f"{'mode':<5} {'path':<40} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}"
+            )
+            for row in results:
+                self.stdout.write(
+                    f"{row['mode']:<5} {row['path']:<40} {row['requests']:>8} {row['errors']:>6} "
+                    f"{row['requests_per_second']:>9.1f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}"
+                )
+
+        elif options['suite'] == 'api':
+            self.handle_api(options)
+
+    def handle_api(self, options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read baseline {options['compare']}: {e}")
+
+        report = benchmarks.benchmark_api(
+            options['countries'], options['requests'], options['limit'], options['recording']
+        )
+        endpoints = [row for row in report['results'] if 'requests_per_second' in row]
+        refreshes = [row for row in report['results'] if 'requests_per_second' not in row]
+
+        self.stdout.write(
+            f"{'scenario':<62} {'req/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+            f"{'queries':>7} {'peak KiB':>9} {'errors':>6}"
+        )
+        for row in endpoints:
+            self.stdout.write(
+                f"{row['scenario']:<62} {row['requests_per_second']:>9.1f} {row['p50_ms']:>8.2f} "
+                f"{row['p90_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['queries']:>7.2f} "
+                f"{row['peak_kb']:>9.0f} {row['errors']:>6}"
+            )
+        self.stdout.write('')
+        self.stdout.write(
+            f"{'scenario':<18} {'countries':>9} {'seconds':>8} {'fetch':>7} {'upsert':>7} {'render':>7} "
+            f"{'queries':>7} {'peak KiB':>9}"
+        )
+        for row in refreshes:
+            self.stdout.write(
+                f"{row['scenario']:<18} {row['countries']:>9} {row['seconds']:>8.3f} "
+                f"{row.get('fetch_seconds', 0):>7.3f} {row.get('upsert_seconds', 0):>7.3f} "
+                f"{row.get('render_seconds', 0):>7.3f} {row['queries']:>7} {row['peak_kb']:>9.0f}"
+            )
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved report to {options['save']}"))
+
+        if baseline is not None:
+            self.compare(baseline, report, options)
+
+    def compare(self, baseline, report, options):
+        for key in ('countries', 'requests', 'limit', 'database', 'settings'):
+            if baseline.get(key) != report.get(key):
+                self.stdout.write(self.style.WARNING(
+                    f"Baseline {key} differs: {baseline.get(key)!r} vs {report.get(key)!r}"
+                ))
+
+        changes = benchmarks.compare_reports(baseline, report, options['tolerance'])
+        self.stdout.write('')
+        self.stdout.write(f"{'scenario':<62} {'metric':<20} {'before':>10} {'after':>10} {'change':>8}")
+        for change in changes:
+            line = (
+                f"{change['scenario']:<62} {change['metric']:<20} {change['before']:>10.2f} "
+                f"{change['after']:>10.2f} {change['change']:>+8.1%}"
+            )
+            self.stdout.write(self.style.ERROR(line) if change['regressed'] else line)
+
+        regressions = sum(change['regressed'] for change in changes)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{regressions} regressions beyond {options['tolerance']:.0%}")
+        self.stdout.write(f"{regressions} regressions beyond {options['tolerance']:.0%}")
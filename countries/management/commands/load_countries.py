@@ -1,61 +1,46 @@
-import requests
-from django.core.management.base import BaseCommand
-from countries.models import Country
+import time
+from django.core.management.base import BaseCommand, CommandError
+from countries.refresh_service import RefreshService
+from countries.seed_service import SeedService
 
 class Command(BaseCommand):
-    help = 'Load countries data from REST Countries API'
-    
+    help = 'Bootstrap countries from the bundled snapshot, or from the live APIs with --live'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--live', action='store_true',
+                            help='Run a full refresh against the upstream APIs, using the snapshot if they fail')
+        parser.add_argument('--force', action='store_true',
+                            help='Load even when the database is already at the snapshot version')
+        parser.add_argument('--path', help='Snapshot file (default: settings.COUNTRIES_SEED_PATH)')
+
     def handle(self, *args, **options):
-        self.stdout.write('Loading countries data from REST Countries API...')
-        
-        url = "https://restcountries.com/v3.1/all"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            countries_data = response.json()
-            
-            # Simple exchange rates fallback
-            exchange_rates = {
-                'USD': 1.0, 'EUR': 0.93, 'GBP': 0.80, 'JPY': 150.0, 
-                'CAD': 1.35, 'AUD': 1.55, 'CHF': 0.88, 'CNY': 7.25,
-                'INR': 83.0, 'BRL': 5.05, 'ZAR': 18.5, 'RUB': 92.0,
-                'MXN': 17.0, 'SGD': 1.35, 'NZD': 1.65, 'SEK': 10.5,
-                'NOK': 10.8, 'DKK': 6.95, 'TRY': 32.0, 'KRW': 1330.0
-            }
-            
-            for country_data in countries_data:
-                name = country_data.get('name', {}).get('common', 'Unknown')
-                
-                # Get primary currency
-                currencies = list(country_data.get('currencies', {}).keys())
-                primary_currency = currencies[0] if currencies else 'USD'
-                
-                # Calculate GDP (using your existing logic)
-                population = country_data.get('population', 0)
-                gdp_per_capita = 1500  # Your random range logic
-                exchange_rate = exchange_rates.get(primary_currency, 1.0)
-                gdp = (population * gdp_per_capita) / exchange_rate
-                
-                # Create or update country
-                Country.objects.update_or_create(
-                    name=name,
-                    defaults={
-                        'population': population,
-                        'area': country_data.get('area', 0),
-                        'region': country_data.get('region', ''),
-                        'subregion': country_data.get('subregion', ''),
-                        'capital': country_data.get('capital', [''])[0] if country_data.get('capital') else '',
-                        'currencies': currencies,
-                        'languages': list(country_data.get('languages', {}).values()),
-                        'borders': country_data.get('borders', []),
-                        'gdp': gdp,
-                    }
-                )
-            
-            self.stdout.write(
-                self.style.SUCCESS(f'Successfully loaded {len(countries_data)} countries')
+        started = time.perf_counter()
+
+        if options['live']:
+            self.stdout.write('Refreshing countries from the upstream APIs...')
+            try:
+                result = RefreshService.run_refresh(force=options['force'])
+                self._report(result, started)
+                return
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f'Live refresh failed ({e}); loading the bundled snapshot'))
+
+        try:
+            result = SeedService.load(options['path'], force=options['force'] or options['live'])
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Could not read countries snapshot: {e}')
+
+        if result is None:
+            self.stdout.write(self.style.SUCCESS('Countries already up to date with the bundled snapshot'))
+            return
+        self._report(result, started)
+
+    def _report(self, result, started):
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Loaded {result['countries_processed']} countries "
+                f"(new={result['countries_new']}, changed={result['countries_changed']}, "
+                f"unchanged={result['countries_unchanged']}, errors={result['countries_with_errors']}) "
+                f"in {time.perf_counter() - started:.2f}s"
             )
-        else:
-            self.stdout.write(
-                self.style.ERROR('Failed to fetch countries data')
-            )
\ No newline at end of file
+        )
@@ -0,0 +1,69 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from countries import sources
+from countries.refresh_service import RefreshService
+
+
+class Command(BaseCommand):
+    help = 'Record, replay or serve upstream data for offline refreshes'
+
+    def add_arguments(self, parser):
+        subcommands = parser.add_subparsers(dest='action', required=True)
+
+        record = subcommands.add_parser('record', help='Capture the upstream APIs into a recording')
+        record.add_argument('--output', help='Recording file (default: the last good recording)')
+        record.add_argument('--source', choices=['live', 'stub'], default='live')
+
+        replay = subcommands.add_parser('replay', help='Run a refresh from a recording, without network')
+        replay.add_argument('--input', help='Recording file (default: the last good recording)')
+        replay.add_argument('--prune', action='store_true', help='Delete countries missing from the recording')
+
+        serve = subcommands.add_parser('serve', help='Serve a recording as a local stub of the upstream APIs')
+        serve.add_argument('--input', help='Recording file (default: the last good recording)')
+        serve.add_argument('--host', default='127.0.0.1')
+        serve.add_argument('--port', type=int, default=8001)
+
+    def handle(self, *args, **options):
+        getattr(self, f"handle_{options['action']}")(options)
+
+    def handle_record(self, options):
+        path = options['output'] or sources.last_good_path()
+        started = time.perf_counter()
+        try:
+            count = sources.record(path, options['source'])
+        except Exception as e:
+            raise CommandError(f'Could not record upstream data: {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Recorded {count} countries to {path} in {time.perf_counter() - started:.2f}s'
+        ))
+
+    def handle_replay(self, options):
+        source = sources.RecordingSource(options['input'])
+        try:
+            result = RefreshService.run_refresh(force=True, prune=options['prune'], source=source)
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Could not replay {source.path}: {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {result['countries_processed']} countries from {source.path} "
+            f"(new={result['countries_new']}, changed={result['countries_changed']}, "
+            f"unchanged={result['countries_unchanged']}, removed={result['countries_removed']}, "
+            f"errors={result['countries_with_errors']})"
+        ))
+
+    def handle_serve(self, options):
+        path = options['input'] or sources.last_good_path()
+        try:
+            server = sources.StubUpstreamServer((options['host'], options['port']), path)
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Could not serve {path}: {e}')
+        host, port = server.server_address[:2]
+        self.stdout.write(
+            f'Serving {path} at http://{host}:{port}/countries and /rates '
+            f'(set UPSTREAM_SOURCE=stub UPSTREAM_STUB_URL=http://{host}:{port}); Ctrl-C to stop'
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
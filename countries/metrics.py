@@ -0,0 +1,296 @@
+"""
+In-process metrics in the Prometheus text format, served at GET /metrics.
+
+- countries_request_duration_seconds / countries_request_queries:
+  per-route latency and database query histograms (MetricsMiddleware)
+- countries_span_duration_seconds: timed stages (span()), e.g. the
+  refresh fetch/upsert/render stages and image rendering
+
+Every worker process keeps its own numbers; Prometheus scrapes whichever
+worker answers, so compare rates, not absolute totals, across scrapes.
+All of it is off unless METRICS_ENABLED is set, and the endpoints only
+answer requests with the METRICS_TOKEN bearer token or from
+METRICS_ALLOWED_IPS.
+
+With PROFILER_ENABLED=true each worker also runs a sampling profiler
+(SamplingProfiler) whose folded stacks are served at GET /metrics/profile.
+"""
+import hmac
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label values tuple"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def collect(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for label_values, values in series:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}'
+            braces = f'{{{labels}}}' if labels else ''
+            yield f'{self.name}_sum{braces} {values[-1]!r}'
+            yield f'{self.name}_count{braces} {cumulative}'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram(
+    'countries_request_duration_seconds', 'Time spent serving a request.',
+    ('method', 'route', 'status'), LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    'countries_request_queries', 'Database queries run while serving a request (sync views).',
+    ('method', 'route'), QUERY_BUCKETS,
+)
+SPAN_DURATION = Histogram(
+    'countries_span_duration_seconds', 'Time spent in an instrumented stage.',
+    ('span',), LATENCY_BUCKETS,
+)
+REGISTRY = (REQUEST_DURATION, REQUEST_QUERIES, SPAN_DURATION)
+
+
+@contextmanager
+def span(name: str):
+    """Time a block into countries_span_duration_seconds{span=name}"""
+    if not settings.METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_DURATION.observe(elapsed, name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("span %s took %.1fms", name, elapsed * 1000)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+class QueryCounter:
+    """execute_wrapper that only counts round trips"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _route(request) -> str:
+    """The matched URL pattern, so /countries/Ghana and /countries/Togo share a series"""
+    match = getattr(request, 'resolver_match', None)
+    return f'/{match.route}' if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Record latency (and, for sync views, query counts) per route.
+
+    Runs natively in both WSGI and ASGI mode, so it adds no thread switch
+    of its own; the async views only avoid one if every other middleware is
+    async-capable too (hence no WhiteNoise under ASGI, see settings). Under
+    ASGI the ORM runs queries on another thread, where this middleware
+    cannot count them.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        profiler()  # no-op unless PROFILER_ENABLED
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, counter.count)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def record(request, response, elapsed: float, queries: Optional[int] = None) -> None:
+        route = _route(request)
+        REQUEST_DURATION.observe(elapsed, request.method, route, str(response.status_code))
+        if queries is not None:
+            REQUEST_QUERIES.observe(queries, request.method, route)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a daemon thread records the stack of every other
+    thread each interval; stacks are reported folded ("a;b;c count"), the
+    input format of flamegraph tools.
+    """
+
+    MAX_DEPTH = 64
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._samples_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename}:{frame.f_lineno})')
+                    frame = frame.f_back
+                with self._samples_lock:
+                    self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self, reset: bool = False) -> str:
+        with self._samples_lock:
+            samples = self.samples.copy()
+            if reset:
+                self.samples.clear()
+        return ''.join(f'{stack} {count}\n' for stack, count in samples.most_common())
+
+
+_profiler: Optional[SamplingProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def profiler() -> Optional[SamplingProfiler]:
+    """This worker's profiler, started with the first request when PROFILER_ENABLED is set"""
+    global _profiler
+    if not settings.PROFILER_ENABLED:
+        return None
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = SamplingProfiler(settings.PROFILER_INTERVAL)
+                _profiler.start()
+    return _profiler
+
+
+def is_authorized(request) -> bool:
+    """The METRICS_TOKEN bearer token, or a request from one of METRICS_ALLOWED_IPS"""
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+@require_GET
+def metrics_view(request):
+    """GET /metrics: this worker's metrics in the Prometheus text format"""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if not is_authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@csrf_exempt  # token or address authenticated, no cookies involved
+@require_http_methods(['GET', 'POST'])
+def profile_view(request):
+    """
+    GET /metrics/profile: folded stacks sampled by this worker so far;
+    POST returns them and starts over.
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    sampler = profiler()
+    if sampler is None:
+        raise Http404
+    if not is_authorized(request):
+        return HttpResponseForbidden()
+    body = sampler.folded(reset=request.method == 'POST')
+    return HttpResponse(body, content_type='text/plain; charset=utf-8')
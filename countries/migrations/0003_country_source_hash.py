@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0002_alter_country_population'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='country',
+            name='source_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:23
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0004_refreshjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='countries_upper_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(django.db.models.functions.text.Upper('region'), models.F('name'), name='countries_upper_region_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(django.db.models.functions.text.Upper('currency_code'), models.F('name'), name='countries_upper_currency_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(fields=['estimated_gdp', 'id'], name='countries_gdp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(fields=['population', 'id'], name='countries_population_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(fields=['last_refreshed_at'], name='countries_refreshed_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0005_country_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_countries', models.PositiveIntegerField(default=0)),
+                ('total_population', models.BigIntegerField(default=0)),
+                ('total_estimated_gdp', models.DecimalField(decimal_places=2, default=0, max_digits=40)),
+                ('last_refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('top_by_gdp', models.JSONField(default=list)),
+                ('top_by_population', models.JSONField(default=list)),
+                ('regions', models.JSONField(default=dict)),
+                ('currencies', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'country stats',
+                'db_table': 'country_stats',
+            },
+        ),
+    ]
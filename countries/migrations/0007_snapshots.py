@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0006_countrystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Snapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('total_countries', models.PositiveIntegerField(default=0)),
+                ('changed_countries', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'snapshots',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country_id', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=100)),
+                ('currency_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('population', models.BigIntegerField(default=0)),
+                ('exchange_rate', models.DecimalField(blank=True, decimal_places=6, max_digits=20, null=True)),
+                ('estimated_gdp', models.DecimalField(blank=True, decimal_places=2, max_digits=30, null=True)),
+                ('removed', models.BooleanField(default=False)),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='values', to='countries.snapshot')),
+            ],
+            options={
+                'db_table': 'snapshot_values',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='snapshotvalue',
+            constraint=models.UniqueConstraint(fields=('country_id', 'snapshot'), name='snapshot_value_country_uniq'),
+        ),
+    ]
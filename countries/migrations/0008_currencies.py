@@ -0,0 +1,84 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_primary_currencies(apps, schema_editor):
+    """Create a Currency per existing currency_code and link each country to it"""
+    Country = apps.get_model('countries', 'Country')
+    Currency = apps.get_model('countries', 'Currency')
+    CountryCurrency = apps.get_model('countries', 'CountryCurrency')
+
+    rows = list(
+        Country.objects.exclude(currency_code__isnull=True).exclude(currency_code='')
+        .values_list('pk', 'currency_code', 'exchange_rate')
+    )
+    rates = {}
+    for _, code, rate in rows:
+        rates.setdefault(code.upper(), rate)
+    Currency.objects.bulk_create([Currency(code=code, exchange_rate=rate) for code, rate in rates.items()])
+
+    currency_ids = dict(Currency.objects.values_list('code', 'pk'))
+    CountryCurrency.objects.bulk_create(
+        [CountryCurrency(country_id=pk, currency_id=currency_ids[code.upper()], position=0) for pk, code, _ in rows],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('countries', '0007_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountryCurrency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'country_currencies',
+            },
+        ),
+        migrations.CreateModel(
+            name='Currency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('exchange_rate', models.DecimalField(blank=True, decimal_places=6, max_digits=20, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'currencies',
+                'db_table': 'currencies',
+                'ordering': ['code'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='country',
+            name='countries_upper_currency_idx',
+        ),
+        migrations.AddField(
+            model_name='countrycurrency',
+            name='country',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='countries.country'),
+        ),
+        migrations.AddField(
+            model_name='countrycurrency',
+            name='currency',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='countries.currency'),
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='currencies',
+            field=models.ManyToManyField(blank=True, related_name='countries', through='countries.CountryCurrency', to='countries.currency'),
+        ),
+        migrations.AddConstraint(
+            model_name='countrycurrency',
+            constraint=models.UniqueConstraint(fields=('currency', 'country'), name='country_currency_uniq'),
+        ),
+        migrations.RunPython(link_primary_currencies, migrations.RunPython.noop),
+    ]
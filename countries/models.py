@@ -1,7 +1,96 @@
+from asgiref.sync import sync_to_async
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Upper
+from django.db.models.lookups import Exact
 from django.core.exceptions import ValidationError
-import random
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from operator import itemgetter
+from .gdp import compute_gdp_batch
+
+EXCHANGE_RATE_QUANTUM = Decimal('0.000001')
+
+
+def to_decimal(value):
+    """Decimal for value (floats go through str() as before), or None if it is not a number"""
+    if value is None or isinstance(value, Decimal):
+        return value
+    try:
+        return Decimal(value if isinstance(value, (int, str)) else str(value))
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+
+def quantize_exchange_rate(value):
+    """Exchange rate rounded to the column's 6 decimal places, or None if it is not a number"""
+    rate = to_decimal(value)
+    try:
+        return rate.quantize(EXCHANGE_RATE_QUANTUM, rounding=ROUND_HALF_UP)
+    except (AttributeError, ArithmeticError):
+        return None
+
+def assign_estimated_gdp(countries):
+    """Compute estimated_gdp for many (already prepared) countries in one batch"""
+    gdps = compute_gdp_batch(
+        [country.name for country in countries],
+        [country.population for country in countries],
+        [country.exchange_rate for country in countries],
+    )
+    for country, gdp in zip(countries, gdps):
+        country.estimated_gdp = gdp
+
+class CountryQuerySet(models.QuerySet):
+    
+    def iexact(self, field, value):
+        """
+        Case-insensitive match written as UPPER(field) = UPPER(value).
+        
+        Unlike __iexact (LIKE on SQLite) this matches the Upper() expression
+        indexes on Country, so it can use them on SQLite and PostgreSQL.
+        """
+        return self.filter(Exact(Upper(field), Upper(Value(value))))
+    
+    def bulk_create(self, objs, *args, prepare=True, **kwargs):
+        """
+        bulk_create that still computes estimated_gdp and rounds exchange_rate.
+        
+        Pass prepare=False when the objects already went through
+        Country.prepare_for_write (e.g. the refresh pipeline).
+        """
+        objs = list(objs)
+        if prepare:
+            for obj in objs:
+                obj.prepare_for_write(compute_gdp=False)
+            assign_estimated_gdp(objs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields and {'population', 'exchange_rate'} & set(update_fields):
+            kwargs['update_fields'] = list(dict.fromkeys([*update_fields, 'estimated_gdp']))
+        return super().bulk_create(objs, *args, **kwargs)
+    
+    def bulk_update(self, objs, fields, *args, prepare=True, **kwargs):
+        """bulk_update that keeps estimated_gdp in step with population and exchange_rate"""
+        objs = list(objs)
+        if prepare:
+            for obj in objs:
+                obj.prepare_for_write(compute_gdp=False)
+            assign_estimated_gdp(objs)
+        if {'population', 'exchange_rate'} & set(fields):
+            fields = list(dict.fromkeys([*fields, 'estimated_gdp']))
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
+class Currency(models.Model):
+    """One row per ISO currency code, holding its single USD-based rate"""
+    code = models.CharField(max_length=10, unique=True)  # always upper case
+    exchange_rate = models.DecimalField(max_digits=20, decimal_places=6, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'currencies'
+        ordering = ['code']
+        verbose_name_plural = 'currencies'
+    
+    def __str__(self):
+        return self.code
 
 class Country(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -13,10 +102,27 @@ class Country(models.Model):
     estimated_gdp = models.DecimalField(max_digits=30, decimal_places=2, blank=True, null=True)
     flag_url = models.URLField(blank=True, null=True)
     last_refreshed_at = models.DateTimeField(auto_now=True)
+    # Hash of the processed upstream fields, used to skip unchanged rows on refresh
+    source_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    # Every currency the country uses; currency_code/exchange_rate above
+    # mirror the primary one (position 0), which estimated_gdp is based on
+    currencies = models.ManyToManyField(Currency, through='CountryCurrency', related_name='countries', blank=True)
+    
+    objects = CountryQuerySet.as_manager()
     
     class Meta:
         db_table = 'countries'
         ordering = ['name']
+        indexes = [
+            # Case-insensitive lookups (CountryQuerySet.iexact)
+            models.Index(Upper('name'), name='countries_upper_name_idx'),
+            models.Index(Upper('region'), F('name'), name='countries_upper_region_idx'),
+            # Sort orders of GET /countries, with id as tie-breaker
+            models.Index(fields=['estimated_gdp', 'id'], name='countries_gdp_idx'),
+            models.Index(fields=['population', 'id'], name='countries_population_idx'),
+            # Latest refresh for /status and the summary image
+            models.Index(fields=['last_refreshed_at'], name='countries_refreshed_idx'),
+        ]
     
     def clean(self):
         errors = {}
@@ -28,46 +134,245 @@ class Country(models.Model):
             raise ValidationError(errors)
     
     def calculate_estimated_gdp(self):
-        """Calculate estimated GDP with proper decimal handling"""
-        if self.population and self.exchange_rate:
-            try:
-                random_multiplier = random.uniform(1000, 2000)
-                gdp = (self.population * random_multiplier) / float(self.exchange_rate)
-                
-                # Round to 2 decimal places properly
-                gdp_decimal = Decimal(str(gdp))
-                gdp_rounded = gdp_decimal.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                return gdp_rounded
-            except (TypeError, ZeroDivisionError, ValueError):
-                return None
-        return None
+        """Estimated GDP with a stable per-country multiplier (see countries.gdp)"""
+        exchange_rate = to_decimal(self.exchange_rate)
+        return compute_gdp_batch([self.name], [self.population], [exchange_rate])[0]
     
-    def save(self, *args, **kwargs):
-        # Ensure population has a value
+    def prepare_for_write(self, compute_gdp=True):
+        """
+        Normalise population, exchange_rate and estimated_gdp in one pass.
+        
+        Runs no queries, so bulk and refresh paths can call it per row.
+        Batch callers pass compute_gdp=False and fill estimated_gdp with
+        countries.gdp.compute_gdp_batch instead.
+        """
         if self.population is None:
             self.population = 0
-            
-        # Round exchange_rate to 6 decimal places if it exists
+        
         if self.exchange_rate is not None:
-            try:
-                exchange_decimal = Decimal(str(self.exchange_rate))
-                self.exchange_rate = exchange_decimal.quantize(Decimal('0.000001'), rounding=ROUND_HALF_UP)
-            except (TypeError, ValueError):
-                self.exchange_rate = None
-            
-        # Calculate estimated GDP
-        self.estimated_gdp = self.calculate_estimated_gdp()
+            self.exchange_rate = quantize_exchange_rate(self.exchange_rate)
+        
+        if compute_gdp:
+            self.estimated_gdp = self.calculate_estimated_gdp()
+    
+    def validate_for_write(self):
+        """
+        Single-pass validation for bulk and refresh writes, with no queries.
         
-        # Round estimated_gdp to 2 decimal places if it exists
-        if self.estimated_gdp is not None:
-            try:
-                gdp_decimal = Decimal(str(self.estimated_gdp))
-                self.estimated_gdp = gdp_decimal.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            except (TypeError, ValueError):
-                self.estimated_gdp = None
+        Checks lengths, decimal ranges, the flag URL scheme and clean(); it
+        skips the unique-name query and Django's full URL validator, so it is
+        only for paths that guarantee name uniqueness themselves.
+        """
+        errors = {}
+        for field in self._meta.concrete_fields:
+            value = getattr(self, field.attname)
+            if value is None:
+                continue
+            if isinstance(field, models.CharField) and field.max_length and len(value) > field.max_length:
+                errors[field.name] = f'Ensure this value has at most {field.max_length} characters'
+            elif isinstance(field, models.DecimalField):
+                limit = Decimal(10) ** (field.max_digits - field.decimal_places)
+                if not isinstance(value, Decimal) or abs(value) >= limit:
+                    errors[field.name] = f'Ensure this value is a number below {limit}'
         
+        if self.flag_url and not self.flag_url.startswith(('http://', 'https://')):
+            errors['flag_url'] = 'Enter a valid URL.'
+        if errors:
+            raise ValidationError(errors)
+        self.clean()
+    
+    def save(self, *args, **kwargs):
+        # Interactive saves keep strict validation, including the unique check
+        self.prepare_for_write()
         self.full_clean()
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+class RefreshJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # True while queued or running; the partial unique constraint below makes
+    # this the cross-process lock that merges concurrent refresh requests
+    is_active = models.BooleanField(default=True)
+    stage = models.CharField(max_length=50, blank=True, default='')
+    progress = models.PositiveSmallIntegerField(default=0)
+    options = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+    timings = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Touched periodically while the job runs, so a slow refresh is not
+    # mistaken for one whose worker died
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        db_table = 'refresh_jobs'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['is_active'],
+                condition=models.Q(is_active=True),
+                name='single_active_refresh_job',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Refresh job {self.pk} ({self.status})"
+
+
+class CountryCurrency(models.Model):
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    currency = models.ForeignKey(Currency, on_delete=models.CASCADE)
+    # Order in the upstream payload; 0 is the primary currency
+    position = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'country_currencies'
+        constraints = [
+            # (currency, country) first: ?currency= joins from the currency side
+            models.UniqueConstraint(fields=['currency', 'country'], name='country_currency_uniq'),
+        ]
+
+
+class CountryStats(models.Model):
+    """
+    Materialized aggregates over the countries table (a single row).
+    
+    Writers call rebuild() inside the transaction that changes countries,
+    so /status, /stats and the summary image read one row instead of
+    scanning the table. GDP amounts are stored as decimal strings.
+    """
+    SINGLETON_ID = 1
+    TOP_N = 10
+    
+    total_countries = models.PositiveIntegerField(default=0)
+    total_population = models.BigIntegerField(default=0)
+    total_estimated_gdp = models.DecimalField(max_digits=40, decimal_places=2, default=0)
+    last_refreshed_at = models.DateTimeField(blank=True, null=True)
+    # [{'name', 'estimated_gdp'}] and [{'name', 'population'}], largest first
+    top_by_gdp = models.JSONField(default=list)
+    top_by_population = models.JSONField(default=list)
+    # region / currency code -> {'countries', 'population', 'estimated_gdp'}
+    regions = models.JSONField(default=dict)
+    currencies = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'country_stats'
+        verbose_name_plural = 'country stats'
+    
+    @classmethod
+    def rebuild(cls):
+        """Recompute every aggregate in one pass over countries and their currency links"""
+        rows = list(Country.objects.order_by().values_list(
+            'id', 'name', 'region', 'currency_code', 'population', 'estimated_gdp', 'last_refreshed_at'
+        ))
+        
+        # A country counts towards every currency it uses
+        country_currencies = {}
+        for country_id, code in CountryCurrency.objects.order_by('position').values_list('country_id', 'currency__code'):
+            country_currencies.setdefault(country_id, []).append(code)
+        
+        regions, currencies = {}, {}
+        total_population, total_gdp = 0, Decimal(0)
+        for pk, _, region, currency_code, population, gdp, _ in rows:
+            total_population += population
+            total_gdp += gdp or 0
+            keys = [(regions, region or '')]
+            keys.extend((currencies, code) for code in country_currencies.get(pk) or [currency_code or ''])
+            for rollup, key in keys:
+                entry = rollup.setdefault(key, [0, 0, Decimal(0)])
+                entry[0] += 1
+                entry[1] += population
+                entry[2] += gdp or 0
+        
+        # Same order as ?sort=gdp_desc / population_desc: value, then id
+        by_gdp = sorted((row for row in rows if row[5] is not None), key=itemgetter(5, 0), reverse=True)
+        by_population = sorted(rows, key=itemgetter(4, 0), reverse=True)
+        
+        def rollup_data(rollup):
+            return {
+                key: {'countries': count, 'population': population, 'estimated_gdp': str(gdp)}
+                for key, (count, population, gdp) in sorted(rollup.items())
+            }
+        
+        stats, _ = cls.objects.update_or_create(pk=cls.SINGLETON_ID, defaults={
+            'total_countries': len(rows),
+            'total_population': total_population,
+            'total_estimated_gdp': total_gdp,
+            'last_refreshed_at': max((row[6] for row in rows), default=None),
+            'top_by_gdp': [{'name': row[1], 'estimated_gdp': str(row[5])} for row in by_gdp[:cls.TOP_N]],
+            'top_by_population': [{'name': row[1], 'population': row[4]} for row in by_population[:cls.TOP_N]],
+            'regions': rollup_data(regions),
+            'currencies': rollup_data(currencies),
+        })
+        return stats
+    
+    @classmethod
+    def current(cls):
+        """The aggregates row, built on first use (e.g. right after migrating)"""
+        stats = cls.objects.filter(pk=cls.SINGLETON_ID).first()
+        return stats if stats is not None else cls.rebuild()
+    
+    @classmethod
+    async def acurrent(cls):
+        """current() for async views"""
+        stats = await cls.objects.filter(pk=cls.SINGLETON_ID).afirst()
+        return stats if stats is not None else await sync_to_async(cls.rebuild)()
+    
+    def __str__(self):
+        return f"Country stats ({self.total_countries} countries)"
+
+
+class Snapshot(models.Model):
+    """One versioned state of the dataset, recorded by each writing refresh"""
+    created_at = models.DateTimeField(db_index=True)
+    # Countries present after this snapshot / value rows stored for it
+    total_countries = models.PositiveIntegerField(default=0)
+    changed_countries = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'snapshots'
+        ordering = ['-id']
+    
+    def __str__(self):
+        return f"Snapshot {self.pk} ({self.created_at:%Y-%m-%d %H:%M})"
+
+
+class SnapshotValue(models.Model):
+    """
+    Tracked values of one country as of a snapshot, stored only when they
+    changed since the country's previous value row (append-only).
+    
+    country_id is a plain integer so history survives deleting the country;
+    removed=True marks the snapshot in which it disappeared.
+    """
+    snapshot = models.ForeignKey(Snapshot, on_delete=models.CASCADE, related_name='values')
+    country_id = models.PositiveIntegerField()
+    name = models.CharField(max_length=100)
+    currency_code = models.CharField(max_length=10, blank=True, null=True)
+    population = models.BigIntegerField(default=0)
+    exchange_rate = models.DecimalField(max_digits=20, decimal_places=6, blank=True, null=True)
+    estimated_gdp = models.DecimalField(max_digits=30, decimal_places=2, blank=True, null=True)
+    removed = models.BooleanField(default=False)
+    
+    class Meta:
+        db_table = 'snapshot_values'
+        constraints = [
+            # Also the index for "latest value per country up to snapshot N"
+            models.UniqueConstraint(fields=['country_id', 'snapshot'], name='snapshot_value_country_uniq'),
+        ]
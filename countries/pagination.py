@@ -0,0 +1,110 @@
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Optional, Tuple
+
+from django.db.models import Q
+
+COUNTRY_FIELDS = (
+    'id',
+    'name',
+    'capital',
+    'region',
+    'population',
+    'currency_code',
+    'exchange_rate',
+    'estimated_gdp',
+    'flag_url',
+    'last_refreshed_at',
+)
+
+# sort mode -> (field, descending); every ordering is made total with id,
+# except name which is unique on its own
+SORTS = {
+    'gdp_desc': ('estimated_gdp', True),
+    'gdp_asc': ('estimated_gdp', False),
+    'population_desc': ('population', True),
+    'population_asc': ('population', False),
+    'name_desc': ('name', True),
+    'name_asc': ('name', False),
+}
+DEFAULT_SORT = 'name_asc'
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+
+
+class InvalidPageParameter(ValueError):
+    pass
+
+
+def order_fields(sort: str) -> Tuple[str, ...]:
+    field, descending = SORTS[sort]
+    fields = (field,) if field == 'name' else (field, 'id')
+    return tuple(f'-{f}' for f in fields) if descending else fields
+
+
+def parse_fields(value: Optional[str]) -> Tuple[str, ...]:
+    """?fields=name,flag_url -> ('name', 'flag_url'); all fields when absent"""
+    if not value:
+        return COUNTRY_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in COUNTRY_FIELDS]
+    if unknown or not fields:
+        raise InvalidPageParameter(
+            f"Unknown field(s): {', '.join(unknown) or value}. Allowed: {', '.join(COUNTRY_FIELDS)}"
+        )
+    return fields
+
+
+def parse_limit(value: Optional[str]) -> int:
+    try:
+        limit = int(value) if value else DEFAULT_LIMIT
+    except ValueError:
+        raise InvalidPageParameter('limit must be an integer')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise InvalidPageParameter(f'limit must be between 1 and {MAX_LIMIT}')
+    return limit
+
+
+def encode_cursor(sort: str, row: Dict) -> str:
+    """Opaque cursor pointing just after row in the given sort order"""
+    field, _ = SORTS[sort]
+    value = row[field]
+    payload = [sort, str(value) if isinstance(value, Decimal) else value, row['id']]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(sort: str, cursor: str) -> Tuple[object, int]:
+    """Return the (sort value, id) stored in cursor; it must belong to the same sort"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if cursor_sort != sort or not isinstance(pk, int):
+            raise ValueError
+        field, _ = SORTS[sort]
+        if field == 'estimated_gdp':
+            value = Decimal(value)
+            if not value.is_finite():
+                raise ValueError
+        elif field == 'population':
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError
+        elif not isinstance(value, str):
+            raise ValueError
+    except (ValueError, TypeError, OverflowError, InvalidOperation):
+        raise InvalidPageParameter('Invalid cursor for this sort order')
+    return value, pk
+
+
+def keyset_filter(sort: str, value, pk: int) -> Q:
+    """Rows strictly after (value, pk) in the given sort order"""
+    field, descending = SORTS[sort]
+    after = 'lt' if descending else 'gt'
+    if field == 'name':
+        return Q(**{f'name__{after}': value})
+    # field <= value AND (field < value OR id < pk), written so the leading
+    # range condition can seek into the (field, id) index
+    return Q(**{f'{field}__{after}e': value}) & (
+        Q(**{f'{field}__{after}': value}) | Q(**{f'id__{after}': pk})
+    )
@@ -0,0 +1,105 @@
+"""
+In-process exchange-rate table for /rates and /convert.
+
+Rates are USD based (units of currency per 1 USD, as served by
+open.er-api). The table is loaded from the database once per dataset
+version; requests only do dictionary and array lookups. A cross rate
+from A to B is rates[B] / rates[A].
+"""
+import math
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .cache import get_dataset_version
+from .models import Currency
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+BASE_CURRENCY = 'USD'
+MAX_BATCH = 10_000
+
+
+class UnknownCurrency(ValueError):
+    def __init__(self, codes: Sequence[str]):
+        self.codes = sorted(set(codes))
+        super().__init__(f"Unknown currency code(s): {', '.join(self.codes)}")
+
+
+class RateTable:
+
+    def __init__(self, rates: Dict[str, float]):
+        rates = {BASE_CURRENCY: 1.0, **rates}
+        self.codes: List[str] = sorted(rates)
+        self.index: Dict[str, int] = {code: i for i, code in enumerate(self.codes)}
+        self.rates: Dict[str, float] = {code: rates[code] for code in self.codes}
+        self.array = np.array([self.rates[code] for code in self.codes], dtype=np.float64) if np is not None else None
+
+    @classmethod
+    def load(cls) -> 'RateTable':
+        """One query over the currencies table (one rate per currency)"""
+        rows = Currency.objects.order_by().exclude(exchange_rate__isnull=True).values_list('code', 'exchange_rate')
+        return cls({code: float(rate) for code, rate in rows if rate})
+
+    _current: Tuple[Optional[int], Optional['RateTable']] = (None, None)
+    _lock = threading.Lock()
+
+    @classmethod
+    def current(cls) -> 'RateTable':
+        """The table for the current dataset version, loaded at most once per version"""
+        version = get_dataset_version()
+        cached_version, table = cls._current
+        if cached_version == version:
+            return table
+        with cls._lock:
+            cached_version, table = cls._current
+            if cached_version != version:
+                table = cls.load()
+                cls._current = (version, table)
+        return table
+
+    def positions(self, codes: Sequence[str]) -> List[int]:
+        try:
+            return [self.index[code] for code in codes]
+        except KeyError:
+            raise UnknownCurrency([code for code in codes if code not in self.index])
+
+    def cross_rate(self, from_code: str, to_code: str) -> float:
+        """Units of to_code per unit of from_code"""
+        self.positions([from_code, to_code])
+        return self.rates[to_code] / self.rates[from_code]
+
+    def rates_for(self, base: str, symbols: Optional[Sequence[str]] = None) -> Dict[str, float]:
+        """Rates of symbols (default: every currency) against base"""
+        symbols = list(symbols) if symbols else self.codes
+        self.positions([base, *symbols])
+        base_rate = self.rates[base]
+        return {code: self.rates[code] / base_rate for code in symbols}
+
+    def convert_batch(self, from_codes: Sequence[str], to_codes: Sequence[str],
+                      amounts: Sequence[float]) -> List[float]:
+        """amount * rate(to) / rate(from) for every triple, in one vectorized pass"""
+        from_positions = self.positions(from_codes)
+        to_positions = self.positions(to_codes)
+        if self.array is not None and len(amounts) > 1:
+            results = (
+                np.asarray(amounts, dtype=np.float64)
+                * self.array.take(to_positions) / self.array.take(from_positions)
+            )
+            return results.tolist()
+        return [
+            amount * self.rates[self.codes[to_position]] / self.rates[self.codes[from_position]]
+            for amount, from_position, to_position in zip(amounts, from_positions, to_positions)
+        ]
+
+
+def parse_amount(value) -> float:
+    """Finite float from a query string or JSON value; raises ValueError otherwise"""
+    if isinstance(value, bool):
+        raise ValueError
+    amount = float(value)
+    if not math.isfinite(amount):
+        raise ValueError
+    return amount
@@ -0,0 +1,59 @@
+"""
+Recorded upstream data: the bundled seed, captures made with
+`manage.py upstream record` and the last good live payload.
+
+A recording is gzip-compressed JSON Lines: the first line holds the
+metadata ({"created_at", "exchange_rates"}), every following line one
+country in the restcountries v2 shape, so it can be replayed through the
+regular refresh pipeline one country at a time.
+"""
+import gzip
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class RecordingMeta(NamedTuple):
+    created_at: datetime
+    exchange_rates: Dict
+
+
+def read_meta(path: str) -> RecordingMeta:
+    """Only the first line of the file"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        meta = json.loads(f.readline())
+    return RecordingMeta(parse_datetime(meta['created_at']), meta['exchange_rates'])
+
+
+def iter_countries(path: str) -> Iterator[Dict]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write(path: str, countries: Iterable[Dict], exchange_rates: Dict,
+          created_at: Optional[datetime] = None) -> int:
+    """Write a recording atomically; returns the number of countries written"""
+    created_at = created_at or timezone.now()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    count = 0
+    try:
+        # mtime=0 keeps the file byte-for-byte reproducible
+        with open(tmp_path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+            meta = {'created_at': created_at.isoformat(), 'exchange_rates': exchange_rates}
+            f.write(json.dumps(meta, sort_keys=True).encode() + b'\n')
+            for country in countries:
+                f.write(json.dumps(country, sort_keys=True, ensure_ascii=False).encode() + b'\n')
+                count += 1
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return count
@@ -0,0 +1,379 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import sources
+from .cache import bump_dataset_version
+from .image_service import SummaryImageGenerator
+from .metrics import span
+from .models import (
+    Country, CountryCurrency, CountryStats, Currency, assign_estimated_gdp, quantize_exchange_rate,
+)
+from .services import ConditionalFetcher, CountryService
+from .snapshot_service import SnapshotService
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshService:
+
+    BATCH_SIZE = 500
+
+    # Columns written by a refresh; everything else on the row is left alone
+    UPDATE_FIELDS = [
+        'name',
+        'capital',
+        'region',
+        'population',
+        'currency_code',
+        'exchange_rate',
+        'estimated_gdp',
+        'flag_url',
+        'last_refreshed_at',
+        'source_hash',
+    ]
+
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        return name.strip().lower()
+
+    @staticmethod
+    def content_hash(processed_data: Dict) -> str:
+        """
+        Stable hash of the fields CountryService.process_country_data returns.
+
+        The GDP multiplier seed is included so changing it rewrites every row.
+        """
+        payload = json.dumps(
+            [processed_data, settings.GDP_MULTIPLIER_SEED],
+            sort_keys=True, default=str, separators=(',', ':'),
+        )
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def apply_processed_data(country: Country, processed_data: Dict, refreshed_at) -> None:
+        """Copy processed upstream data onto a (possibly unsaved) Country"""
+        country.name = processed_data['name']
+        country.capital = processed_data['capital']
+        country.region = processed_data['region']
+        country.population = processed_data['population'] or 0
+        country.currency_code = processed_data['currency_code']
+        country.exchange_rate = processed_data['exchange_rate']
+        country.flag_url = processed_data['flag_url']
+        country.last_refreshed_at = refreshed_at
+        country.source_hash = RefreshService.content_hash(processed_data)
+
+        # Validate per row so one bad country is reported instead of failing
+        # the whole batch; uniqueness is guaranteed by the name-keyed diff
+        country.prepare_for_write(compute_gdp=False)
+        country.validate_for_write()
+
+    @staticmethod
+    def upsert_currencies(rates: Dict[str, Optional[float]]) -> Tuple[Dict[str, int], int]:
+        """
+        Create missing currencies and store rates that changed, one row per
+        currency. Returns ({code: currency id} for every code in rates, the
+        number of currencies written).
+        """
+        existing = {code: (pk, rate) for pk, code, rate in Currency.objects.values_list('pk', 'code', 'exchange_rate')}
+        now = timezone.now()
+        new_currencies, changed_currencies = [], []
+        for code, rate in rates.items():
+            rate = quantize_exchange_rate(rate)
+            if code not in existing:
+                new_currencies.append(Currency(code=code, exchange_rate=rate))
+            elif existing[code][1] != rate:
+                changed_currencies.append(Currency(pk=existing[code][0], code=code, exchange_rate=rate, updated_at=now))
+
+        Currency.objects.bulk_create(new_currencies, batch_size=RefreshService.BATCH_SIZE)
+        Currency.objects.bulk_update(
+            changed_currencies, ['exchange_rate', 'updated_at'], batch_size=RefreshService.BATCH_SIZE
+        )
+
+        ids = {code: pk for code, (pk, _) in existing.items()}
+        ids.update((currency.code, currency.pk) for currency in new_currencies)
+        return ids, len(new_currencies) + len(changed_currencies)
+
+    @staticmethod
+    def link_currencies(countries: List[Country], codes: List[List[str]], currency_ids: Dict[str, int]) -> None:
+        """Replace the currency links of freshly written countries"""
+        CountryCurrency.objects.filter(country_id__in=[country.pk for country in countries]).delete()
+        CountryCurrency.objects.bulk_create(
+            [
+                CountryCurrency(country_id=country.pk, currency_id=currency_ids[code], position=position)
+                for country, country_codes in zip(countries, codes)
+                for position, code in enumerate(country_codes)
+            ],
+            batch_size=RefreshService.BATCH_SIZE,
+        )
+
+    @staticmethod
+    def upsert_countries(countries_data: Iterable[Dict], exchange_rates: Dict, prune: bool = False) -> Dict:
+        """
+        Create or update the countries whose upstream data changed.
+
+        Existing rows are loaded once and matched on their normalized name.
+        Rows whose content hash matches the stored one are skipped entirely
+        (last_refreshed_at and estimated_gdp stay as they are); new and
+        changed rows are written with bulk_create every BATCH_SIZE rows, so
+        countries_data can be a stream that is consumed as it is parsed.
+        With prune=True, countries missing from the payload are deleted in
+        a single statement. Currencies are upserted once per code and the
+        currency links of written countries replaced. CountryStats is
+        rebuilt and a history snapshot recorded in the same transaction
+        whenever anything was written.
+        """
+        processed_count = 0
+        error_count = 0
+        error_samples = []
+        refreshed_at = timezone.now()
+
+        with transaction.atomic():
+            existing = {
+                RefreshService.normalize_name(row[1]): (row[0], row[2], tuple(row[3:]))
+                for row in Country.objects.values_list(
+                    'pk', 'name', 'source_hash', *SnapshotService.TRACKED_FIELDS
+                )
+            }
+
+            seen_keys = set()
+            unchanged_keys = set()
+            created_keys = set()
+            updated_keys = set()
+            payload_rates: Dict[str, Optional[float]] = {}
+            snapshot_rows: Dict[int, Country] = {}
+            currencies_written = 0
+
+            # Rows of the current batch, with their currency codes
+            to_create: Dict[str, Country] = {}
+            to_update: Dict[str, Country] = {}
+            currency_codes: Dict[str, List[str]] = {}
+
+            def flush():
+                nonlocal currencies_written
+                if not to_create and not to_update:
+                    return
+                new_rows: List[Country] = list(to_create.values())
+                changed_rows: List[Country] = list(to_update.values())
+
+                # One vectorized GDP pass over every row that will be written
+                assign_estimated_gdp(new_rows + changed_rows)
+
+                Country.objects.bulk_create(new_rows, batch_size=RefreshService.BATCH_SIZE, prepare=False)
+                # Existing rows already carry their primary key, so an upsert on
+                # the pk turns into one INSERT ... ON CONFLICT DO UPDATE per batch
+                # (much cheaper than the CASE WHEN statements of bulk_update)
+                Country.objects.bulk_create(
+                    changed_rows,
+                    batch_size=RefreshService.BATCH_SIZE,
+                    prepare=False,
+                    update_conflicts=True,
+                    unique_fields=['id'],
+                    update_fields=RefreshService.UPDATE_FIELDS,
+                )
+
+                # One row per currency: a moved rate updates a single Currency
+                batch_codes = {code for codes in currency_codes.values() for code in codes}
+                currency_ids, written = RefreshService.upsert_currencies(
+                    {code: payload_rates[code] for code in batch_codes}
+                )
+                currencies_written += written
+                written_rows = {**to_create, **to_update}
+                RefreshService.link_currencies(
+                    list(written_rows.values()), [currency_codes[key] for key in written_rows], currency_ids
+                )
+
+                # History keeps only tracked values that actually moved
+                for key, country in written_rows.items():
+                    if key in to_create or SnapshotService.tracked_values(country) != existing[key][2]:
+                        snapshot_rows[country.pk] = country
+                    # A name repeated later in the payload now compares with this row
+                    existing[key] = (country.pk, country.source_hash, SnapshotService.tracked_values(country))
+
+                created_keys.update(to_create)
+                updated_keys.update(key for key in to_update if key not in created_keys)
+                to_create.clear()
+                to_update.clear()
+                currency_codes.clear()
+
+            for country_data in countries_data:
+                processed_count += 1
+                try:
+                    processed_data = CountryService.process_country_data(country_data, exchange_rates)
+                    if not processed_data['name']:
+                        raise ValidationError({'name': 'Name is required'})
+
+                    key = RefreshService.normalize_name(processed_data['name'])
+                    pk, stored_hash, _ = existing.get(key, (None, None, None))
+                    seen_keys.add(key)
+                    for code in processed_data['currency_codes']:
+                        payload_rates[code] = exchange_rates.get(code)
+
+                    if (
+                        pk is not None
+                        and key not in to_update
+                        and stored_hash == RefreshService.content_hash(processed_data)
+                    ):
+                        unchanged_keys.add(key)
+                        continue
+
+                    country = Country(pk=pk)
+                    RefreshService.apply_processed_data(country, processed_data, refreshed_at)
+                    currency_codes[key] = processed_data['currency_codes']
+
+                    # A name repeated in the payload overwrites the pending row,
+                    # same end state as running update_or_create twice
+                    if country.pk is None:
+                        to_create[key] = country
+                    else:
+                        to_update[key] = country
+
+                except Exception as e:
+                    error_count += 1
+                    error_msg = f"{country_data.get('name')}: {str(e)}"
+                    error_samples.append(error_msg)
+                    if error_count <= 10:
+                        logger.warning("Refresh error #%d: %s", error_count, error_msg)
+
+                if len(to_create) + len(to_update) >= RefreshService.BATCH_SIZE:
+                    with span('refresh.write'):
+                        flush()
+            with span('refresh.write'):
+                flush()
+
+            # Rates of currencies only used by unchanged countries
+            _, written = RefreshService.upsert_currencies(payload_rates)
+            currencies_written += written
+
+            removed_ids = [pk for key, (pk, _, _) in existing.items() if key not in seen_keys]
+            if prune and removed_ids:
+                Country.objects.filter(pk__in=removed_ids).delete()
+
+            if created_keys or updated_keys or (prune and removed_ids):
+                with span('refresh.aggregates'):
+                    CountryStats.rebuild()
+                    SnapshotService.record(snapshot_rows.values(), removed_ids if prune else (), created_at=refreshed_at)
+                transaction.on_commit(bump_dataset_version)
+            elif currencies_written:
+                # Only a secondary currency's rate moved: /rates must see it
+                transaction.on_commit(bump_dataset_version)
+
+        unchanged_count = len(unchanged_keys - updated_keys)
+
+        return {
+            'countries_processed': processed_count,
+            'countries_created': len(created_keys),
+            # Every existing country the payload matched, as it always was;
+            # countries_changed / countries_unchanged split it
+            'countries_updated': len(updated_keys) + unchanged_count,
+            'countries_with_errors': error_count,
+            'countries_new': len(created_keys),
+            'countries_changed': len(updated_keys),
+            'countries_unchanged': unchanged_count,
+            'countries_removed': len(removed_ids),
+            'removed_deleted': prune,
+            'sample_errors': error_samples[:5],
+        }
+
+    @staticmethod
+    def upstream_committed(source: str) -> None:
+        """Promote the staged HTTP cache and, for live data, keep it as the last good recording"""
+        try:
+            ConditionalFetcher.promote_staged()
+        except OSError as e:
+            logger.warning("Could not promote the staged upstream responses: %s", e)
+            return
+        if source == 'live':
+            try:
+                sources.save_last_good()
+            except (OSError, ValueError) as e:
+                logger.warning("Could not save the last good upstream recording: %s", e)
+
+    @staticmethod
+    def run_refresh(
+        force: bool = False,
+        prune: bool = False,
+        progress: Optional[Callable[[str, int], None]] = None,
+        source=None,
+    ) -> Dict:
+        """
+        Run the whole refresh pipeline: fetch, upsert and summary image.
+
+        progress, when given, is called with (stage, percent) as each stage
+        starts. source overrides settings.UPSTREAM_SOURCE (see
+        countries.sources). The returned dict includes per-stage timings in
+        seconds and the source the data came from. Raises when the upstream
+        sources cannot be fetched.
+        """
+        timings = {}
+
+        def stage(name: str, percent: int):
+            if progress is not None:
+                progress(name, percent)
+            return time.perf_counter()
+
+        started = stage('fetch', 0)
+        # When streaming, countries are downloaded and parsed during upsert
+        with span('refresh.fetch'):
+            upstream = sources.fetch_upstream(stream=settings.REFRESH_STREAMING, source=source)
+        timings['fetch'] = time.perf_counter() - started
+
+        if upstream.not_modified and not force and Country.objects.exists():
+            # Both sources answered 304: nothing to reprocess
+            return {
+                'message': 'Countries data already up to date',
+                'countries_processed': 0,
+                'countries_created': 0,
+                'countries_updated': 0,
+                'countries_with_errors': 0,
+                'countries_new': 0,
+                'countries_changed': 0,
+                'countries_unchanged': 0,
+                'countries_removed': 0,
+                'removed_deleted': False,
+                'total_countries_in_db': Country.objects.count(),
+                'sample_errors': [],
+                'source': upstream.source,
+                'timings': timings,
+            }
+
+        started = stage('upsert', 40)
+        with span('refresh.upsert'):
+            result = RefreshService.upsert_countries(
+                upstream.countries, upstream.exchange_rates, prune=prune
+            )
+        timings['upsert'] = time.perf_counter() - started
+
+        # Only now may the next fetch be conditional on what was just processed
+        transaction.on_commit(lambda: RefreshService.upstream_committed(upstream.source))
+
+        started = stage('render', 80)
+        with span('refresh.render'):
+            SummaryImageGenerator.generate_summary_image()
+        timings['render'] = time.perf_counter() - started
+
+        logger.info(
+            "Refresh finished (%s): processed=%d new=%d changed=%d unchanged=%d removed=%d errors=%d",
+            upstream.source,
+            result['countries_processed'],
+            result['countries_new'],
+            result['countries_changed'],
+            result['countries_unchanged'],
+            result['countries_removed'],
+            result['countries_with_errors'],
+        )
+
+        return {
+            'message': 'Countries data refreshed successfully',
+            **result,
+            'total_countries_in_db': Country.objects.count(),
+            'source': upstream.source,
+            'timings': timings,
+        }
@@ -0,0 +1,173 @@
+"""
+Process-local, read-only copy of the countries table.
+
+The whole dataset (a few hundred rows) is loaded once per dataset version
+into immutable records, with indexes by lowercased name, region and
+currency code and every sort order precomputed, so GET /countries,
+GET /countries/:name and the CountryStats aggregates are served without a
+query. A new version builds a new replica and swaps it in with a single
+assignment; requests holding the old one finish with it.
+
+Names are ordered by the database itself (its collation need not be
+code point order: PostgreSQL's usually is not), numbers by Python; pages
+are cut by bisecting the same keys, so cursors stay consistent with the
+SQL path. A name cursor is placed by the rank of its name, so one whose
+row has since gone cannot be placed and the caller falls back to SQL.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+
+from .cache import get_dataset_version
+from .models import Country, CountryCurrency, CountryStats
+from .pagination import COUNTRY_FIELDS, SORTS
+
+# Every row is a CountryRecord in this column order
+COLUMNS = COUNTRY_FIELDS
+
+
+class CountryRecord(NamedTuple):
+    id: int
+    name: str
+    capital: Optional[str]
+    region: Optional[str]
+    population: int
+    currency_code: Optional[str]
+    exchange_rate: object
+    estimated_gdp: object
+    flag_url: Optional[str]
+    last_refreshed_at: object
+
+
+class Ordering(NamedTuple):
+    """Record positions sorted by (value, id) both ways, and the ascending keys for bisecting"""
+    ascending: Tuple[int, ...]
+    descending: Tuple[int, ...]
+    keys: Tuple[tuple, ...]
+
+
+class CountryReplica:
+    __slots__ = ('version', 'records', 'stats', 'by_name', 'name_ranks', 'by_region', 'by_currency', 'orderings')
+
+    def __init__(self, version: Optional[int], records: List[CountryRecord],
+                 currencies: Dict[int, List[str]], stats: Optional[CountryStats] = None):
+        """records must come in the database's ORDER BY name, id order"""
+        self.version = version
+        self.stats = stats
+        self.records: Tuple[CountryRecord, ...] = tuple(records)
+        self.by_name: Dict[str, CountryRecord] = {record.name.lower(): record for record in self.records}
+        self.name_ranks: Dict[str, int] = {record.name: rank for rank, record in enumerate(self.records)}
+
+        by_region: Dict[str, set] = {}
+        by_currency: Dict[str, set] = {}
+        for position, record in enumerate(self.records):
+            if record.region:
+                by_region.setdefault(record.region.lower(), set()).add(position)
+            for code in currencies.get(record.id, ()):
+                by_currency.setdefault(code, set()).add(position)
+        self.by_region: Dict[str, FrozenSet[int]] = {key: frozenset(v) for key, v in by_region.items()}
+        self.by_currency: Dict[str, FrozenSet[int]] = {key: frozenset(v) for key, v in by_currency.items()}
+
+        ascending = tuple(range(len(self.records)))
+        self.orderings: Dict[str, Ordering] = {
+            'name': Ordering(ascending, ascending[::-1], tuple((rank,) for rank in ascending)),
+        }
+        for field in {field for field, _ in SORTS.values()} - {'name'}:
+            index = COLUMNS.index(field)
+            # Like the SQL path: rows without an estimated GDP are left out of GDP sorts
+            keyed = sorted(
+                ((record[index], record.id), position)
+                for position, record in enumerate(self.records)
+                if record[index] is not None
+            )
+            ascending = tuple(position for _, position in keyed)
+            self.orderings[field] = Ordering(ascending, ascending[::-1], tuple(key for key, _ in keyed))
+
+    @classmethod
+    def load(cls, version: Optional[int] = None) -> 'CountryReplica':
+        """Three queries: the countries, their currency links and the aggregates row"""
+        rows = Country.objects.order_by('name', 'id').values_list(*COLUMNS)
+        records = [CountryRecord(*row) for row in rows]
+        currencies: Dict[int, List[str]] = {}
+        for country_id, code in CountryCurrency.objects.order_by().values_list('country_id', 'currency__code'):
+            currencies.setdefault(country_id, []).append(code)
+        return cls(version, records, currencies, CountryStats.current())
+
+    _current: Optional['CountryReplica'] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def for_version(cls, version: int) -> 'CountryReplica':
+        """The replica for dataset version, loaded at most once per version"""
+        replica = cls._current
+        if replica is not None and replica.version == version:
+            return replica
+        with cls._lock:
+            replica = cls._current
+            if replica is None or replica.version != version:
+                replica = cls.load(version)
+                cls._current = replica
+        return replica
+
+    @classmethod
+    async def afor_version(cls, version: int) -> 'CountryReplica':
+        """for_version for async views; only a reload leaves the event loop"""
+        replica = cls._current
+        if replica is not None and replica.version == version:
+            return replica
+        return await sync_to_async(cls.for_version)(version)
+
+    @classmethod
+    def current(cls) -> 'CountryReplica':
+        return cls.for_version(get_dataset_version())
+
+    def get(self, name: str) -> Optional[CountryRecord]:
+        return self.by_name.get(name.lower())
+
+    def query(self, region: str = '', currency: str = '', sort: str = 'name_asc',
+              limit: Optional[int] = None, after: Optional[tuple] = None) -> Optional[List[CountryRecord]]:
+        """
+        Rows for GET /countries in sort order: region is lowercase, currency
+        upper case, after a decoded (value, id) cursor. With a limit, up to
+        limit + 1 rows are returned so the caller can tell if there is a
+        next page, like the SQL path. None when after names a country this
+        replica does not have.
+        """
+        field, descending = SORTS[sort]
+        ordering = self.orderings[field]
+        positions = ordering.descending if descending else ordering.ascending
+        start = 0
+
+        if after is not None:
+            value, pk = after
+            if field == 'name':
+                # Names are unique: the cursor compares on the name's rank alone
+                rank = self.name_ranks.get(value)
+                if rank is None:
+                    return None
+                low = high = (rank,)
+            else:
+                low = high = (value, pk)
+            if descending:
+                start = len(positions) - bisect_left(ordering.keys, low)
+            else:
+                start = bisect_right(ordering.keys, high)
+
+        wanted = None
+        if region:
+            wanted = self.by_region.get(region, frozenset())
+        if currency:
+            matches = self.by_currency.get(currency, frozenset())
+            wanted = matches if wanted is None else wanted & matches
+
+        records = self.records
+        rows = []
+        for position in islice(positions, start, None):
+            if wanted is None or position in wanted:
+                rows.append(records[position])
+                if limit is not None and len(rows) > limit:
+                    break
+        return rows
@@ -0,0 +1,59 @@
+"""
+Bundled countries snapshot used to bootstrap an empty or stale database.
+
+The seed is a recording (see countries.recordings) that goes through the
+regular refresh pipeline (CountryService.process_country_data and the
+bulk upsert) one country at a time.
+"""
+import logging
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from . import recordings
+from .models import CountryStats
+from .refresh_service import RefreshService
+
+logger = logging.getLogger(__name__)
+
+
+class SeedService:
+
+    @staticmethod
+    def path() -> str:
+        return settings.COUNTRIES_SEED_PATH
+
+    @staticmethod
+    def is_current(meta: recordings.RecordingMeta) -> bool:
+        """The database already holds this snapshot's data or something newer"""
+        stats = CountryStats.current()
+        return bool(
+            stats.total_countries
+            and stats.last_refreshed_at
+            and stats.last_refreshed_at >= meta.created_at
+        )
+
+    @staticmethod
+    def load(path: Optional[str] = None, force: bool = False) -> Optional[Dict]:
+        """
+        Upsert the seed file's countries through the refresh pipeline.
+
+        Returns the upsert result, or None when the database is already at
+        (or newer than) the file's version and force is not set.
+        """
+        path = path or SeedService.path()
+        meta = recordings.read_meta(path)
+        if not force and SeedService.is_current(meta):
+            logger.info("Database is already at seed version %s; nothing to load", meta.created_at.isoformat())
+            return None
+
+        result = RefreshService.upsert_countries(recordings.iter_countries(path), meta.exchange_rates)
+        logger.info(
+            "Loaded seed %s: new=%d changed=%d unchanged=%d errors=%d",
+            meta.created_at.isoformat(),
+            result['countries_new'],
+            result['countries_changed'],
+            result['countries_unchanged'],
+            result['countries_with_errors'],
+        )
+        return result
@@ -0,0 +1,112 @@
+"""
+Fast JSON rendering for countries.
+
+Rows come straight from values_list() tuples (no model instances) and are
+encoded with orjson when it is installed, falling back to the stdlib json
+module. Each rendered row is cached per dataset version, so a list
+response is mostly a join of precomputed fragments.
+"""
+import json
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from .cache import LRUCache, on_dataset_version_change
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def dumps(data) -> bytes:
+    """Compact UTF-8 JSON, the same output as DRF's JSONRenderer"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _decimal_or_none(value):
+    return float(value) if value else None
+
+
+def _datetime(value):
+    if value is None:
+        return None
+    representation = value.isoformat()
+    if representation.endswith('+00:00'):
+        representation = representation[:-6] + 'Z'
+    return representation
+
+
+CONVERTERS = {
+    'exchange_rate': _decimal_or_none,
+    'estimated_gdp': _decimal_or_none,
+    'last_refreshed_at': _datetime,
+}
+
+
+class CountrySerializer:
+
+    # (dataset version, fields, id) -> rendered row
+    _row_cache = LRUCache(maxsize=100_000)
+
+    @staticmethod
+    def columns(fields: Tuple[str, ...], extra: Sequence[str] = ()) -> Tuple[str, ...]:
+        """values_list() columns for fields: id first, then fields, then extra"""
+        return tuple(dict.fromkeys(('id',) + tuple(fields) + tuple(extra)))
+
+    @staticmethod
+    def _plan(fields: Tuple[str, ...], columns: Tuple[str, ...]):
+        return [(field, columns.index(field), CONVERTERS.get(field)) for field in fields]
+
+    @staticmethod
+    def _to_representation(plan, row: tuple) -> dict:
+        return {
+            field: converter(row[position]) if converter else row[position]
+            for field, position, converter in plan
+        }
+
+    @classmethod
+    def to_representation(cls, fields: Tuple[str, ...], columns: Tuple[str, ...], row: tuple) -> dict:
+        return cls._to_representation(cls._plan(fields, columns), row)
+
+    @classmethod
+    def render_rows(cls, fields: Tuple[str, ...], columns: Tuple[str, ...], rows: Iterable[tuple],
+                    version: Optional[int] = None) -> List[bytes]:
+        """Rendered fragment per row; cached per dataset version when one is given"""
+        plan = cls._plan(fields, columns)
+        if version is None:
+            return [dumps(cls._to_representation(plan, row)) for row in rows]
+
+        cache = cls._row_cache
+        fragments = []
+        for row in rows:
+            key = (version, fields, row[0])
+            fragment = cache.get(key)
+            if fragment is None:
+                fragment = dumps(cls._to_representation(plan, row))
+                cache.set(key, fragment)
+            fragments.append(fragment)
+        return fragments
+
+    @classmethod
+    def render_one(cls, fields: Tuple[str, ...], columns: Tuple[str, ...], row: tuple,
+                   version: Optional[int] = None) -> bytes:
+        return cls.render_rows(fields, columns, [row], version)[0]
+
+    @classmethod
+    def render_list(cls, fields: Tuple[str, ...], columns: Tuple[str, ...], rows: Iterable[tuple],
+                    version: Optional[int] = None) -> bytes:
+        return b'[' + b','.join(cls.render_rows(fields, columns, rows, version)) + b']'
+
+    @classmethod
+    def render_page(cls, fields: Tuple[str, ...], columns: Tuple[str, ...], rows: Iterable[tuple],
+                    next_cursor: Optional[str], version: Optional[int] = None) -> bytes:
+        return (
+            b'{"results":' + cls.render_list(fields, columns, rows, version)
+            + b',"next_cursor":' + dumps(next_cursor) + b'}'
+        )
+
+
+@on_dataset_version_change
+def _drop_rendered_rows(version: int) -> None:
+    CountrySerializer._row_cache.clear()
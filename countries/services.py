@@ -1,32 +1,277 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
 import requests
-from typing import Dict, List, Optional
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .streaming import CHUNK_SIZE, iter_file, iter_json_array
+
+
+class FetchResult(NamedTuple):
+    data: object
+    not_modified: bool
+    # For a streamed body: releases the response if data will not be read
+    close: Optional[Callable[[], None]] = None
+
+
+class UpstreamData(NamedTuple):
+    countries: Iterable[Dict]  # a list, or an iterator when streaming
+    exchange_rates: Dict
+    not_modified: bool
+    source: str = 'live'  # see countries.sources
+
+
+class ConditionalFetcher:
+    """
+    Fetch JSON documents over a pooled session using HTTP validators.
+
+    Response bodies and their ETag/Last-Modified validators are kept under
+    settings.CACHE_DIR/http so later requests can be conditional; a 304
+    answer is served from the stored body.
+
+    A new body is only staged at first. It replaces the cached copy when
+    promote_staged() is called, which run_refresh does once the data was
+    committed, so a refresh that fails half way is not answered with 304
+    the next time.
+    """
+
+    TIMEOUT = (5, 30)  # (connect, read) seconds
+    _session = None
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        if cls._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            cls._session = session
+        return cls._session
 
-class CountryService:
-    
     @staticmethod
-    def fetch_countries_data() -> List[Dict]:
+    def _paths(name: str, staged: bool = False):
+        cache_dir = os.path.join(settings.CACHE_DIR, 'http')
+        stem = f'{name}.staged' if staged else name
+        return os.path.join(cache_dir, f'{stem}.json'), os.path.join(cache_dir, f'{stem}.meta.json')
+
+    @classmethod
+    def discard_staged(cls, name: str) -> None:
+        for path in cls._paths(name, staged=True):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @classmethod
+    def promote_staged(cls, names=('countries', 'exchange_rates')) -> None:
+        """Make the bodies and validators staged by the last fetches the cached copies"""
+        for name in names:
+            staged_body, staged_meta = cls._paths(name, staged=True)
+            if not os.path.exists(staged_meta):
+                continue
+            body_path, meta_path = cls._paths(name)
+            # Without meta the old body is never used, even if we stop half way
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            os.replace(staged_body, body_path)
+            os.replace(staged_meta, meta_path)
+
+    @staticmethod
+    def _write_atomic(path: str, content: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_cached(cls, name: str, url: str):
+        """Return (body, meta) stored for url, or (None, {}) when nothing usable is cached"""
+        body_path, meta_path = cls._paths(name)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get('url') != url:
+                return None, {}
+            with open(body_path, 'rb') as f:
+                return f.read(), meta
+        except (OSError, ValueError):
+            return None, {}
+
+    @classmethod
+    def fetch(cls, name: str, url: str) -> FetchResult:
+        cls.discard_staged(name)
+        cached_body, meta = cls.load_cached(name, url)
+
+        headers = {}
+        if cached_body is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = cls.session().get(url, headers=headers, timeout=cls.TIMEOUT)
+
+        if response.status_code == 304 and cached_body is not None:
+            return FetchResult(json.loads(cached_body), True)
+
+        response.raise_for_status()
+        body = response.content
+        data = json.loads(body)
+
+        body_path, meta_path = cls._paths(name, staged=True)
+        cls._write_atomic(body_path, body)
+        cls._write_atomic(meta_path, json.dumps({
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }).encode())
+
+        return FetchResult(data, False)
+
+    @classmethod
+    def fetch_stream(cls, name: str, url: str) -> FetchResult:
+        """
+        Like fetch, for a document that is a JSON array, but data is an
+        iterator over its items, parsed while the body is downloaded.
+
+        The body is copied to the cache as it streams and is only staged
+        once it was read completely.
+        """
+        cls.discard_staged(name)
+        body_path, meta = cls.load_cached_meta(name, url)
+
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        response = cls.session().get(url, headers=headers, timeout=cls.TIMEOUT, stream=True)
+
+        if response.status_code == 304 and meta:
+            response.close()
+            return FetchResult(iter_json_array(iter_file(body_path)), True)
+
         try:
-            response = requests.get(
-                'https://restcountries.com/v2/all?fields=name,capital,region,population,flag,currencies',
-                timeout=30
-            )
             response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
+        except requests.RequestException:
+            response.close()
+            raise
+        return FetchResult(iter_json_array(cls._tee_to_cache(name, url, response)), False, response.close)
+
+    @classmethod
+    def load_cached_meta(cls, name: str, url: str):
+        """Like load_cached, without reading the body: (body path, meta) or (None, {})"""
+        body_path, meta_path = cls._paths(name)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None, {}
+        if meta.get('url') != url or not os.path.exists(body_path):
+            return None, {}
+        return body_path, meta
+
+    @classmethod
+    def _tee_to_cache(cls, name: str, url: str, response: requests.Response) -> Iterator[bytes]:
+        """Yield the response body in chunks while writing it to the staging files"""
+        body_path, meta_path = cls._paths(name, staged=True)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        tmp_path = f'{body_path}.{os.getpid()}.stream.tmp'
+        try:
+            with response, open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, body_path)
+            cls._write_atomic(meta_path, json.dumps({
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }).encode())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class CountryService:
+
+    COUNTRIES_URL = 'https://restcountries.com/v2/all?fields=name,capital,region,population,flag,currencies'
+    EXCHANGE_RATES_URL = 'https://open.er-api.com/v6/latest/USD'
+
+    @staticmethod
+    def fetch_countries_result(url: Optional[str] = None) -> FetchResult:
+        try:
+            return ConditionalFetcher.fetch('countries', url or CountryService.COUNTRIES_URL)
+        except (requests.RequestException, ValueError) as e:
             raise Exception(f"Could not fetch data from countries API: {str(e)}")
-    
+
     @staticmethod
-    def fetch_exchange_rates() -> Dict:
+    def fetch_countries_stream(url: Optional[str] = None) -> FetchResult:
+        """Countries as an iterator, parsed one at a time while downloading"""
         try:
-            response = requests.get(
-                'https://open.er-api.com/v6/latest/USD',
-                timeout=30
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data.get('rates', {})
+            result = ConditionalFetcher.fetch_stream('countries', url or CountryService.COUNTRIES_URL)
         except requests.RequestException as e:
+            raise Exception(f"Could not fetch data from countries API: {str(e)}")
+        return result._replace(data=CountryService._wrap_stream_errors(result.data))
+
+    @staticmethod
+    def _wrap_stream_errors(countries: Iterator[Dict]) -> Iterator[Dict]:
+        # Errors surface while the caller consumes the stream
+        try:
+            yield from countries
+        except (requests.RequestException, ValueError) as e:
+            raise Exception(f"Could not fetch data from countries API: {str(e)}")
+
+    @staticmethod
+    def fetch_exchange_rates_result(url: Optional[str] = None) -> FetchResult:
+        try:
+            result = ConditionalFetcher.fetch('exchange_rates', url or CountryService.EXCHANGE_RATES_URL)
+            return FetchResult(result.data.get('rates', {}), result.not_modified)
+        except (requests.RequestException, ValueError) as e:
             raise Exception(f"Could not fetch data from exchange rates API: {str(e)}")
+
+    @staticmethod
+    def fetch_countries_data() -> List[Dict]:
+        return CountryService.fetch_countries_result().data
+    
+    @staticmethod
+    def fetch_exchange_rates() -> Dict:
+        return CountryService.fetch_exchange_rates_result().data
+
+    @staticmethod
+    def fetch_upstream(stream: bool = False, countries_url: Optional[str] = None,
+                       rates_url: Optional[str] = None) -> UpstreamData:
+        """
+        Fetch countries and exchange rates concurrently over HTTP.
+
+        not_modified is only set when both sources answered 304, i.e. the
+        data is exactly what the last refresh already processed. With
+        stream=True, countries is an iterator that parses the response as
+        the caller consumes it. The URLs default to the live APIs.
+        """
+        fetch_countries = (
+            CountryService.fetch_countries_stream if stream else CountryService.fetch_countries_result
+        )
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            countries_future = executor.submit(fetch_countries, countries_url)
+            rates_future = executor.submit(CountryService.fetch_exchange_rates_result, rates_url)
+            countries = countries_future.result()
+            try:
+                rates = rates_future.result()
+            except BaseException:
+                # The countries stream will never be read
+                if countries.close is not None:
+                    countries.close()
+                raise
+
+        return UpstreamData(
+            countries=countries.data,
+            exchange_rates=rates.data,
+            not_modified=countries.not_modified and rates.not_modified,
+        )
     
     @staticmethod
     def extract_currency_code(country_data: Dict) -> Optional[str]:
@@ -35,6 +280,12 @@ class CountryService:
             return currencies[0].get('code')
         return None
     
+    @staticmethod
+    def extract_currency_codes(country_data: Dict) -> List[str]:
+        """Every currency code of a country, upper-cased, in upstream order"""
+        codes = (currency.get('code') for currency in country_data.get('currencies') or [])
+        return list(dict.fromkeys(code.strip().upper() for code in codes if code and code.strip()))
+    
     @staticmethod
     def process_country_data(country_data: Dict, exchange_rates: Dict) -> Dict:
         currency_code = CountryService.extract_currency_code(country_data)
@@ -46,6 +297,7 @@ class CountryService:
             'region': country_data.get('region'),
             'population': country_data.get('population', 0),
             'currency_code': currency_code,
+            'currency_codes': CountryService.extract_currency_codes(country_data),
             'exchange_rate': exchange_rate,
             'flag_url': country_data.get('flag')
         }
\ No newline at end of file
@@ -0,0 +1,164 @@
+import logging
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from operator import itemgetter
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .cache import LRUCache
+from .models import Country, Snapshot, SnapshotValue
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotNotFound(Exception):
+    """No snapshot matches the requested id or point in time"""
+
+
+class SnapshotService:
+    """
+    History of the tracked country values.
+
+    Each writing refresh appends a Snapshot plus one SnapshotValue per
+    country whose tracked values changed (the first snapshot is a full
+    baseline), so storage grows with the amount of change rather than with
+    countries x refreshes. The state as of snapshot N is the latest value
+    row per country with snapshot <= N.
+    """
+
+    TRACKED_FIELDS = ('name', 'currency_code', 'population', 'exchange_rate', 'estimated_gdp')
+
+    # (snapshot id, created_at) -> {country_id: values dict}; snapshots never
+    # change once written
+    _states = LRUCache(maxsize=8)
+
+    @classmethod
+    def tracked_values(cls, country: Country) -> Tuple:
+        return tuple(getattr(country, field) for field in cls.TRACKED_FIELDS)
+
+    @classmethod
+    def record(cls, changed: Iterable[Country] = (), removed_ids: Iterable[int] = (), created_at=None) -> Optional[Snapshot]:
+        """
+        Append a snapshot for countries whose tracked values changed and
+        countries that were deleted; call inside the writing transaction.
+
+        The first snapshot ever recorded captures every country instead.
+        Returns None when there is nothing to record.
+        """
+        created_at = created_at or timezone.now()
+        is_baseline = not Snapshot.objects.exists()
+        if is_baseline:
+            changed = Country.objects.order_by().only('id', *cls.TRACKED_FIELDS)
+            removed_ids = ()
+        changed, removed_ids = list(changed), list(removed_ids)
+        if not changed and not removed_ids:
+            return None
+
+        snapshot = Snapshot.objects.create(
+            created_at=created_at,
+            total_countries=Country.objects.count(),
+            changed_countries=len(changed) + len(removed_ids),
+        )
+        values = [
+            SnapshotValue(snapshot=snapshot, country_id=country.pk,
+                          **dict(zip(cls.TRACKED_FIELDS, cls.tracked_values(country))))
+            for country in changed
+        ]
+        values.extend(
+            SnapshotValue(snapshot=snapshot, country_id=pk, name='', removed=True)
+            for pk in removed_ids
+        )
+        SnapshotValue.objects.bulk_create(values, batch_size=500)
+        logger.info(
+            "Recorded %s snapshot %d with %d value rows",
+            'baseline' if is_baseline else 'delta', snapshot.pk, len(values),
+        )
+        return snapshot
+
+    @staticmethod
+    def resolve(as_of: str) -> Snapshot:
+        """
+        Latest snapshot at or before as_of: a snapshot id, an ISO datetime
+        (naive means UTC) or a date (the end of that day).
+        """
+        value = (as_of or '').strip()
+        snapshots = Snapshot.objects.all()
+        if value.isdigit():
+            snapshot = snapshots.filter(pk=int(value)).first()
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                if day is None:
+                    raise ValueError('as_of must be a snapshot id, an ISO date or an ISO datetime')
+                snapshots = snapshots.filter(
+                    created_at__lt=datetime.combine(day + timedelta(days=1), time.min, dt_timezone.utc)
+                )
+            else:
+                if timezone.is_naive(moment):
+                    moment = timezone.make_aware(moment, dt_timezone.utc)
+                snapshots = snapshots.filter(created_at__lte=moment)
+            snapshot = snapshots.order_by('-created_at', '-id').first()
+        if snapshot is None:
+            raise SnapshotNotFound(f'No snapshot at or before {value}')
+        return snapshot
+
+    @classmethod
+    def state(cls, snapshot: Snapshot) -> Dict[int, Dict]:
+        """{country_id: tracked values} of every country present as of snapshot"""
+        key = (snapshot.pk, snapshot.created_at)
+        state = cls._states.get(key)
+        if state is not None:
+            return state
+
+        rows = (
+            SnapshotValue.objects
+            .filter(snapshot_id__lte=snapshot.pk)
+            .order_by('country_id', '-snapshot_id')
+            .values_list('country_id', 'removed', *cls.TRACKED_FIELDS)
+        )
+        state = {}
+        previous_id = None
+        for country_id, removed, *values in rows.iterator(chunk_size=2000):
+            if country_id == previous_id:
+                continue  # an older value of a country already resolved
+            previous_id = country_id
+            if not removed:
+                state[country_id] = {'id': country_id, **dict(zip(cls.TRACKED_FIELDS, values))}
+
+        cls._states.set(key, state)
+        return state
+
+    @classmethod
+    def countries_as_of(cls, snapshot: Snapshot, sort_field: str, descending: bool):
+        """Countries of a snapshot ordered like GET /countries (value, then id)"""
+        rows = cls.state(snapshot).values()
+        if sort_field == 'estimated_gdp':
+            rows = [row for row in rows if row['estimated_gdp'] is not None]
+        if sort_field == 'name':
+            return sorted(rows, key=lambda row: row['name'], reverse=descending)
+        return sorted(rows, key=itemgetter(sort_field, 'id'), reverse=descending)
+
+    @classmethod
+    def diff(cls, from_snapshot: Optional[Snapshot], to_snapshot: Snapshot) -> Dict:
+        """
+        Countries added, removed and changed (with before/after values)
+        between two snapshots; from_snapshot=None diffs against nothing.
+        """
+        before = cls.state(from_snapshot) if from_snapshot is not None else {}
+        after = cls.state(to_snapshot)
+        changed = []
+        for country_id in sorted(before.keys() & after.keys()):
+            old, new = before[country_id], after[country_id]
+            fields = {
+                field: {'from': old[field], 'to': new[field]}
+                for field in cls.TRACKED_FIELDS if old[field] != new[field]
+            }
+            if fields:
+                changed.append({'id': country_id, 'name': new['name'], 'changes': fields})
+        return {
+            'added': [after[pk] for pk in sorted(after.keys() - before.keys())],
+            'removed': [before[pk] for pk in sorted(before.keys() - after.keys())],
+            'changed': changed,
+        }
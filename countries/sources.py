@@ -0,0 +1,187 @@
+"""
+Where a refresh gets its upstream data from.
+
+- live: restcountries.com and open.er-api.com over HTTP
+- recording: a recorded file (see countries.recordings), fully offline
+- stub: a local stub server (`manage.py upstream serve`) replaying a
+  recording over HTTP, so the whole fetch path can be exercised
+
+settings.UPSTREAM_SOURCE picks the source. After every live refresh that
+received new data, the payload is kept as the "last good" recording; when
+the live APIs fail and settings.UPSTREAM_FALLBACK is on, the refresh
+replays it (or the bundled seed) instead.
+"""
+import hashlib
+import json
+import logging
+import os
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from django.conf import settings
+
+from . import recordings
+from .models import CountryStats
+from .services import ConditionalFetcher, CountryService, UpstreamData
+from .streaming import iter_file, iter_json_array
+
+logger = logging.getLogger(__name__)
+
+
+class LiveSource:
+    name = 'live'
+
+    def fetch(self, stream: bool = False) -> UpstreamData:
+        return CountryService.fetch_upstream(stream=stream)
+
+
+class StubServerSource:
+    name = 'stub'
+
+    def __init__(self, base_url: Optional[str] = None):
+        self.base_url = (base_url or settings.UPSTREAM_STUB_URL).rstrip('/')
+
+    def fetch(self, stream: bool = False) -> UpstreamData:
+        upstream = CountryService.fetch_upstream(
+            stream=stream,
+            countries_url=f'{self.base_url}/countries',
+            rates_url=f'{self.base_url}/rates',
+        )
+        return upstream._replace(source=self.name)
+
+
+class RecordingSource:
+    name = 'recording'
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.UPSTREAM_RECORDING_PATH or last_good_path()
+
+    def fetch(self, stream: bool = False) -> UpstreamData:
+        meta = recordings.read_meta(self.path)
+        countries = recordings.iter_countries(self.path)
+        return UpstreamData(
+            countries=countries if stream else list(countries),
+            exchange_rates=meta.exchange_rates,
+            not_modified=False,
+            source=self.name,
+        )
+
+
+SOURCES = {
+    'live': LiveSource,
+    'recording': RecordingSource,
+    'stub': StubServerSource,
+}
+
+
+def get_source(name: Optional[str] = None):
+    name = name or settings.UPSTREAM_SOURCE
+    try:
+        return SOURCES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown upstream source {name!r}; expected one of: {', '.join(SOURCES)}")
+
+
+def last_good_path() -> str:
+    return os.path.join(settings.CACHE_DIR, 'recordings', 'last_good.jsonl.gz')
+
+
+def fallback_path() -> Optional[str]:
+    """
+    The last good recording, else the bundled seed; None when neither
+    exists or would only roll the database back to older data.
+    """
+    stats = CountryStats.current()
+    for path in (last_good_path(), settings.COUNTRIES_SEED_PATH):
+        if not path or not os.path.exists(path):
+            continue
+        if stats.total_countries and stats.last_refreshed_at and \
+                recordings.read_meta(path).created_at < stats.last_refreshed_at:
+            continue
+        return path
+    return None
+
+
+def fetch_upstream(stream: bool = False, source=None) -> UpstreamData:
+    """
+    Fetch from source (default: the configured one); when the live APIs
+    fail, fall back to the last good recording if settings.UPSTREAM_FALLBACK
+    allows it.
+    """
+    source = source or get_source()
+    try:
+        return source.fetch(stream=stream)
+    except Exception as e:
+        path = fallback_path() if settings.UPSTREAM_FALLBACK and source.name == 'live' else None
+        if path is None:
+            raise
+        logger.warning("Upstream fetch failed (%s); replaying %s", e, path)
+        return RecordingSource(path).fetch(stream=stream)._replace(source='fallback')
+
+
+def save_last_good() -> Optional[str]:
+    """
+    Keep the payload the last live refresh processed (the bodies stored by
+    ConditionalFetcher) as a recording; returns its path, or None if the
+    HTTP cache does not hold both documents.
+    """
+    countries_path, _ = ConditionalFetcher.load_cached_meta('countries', CountryService.COUNTRIES_URL)
+    rates_body, _ = ConditionalFetcher.load_cached('exchange_rates', CountryService.EXCHANGE_RATES_URL)
+    if countries_path is None or rates_body is None:
+        return None
+    rates = json.loads(rates_body).get('rates', {})
+    path = last_good_path()
+    recordings.write(path, iter_json_array(iter_file(countries_path)), rates)
+    return path
+
+
+def record(path: str, source_name: str = 'live') -> int:
+    """Capture the current upstream data into a recording; returns the number of countries"""
+    upstream = get_source(source_name).fetch(stream=True)
+    return recordings.write(path, upstream.countries, upstream.exchange_rates)
+
+
+class StubUpstreamServer(ThreadingHTTPServer):
+    """
+    Serves a recording as /countries and /rates in the upstream formats,
+    with ETags so conditional requests get 304s like the real APIs.
+    """
+
+    def __init__(self, address, path: str):
+        meta = recordings.read_meta(path)
+        countries = json.dumps(list(recordings.iter_countries(path))).encode()
+        rates = json.dumps({'result': 'success', 'base_code': 'USD', 'rates': meta.exchange_rates}).encode()
+        self.documents = {
+            '/countries': (countries, '"%s"' % hashlib.sha1(countries).hexdigest()),
+            '/rates': (rates, '"%s"' % hashlib.sha1(rates).hexdigest()),
+        }
+        # (path, If-None-Match) of the latest requests, oldest first
+        self.hits = deque(maxlen=1000)
+        super().__init__(address, StubUpstreamHandler)
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        self.server.hits.append((path, self.headers.get('If-None-Match')))
+        document = self.server.documents.get(path)
+        if document is None:
+            self.send_error(404)
+            return
+        body, etag = document
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("stub upstream: " + format, *args)
@@ -0,0 +1,100 @@
+"""
+Incremental parsing of large JSON arrays.
+
+iter_json_array turns a stream of byte chunks (e.g. response.iter_content)
+into the array's items, decoding each one with json.JSONDecoder.raw_decode
+as soon as it is complete. Only the current partial item is buffered, so
+memory stays flat no matter how large the document is.
+"""
+import codecs
+import json
+from typing import Iterable, Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]'
+
+
+def iter_file(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[object]:
+    """
+    Yield the items of a top-level JSON array read from byte chunks.
+
+    Raises ValueError if the document is not a well-formed array.
+    """
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    finished = False
+    state = 'start'  # start -> first item or ']' -> item -> ',' or ']' -> done
+
+    def more() -> bool:
+        """Append the next chunk to the buffer; False once the stream is exhausted"""
+        nonlocal buffer, pos, finished
+        if finished:
+            return False
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            finished = True
+            buffer = buffer[pos:] + utf8.decode(b'', final=True)
+            pos = 0
+            return False
+        # Drop what was already consumed before growing the buffer
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        return True
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= len(buffer):
+            if more():
+                continue
+            if state == 'done':
+                return
+            raise ValueError('Unexpected end of JSON array')
+
+        char = buffer[pos]
+        if state == 'done':
+            raise ValueError(f'Unexpected data after JSON array at {char!r}')
+        if state == 'start':
+            if char != '[':
+                raise ValueError('Expected a JSON array')
+            pos += 1
+            state = 'first'
+            continue
+        if state in ('first', 'separator') and char == ']':
+            pos += 1
+            state = 'done'
+            continue
+        if state == 'separator':
+            if char != ',':
+                raise ValueError(f'Expected "," or "]" in JSON array, got {char!r}')
+            pos += 1
+            state = 'item'
+            continue
+
+        try:
+            item, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if more():
+                continue
+            raise ValueError('Truncated or invalid item in JSON array')
+        if (end == len(buffer) or buffer[end] not in _DELIMITERS) and more():
+            # A number cut at the chunk boundary ("2" of "2.5") parses too early
+            continue
+        pos = end
+        state = 'separator'
+        yield item
@@ -1,3 +1,1294 @@
-from django.test import TestCase
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import async_views, benchmarks, gdp, metrics, recordings, sources
+from .cache import bump_dataset_version, get_dataset_version
+from .image_service import SummaryImageGenerator, file_lock
+from .models import Country, CountryStats, Currency, RefreshJob, Snapshot
+from .pagination import COUNTRY_FIELDS, SORTS, encode_cursor
+from .refresh_service import RefreshService
+from .replica import CountryReplica
+from .serializers import CountrySerializer
+from .seed_service import SeedService
+from .services import CountryService, ConditionalFetcher
+from .streaming import iter_json_array
+
+COUNTRIES_PAYLOAD = [
+    {
+        'name': 'Nigeria',
+        'capital': 'Abuja',
+        'region': 'Africa',
+        'population': 206139587,
+        'flag': 'https://flagcdn.com/ng.svg',
+        'currencies': [{'code': 'NGN'}],
+    },
+    {
+        'name': 'Ghana',
+        'capital': 'Accra',
+        'region': 'Africa',
+        'population': 31072945,
+        'flag': 'https://flagcdn.com/gh.svg',
+        'currencies': [{'code': 'GHS'}],
+    },
+]
+
+RATES_PAYLOAD = {'result': 'success', 'rates': {'USD': 1, 'NGN': 1600.5, 'GHS': 15.2}}
+
+
+class CountriesTestCase(TestCase):
+    """
+    Every test runs against its own throwaway CACHE_DIR (self.cache_dir)
+    and an empty in-memory Django cache, so the dataset version, HTTP
+    cache, images and cached responses of a dev server on the same
+    checkout are never touched and nothing leaks between tests.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.class_cache_dir = tempfile.mkdtemp()
+        cls.cache_override = override_settings(
+            CACHE_DIR=cls.class_cache_dir,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        )
+        cls.cache_override.enable()
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.cache_override.disable()
+            shutil.rmtree(cls.class_cache_dir, ignore_errors=True)
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.cache_override.disable()
+        shutil.rmtree(cls.class_cache_dir, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        # Removed with the class directory
+        self.cache_dir = tempfile.mkdtemp(dir=self.class_cache_dir)
+        settings_override = override_settings(CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+
+class StubUpstreamTestCase(CountriesTestCase):
+    """Points CountryService at a stub server replaying COUNTRIES_PAYLOAD and RATES_PAYLOAD"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        recording = os.path.join(cls.class_cache_dir, 'upstream.jsonl.gz')
+        recordings.write(recording, COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+        cls.server = sources.StubUpstreamServer(('127.0.0.1', 0), recording)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.url_patches = [
+            mock.patch.object(CountryService, 'COUNTRIES_URL', f'{base_url}/countries'),
+            mock.patch.object(CountryService, 'EXCHANGE_RATES_URL', f'{base_url}/rates'),
+        ]
+        for patch in cls.url_patches:
+            patch.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for patch in cls.url_patches:
+            patch.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.hits.clear()
+
+
+class ConditionalFetchTests(StubUpstreamTestCase):
+
+    def test_first_fetch_downloads_both_sources(self):
+        upstream = CountryService.fetch_upstream()
+
+        self.assertEqual(upstream.countries, COUNTRIES_PAYLOAD)
+        self.assertEqual(upstream.exchange_rates, RATES_PAYLOAD['rates'])
+        self.assertFalse(upstream.not_modified)
+        self.assertCountEqual(self.server.hits, [('/countries', None), ('/rates', None)])
+
+    def test_second_fetch_is_conditional_and_served_from_disk(self):
+        CountryService.fetch_upstream()
+        ConditionalFetcher.promote_staged()
+        self.server.hits.clear()
+
+        upstream = CountryService.fetch_upstream()
+
+        self.assertTrue(upstream.not_modified)
+        self.assertEqual(upstream.countries, COUNTRIES_PAYLOAD)
+        self.assertEqual(upstream.exchange_rates, RATES_PAYLOAD['rates'])
+        self.assertCountEqual(
+            self.server.hits,
+            [('/countries', self.server.documents['/countries'][1]), ('/rates', self.server.documents['/rates'][1])],
+        )
+
+    def test_cached_body_for_another_url_is_ignored(self):
+        ConditionalFetcher.fetch('countries', CountryService.COUNTRIES_URL)
+        ConditionalFetcher.promote_staged()
+        body, meta = ConditionalFetcher.load_cached('countries', CountryService.COUNTRIES_URL + '?v=2')
+
+        self.assertIsNone(body)
+        self.assertEqual(meta, {})
+
+
+    def test_failed_refresh_does_not_make_the_next_fetch_conditional(self):
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD[:1], RATES_PAYLOAD['rates'])
+        with mock.patch.object(RefreshService, 'upsert_countries', side_effect=ValueError('upsert failed')):
+            with self.assertRaisesMessage(ValueError, 'upsert failed'):
+                RefreshService.run_refresh()
+        self.server.hits.clear()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = RefreshService.run_refresh()
+
+        self.assertEqual(result['countries_processed'], 2)
+        self.assertEqual(Country.objects.count(), 2)
+        self.assertCountEqual(self.server.hits, [('/countries', None), ('/rates', None)])
+
+        self.server.hits.clear()
+        self.assertTrue(CountryService.fetch_upstream().not_modified)
+
+
+class StreamingFetchTests(StubUpstreamTestCase):
+
+    def test_countries_are_parsed_while_streaming_and_cached_when_complete(self):
+        result = ConditionalFetcher.fetch_stream('countries', CountryService.COUNTRIES_URL)
+        staged_path, _ = ConditionalFetcher._paths('countries', staged=True)
+
+        self.assertFalse(result.not_modified)
+        self.assertEqual(next(result.data), COUNTRIES_PAYLOAD[0])
+        self.assertFalse(os.path.exists(staged_path))
+        self.assertEqual(list(result.data), COUNTRIES_PAYLOAD[1:])
+        self.assertTrue(os.path.exists(staged_path))
+
+        ConditionalFetcher.promote_staged()
+        second = ConditionalFetcher.fetch_stream('countries', CountryService.COUNTRIES_URL)
+        self.assertTrue(second.not_modified)
+        self.assertEqual(list(second.data), COUNTRIES_PAYLOAD)
+
+    def test_countries_response_is_closed_when_the_rates_fetch_fails(self):
+        responses = []
+        session_get = ConditionalFetcher.session().get
+
+        def get(url, **kwargs):
+            responses.append(session_get(url, **kwargs))
+            return responses[-1]
+
+        rates_url = 'http://127.0.0.1:1/rates'  # nothing listens there
+        with mock.patch.object(ConditionalFetcher.session(), 'get', side_effect=get):
+            with self.assertRaisesMessage(Exception, 'Could not fetch data from exchange rates API'):
+                CountryService.fetch_upstream(stream=True, rates_url=rates_url)
+
+        countries = next(response for response in responses if response.url == CountryService.COUNTRIES_URL)
+        self.assertTrue(countries.raw.closed)
+
+    def test_json_array_items_survive_any_chunking(self):
+        document = [1, 2.5, -3e2, 'a\u00e9"]', None, True, {'a': [1, {'b': '\u00fc'}]}]
+        body = json.dumps(document, ensure_ascii=False).encode()
+
+        for size in (1, 2, 3, 7, len(body)):
+            chunks = (body[i:i + size] for i in range(0, len(body), size))
+            self.assertEqual(list(iter_json_array(chunks)), document)
+
+        for invalid in (b'{}', b'[1,2', b'[1 2]', b'[1]x'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array([invalid]))
+
+    def test_streamed_refresh_writes_in_batches(self):
+        payload = COUNTRIES_PAYLOAD + [dict(COUNTRIES_PAYLOAD[0], population=5)]
+
+        with mock.patch.object(RefreshService, 'BATCH_SIZE', 1):
+            result = RefreshService.upsert_countries(iter(payload), RATES_PAYLOAD['rates'])
+
+        # The repeated name lands in a later batch and still wins
+        self.assertEqual(result['countries_new'], 2)
+        self.assertEqual(Country.objects.get(name='Nigeria').population, 5)
+        self.assertEqual(Snapshot.objects.get().values.count(), 2)
+
+
+@override_settings(REFRESH_JOBS_INLINE=True)
+class RefreshViewTests(StubUpstreamTestCase):
+
+    def test_refresh_runs_as_job_and_reports_through_status(self):
+        response = self.client.post('/countries/refresh', secure=True)
+
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+
+        job = self.client.get(f'/status?job={job_id}', secure=True).json()['refresh_job']
+        self.assertEqual(job['status'], RefreshJob.STATUS_SUCCEEDED)
+        self.assertEqual(job['progress'], 100)
+        self.assertEqual(job['result']['countries_created'], 2)
+        self.assertCountEqual(job['timings'], ['fetch', 'upsert', 'render'])
+
+    def test_concurrent_refresh_requests_are_merged(self):
+        running = RefreshJob.objects.create(status=RefreshJob.STATUS_RUNNING)
+
+        response = self.client.post('/countries/refresh', secure=True)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['job_id'], running.pk)
+        self.assertEqual(RefreshJob.objects.count(), 1)
+
+    def test_running_jobs_are_only_expired_without_a_recent_heartbeat(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        running = RefreshJob.objects.create(status=RefreshJob.STATUS_RUNNING)
+        # Created and started an hour ago, but still beating
+        RefreshJob.objects.filter(pk=running.pk).update(
+            created_at=long_ago, started_at=long_ago, heartbeat_at=timezone.now()
+        )
+
+        self.assertEqual(self.client.post('/countries/refresh', secure=True).json()['job_id'], running.pk)
+
+        RefreshJob.objects.filter(pk=running.pk).update(heartbeat_at=long_ago)
+        response = self.client.post('/countries/refresh', secure=True)
+
+        self.assertNotEqual(response.json()['job_id'], running.pk)
+        running.refresh_from_db()
+        self.assertEqual(running.status, RefreshJob.STATUS_FAILED)
+        self.assertFalse(running.is_active)
+
+    def test_jobs_never_started_expire_from_creation(self):
+        queued = RefreshJob.objects.create()
+        RefreshJob.objects.filter(pk=queued.pk).update(created_at=timezone.now() - timedelta(hours=1))
+
+        response = self.client.post('/countries/refresh', secure=True)
+
+        self.assertNotEqual(response.json()['job_id'], queued.pk)
+        job = RefreshJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(job.status, RefreshJob.STATUS_SUCCEEDED)
+        self.assertIsNotNone(job.heartbeat_at)
+
+    def test_refresh_skips_processing_when_upstream_not_modified(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/countries/refresh', secure=True)
+
+        with mock.patch('countries.refresh_service.RefreshService.upsert_countries') as upsert:
+            self.client.post('/countries/refresh', secure=True)
+
+        upsert.assert_not_called()
+        job = RefreshJob.objects.first()
+        self.assertEqual(job.result['countries_processed'], 0)
+        self.assertEqual(Country.objects.count(), 2)
+
+
+class UpstreamSourceTests(StubUpstreamTestCase):
+
+    def test_live_refresh_keeps_the_last_good_payload_for_fallback(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(RefreshService.run_refresh()['source'], 'live')
+
+        path = sources.last_good_path()
+        self.assertEqual(list(recordings.iter_countries(path)), COUNTRIES_PAYLOAD)
+        self.assertEqual(recordings.read_meta(path).exchange_rates, RATES_PAYLOAD['rates'])
+
+        with mock.patch.object(CountryService, 'fetch_upstream', side_effect=Exception('upstream down')):
+            result = RefreshService.run_refresh()
+
+        self.assertEqual(result['source'], 'fallback')
+        self.assertEqual(result['countries_unchanged'], 2)
+
+    def test_no_fallback_to_data_older_than_the_database(self):
+        old_seed = os.path.join(self.cache_dir, 'old_seed.jsonl.gz')
+        recordings.write(old_seed, COUNTRIES_PAYLOAD[:1], RATES_PAYLOAD['rates'],
+                         created_at=timezone.now() - timedelta(days=1))
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+        with override_settings(COUNTRIES_SEED_PATH=old_seed), \
+                mock.patch.object(CountryService, 'fetch_upstream', side_effect=Exception('upstream down')):
+            with self.assertRaisesMessage(Exception, 'upstream down'):
+                RefreshService.run_refresh()
+
+    def test_stub_server_replays_a_recording_with_validators(self):
+        path = os.path.join(self.cache_dir, 'recording.jsonl.gz')
+        recordings.write(path, COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+        server = sources.StubUpstreamServer(('127.0.0.1', 0), path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        source = sources.StubServerSource(f'http://127.0.0.1:{server.server_port}')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = RefreshService.run_refresh(source=source)
+
+        self.assertEqual(result['source'], 'stub')
+        self.assertEqual(result['countries_new'], 2)
+        self.assertTrue(source.fetch().not_modified)
+
+    def test_upstream_command_records_and_replays_offline(self):
+        path = os.path.join(self.cache_dir, 'capture.jsonl.gz')
+        call_command('upstream', 'record', '--output', path, stdout=io.StringIO())
+        self.server.hits.clear()
+
+        out = io.StringIO()
+        call_command('upstream', 'replay', '--input', path, stdout=out)
+
+        self.assertIn('new=2', out.getvalue())
+        self.assertFalse(self.server.hits)
+        self.assertEqual(Country.objects.get(name='Ghana').exchange_rate, Decimal('15.2'))
+
+
+class IncrementalRefreshTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+    def test_unchanged_countries_are_not_rewritten(self):
+        before = dict(Country.objects.values_list('name', 'last_refreshed_at'))
+        gdp_before = dict(Country.objects.values_list('name', 'estimated_gdp'))
+
+        result = RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+        self.assertEqual(result['countries_unchanged'], 2)
+        self.assertEqual(result['countries_changed'], 0)
+        self.assertEqual(result['countries_new'], 0)
+        self.assertEqual(result['countries_updated'], 2)
+        self.assertEqual(dict(Country.objects.values_list('name', 'last_refreshed_at')), before)
+        self.assertEqual(dict(Country.objects.values_list('name', 'estimated_gdp')), gdp_before)
+
+    def test_changed_new_and_removed_countries_are_reported(self):
+        payload = [
+            dict(COUNTRIES_PAYLOAD[0], population=1),
+            {'name': 'Togo', 'population': 8278737, 'currencies': [{'code': 'XOF'}]},
+        ]
+
+        result = RefreshService.upsert_countries(payload, RATES_PAYLOAD['rates'])
+
+        self.assertEqual(result['countries_changed'], 1)
+        self.assertEqual(result['countries_new'], 1)
+        self.assertEqual(result['countries_unchanged'], 0)
+        self.assertEqual(result['countries_removed'], 1)
+        self.assertEqual((result['countries_created'], result['countries_updated']), (1, 1))
+        self.assertTrue(Country.objects.filter(name='Ghana').exists())
+        self.assertEqual(Country.objects.get(name='Nigeria').population, 1)
+
+    def test_prune_deletes_countries_missing_upstream(self):
+        result = RefreshService.upsert_countries(COUNTRIES_PAYLOAD[:1], RATES_PAYLOAD['rates'], prune=True)
+
+        self.assertEqual(result['countries_removed'], 1)
+        self.assertEqual(list(Country.objects.values_list('name', flat=True)), ['Nigeria'])
+
+
+class CountryStatsTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            RefreshService.upsert_countries(
+                COUNTRIES_PAYLOAD + [{'name': 'Togo', 'region': 'Africa', 'population': 8278737}],
+                RATES_PAYLOAD['rates'],
+            )
+
+    def test_refresh_fills_aggregates_in_the_same_transaction(self):
+        stats = CountryStats.objects.get()
+        gdps = dict(Country.objects.values_list('name', 'estimated_gdp'))
+
+        self.assertEqual(stats.total_countries, 3)
+        self.assertEqual(stats.total_population, 206139587 + 31072945 + 8278737)
+        self.assertEqual(stats.total_estimated_gdp, gdps['Nigeria'] + gdps['Ghana'])
+        self.assertEqual([entry['name'] for entry in stats.top_by_gdp], ['Ghana', 'Nigeria'])
+        self.assertEqual([entry['name'] for entry in stats.top_by_population], ['Nigeria', 'Ghana', 'Togo'])
+        self.assertEqual(stats.regions['Africa']['countries'], 3)
+        self.assertEqual(stats.currencies[''], {'countries': 1, 'population': 8278737, 'estimated_gdp': '0'})
+        self.assertEqual(
+            stats.last_refreshed_at, Country.objects.order_by('-last_refreshed_at')[0].last_refreshed_at
+        )
+
+    def test_stats_endpoints_read_a_single_row(self):
+        with self.settings(COUNTRY_REPLICA_ENABLED=False), self.assertNumQueries(1):
+            response = self.client.get('/stats', secure=True)
+        self.assertEqual(response.json()['total_countries'], 3)
+        self.assertIsInstance(response.json()['top_by_gdp'][0]['estimated_gdp'], float)
+
+        # From the in-memory replica: no query at all once it is loaded
+        self.client.get('/stats', secure=True)
+        with self.assertNumQueries(0):
+            regions = self.client.get('/stats/regions', secure=True).json()
+        self.assertEqual(regions['Africa']['population'], 206139587 + 31072945 + 8278737)
+
+        currencies = self.client.get('/stats/currencies', secure=True).json()
+        self.assertEqual(set(currencies), {'', 'GHS', 'NGN'})
+
+    def test_delete_and_prune_update_aggregates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/countries/Togo/delete', secure=True)
+        self.assertEqual(self.client.get('/status', secure=True).json()['total_countries'], 2)
+
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD[:1], RATES_PAYLOAD['rates'], prune=True)
+        stats = CountryStats.objects.get()
+        self.assertEqual(stats.total_countries, 1)
+        self.assertEqual(list(stats.currencies), ['NGN'])
+
+    def test_missing_row_is_built_on_first_read(self):
+        CountryStats.objects.all().delete()
+        self.assertEqual(CountryStats.current().total_countries, 3)
+
+
+class SnapshotTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+        self.baseline = Snapshot.objects.get()
+
+    def refresh_with(self, rates, payload=COUNTRIES_PAYLOAD, prune=False):
+        RefreshService.upsert_countries(payload, rates, prune=prune)
+        return Snapshot.objects.first()
+
+    def test_only_changed_values_are_stored(self):
+        self.assertEqual(self.baseline.values.count(), 2)
+
+        # Unchanged data records nothing; one moved rate stores one row
+        self.refresh_with(RATES_PAYLOAD['rates'])
+        self.assertEqual(Snapshot.objects.count(), 1)
+        snapshot = self.refresh_with(dict(RATES_PAYLOAD['rates'], GHS=16))
+
+        self.assertEqual(Snapshot.objects.count(), 2)
+        self.assertEqual(list(snapshot.values.values_list('name', flat=True)), ['Ghana'])
+
+    def test_as_of_returns_the_historical_values(self):
+        old_gdp = Country.objects.get(name='Ghana').estimated_gdp
+        self.refresh_with(dict(RATES_PAYLOAD['rates'], GHS=16))
+
+        response = self.client.get(f'/countries?as_of={self.baseline.pk}&sort=gdp_desc', secure=True)
+        rows = response.json()
+
+        self.assertEqual(response['X-Snapshot-Id'], str(self.baseline.pk))
+        self.assertEqual([row['name'] for row in rows], ['Ghana', 'Nigeria'])
+        self.assertEqual(rows[0]['exchange_rate'], 15.2)
+        self.assertEqual(rows[0]['estimated_gdp'], float(old_gdp))
+
+        latest = self.client.get('/countries', {'as_of': timezone.now().isoformat()}, secure=True).json()
+        self.assertEqual({row['name']: row['exchange_rate'] for row in latest}['Ghana'], 16.0)
+
+    def test_as_of_validation(self):
+        self.assertEqual(self.client.get('/countries?as_of=yesterday', secure=True).status_code, 400)
+        self.assertEqual(self.client.get('/countries?as_of=2000-01-01', secure=True).status_code, 404)
+        self.assertEqual(
+            self.client.get(f'/countries?as_of={self.baseline.pk}&fields=capital', secure=True).status_code, 400
+        )
+
+    def test_as_of_rejects_filters_snapshots_cannot_apply(self):
+        # Snapshots have no region and only the primary currency; the live
+        # currency filter matches every linked currency
+        for query in ('region=Africa', 'currency=NGN', 'limit=1', 'cursor=abc'):
+            response = self.client.get(f'/countries?as_of={self.baseline.pk}&{query}', secure=True)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn(query.split('=')[0], response.json()['error'])
+
+    def test_diff_between_snapshots(self):
+        payload = [dict(COUNTRIES_PAYLOAD[0], population=1), {'name': 'Togo', 'population': 8278737}]
+        snapshot = self.refresh_with(RATES_PAYLOAD['rates'], payload, prune=True)
+
+        diff = self.client.get(f'/snapshots/{snapshot.pk}/diff', secure=True).json()
+
+        self.assertEqual(diff['from']['id'], self.baseline.pk)
+        self.assertEqual([row['name'] for row in diff['added']], ['Togo'])
+        self.assertEqual([row['name'] for row in diff['removed']], ['Ghana'])
+        self.assertEqual(diff['changed'][0]['name'], 'Nigeria')
+        self.assertEqual(diff['changed'][0]['changes']['population'], {'from': 206139587, 'to': 1})
+
+    def test_delete_is_recorded(self):
+        self.client.delete('/countries/Ghana/delete', secure=True)
+
+        snapshot = Snapshot.objects.first()
+        self.assertEqual(snapshot.changed_countries, 1)
+        self.assertEqual(
+            [row['name'] for row in self.client.get(f'/countries?as_of={snapshot.pk}', secure=True).json()],
+            ['Nigeria'],
+        )
+
+
+@override_settings(COUNTRY_LIST_CACHE_ENABLED=False)
+class MultiCurrencyTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        bump_dataset_version()
+        self.payload = COUNTRIES_PAYLOAD + [{
+            'name': 'Zimbabwe',
+            'population': 14862924,
+            'currencies': [{'code': 'USD'}, {'code': 'bwp'}, {'code': 'USD'}, {'code': None}],
+        }]
+        RefreshService.upsert_countries(self.payload, dict(RATES_PAYLOAD['rates'], BWP=13.6))
+
+    def test_every_currency_is_linked_in_order(self):
+        zimbabwe = Country.objects.get(name='Zimbabwe')
+
+        self.assertEqual(zimbabwe.currency_code, 'USD')
+        self.assertEqual(
+            list(zimbabwe.countrycurrency_set.order_by('position').values_list('currency__code', flat=True)),
+            ['USD', 'BWP'],
+        )
+        self.assertEqual(Currency.objects.get(code='BWP').exchange_rate, Decimal('13.6'))
+
+    def test_filter_matches_secondary_currencies(self):
+        response = self.client.get('/countries?currency=bwp', secure=True)
+        self.assertEqual([c['name'] for c in response.json()], ['Zimbabwe'])
+        self.assertEqual(CountryStats.current().currencies['BWP']['countries'], 1)
+
+    def test_rate_change_updates_one_currency_row(self):
+        before = dict(Country.objects.values_list('name', 'last_refreshed_at'))
+
+        result = RefreshService.upsert_countries(self.payload, dict(RATES_PAYLOAD['rates'], BWP=14))
+
+        self.assertEqual(result['countries_changed'], 0)
+        self.assertEqual(dict(Country.objects.values_list('name', 'last_refreshed_at')), before)
+        self.assertEqual(Currency.objects.get(code='BWP').exchange_rate, Decimal('14'))
+
+
+class CurrencyConversionTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+        bump_dataset_version()
+
+    def test_rates_and_single_conversion(self):
+        rates = self.client.get('/rates?base=ghs&symbols=NGN,USD', secure=True).json()
+        self.assertEqual(rates, {'base': 'GHS', 'rates': {'NGN': 1600.5 / 15.2, 'USD': 1 / 15.2}})
+
+        converted = self.client.get('/convert?from=USD&to=NGN&amount=2.5', secure=True).json()
+        self.assertEqual(converted['result'], 2.5 * 1600.5)
+        self.assertEqual(converted['rate'], 1600.5)
+
+    def test_batch_conversion_is_served_from_memory(self):
+        conversions = [{'from': 'NGN', 'to': 'GHS', 'amount': n} for n in range(100)]
+        self.client.post('/convert', {'conversions': conversions[:1]}, content_type='application/json', secure=True)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                '/convert', {'conversions': conversions}, content_type='application/json', secure=True
+            )
+
+        results = [row['result'] for row in response.json()['conversions']]
+        self.assertEqual(results, [n * 15.2 / 1600.5 for n in range(100)])
+
+    def test_table_is_reloaded_when_the_dataset_changes(self):
+        self.client.get('/rates', secure=True)
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, dict(RATES_PAYLOAD['rates'], GHS=16))
+        bump_dataset_version()  # on_commit does not fire inside TestCase
+
+        self.assertEqual(self.client.get('/rates?symbols=GHS', secure=True).json()['rates'], {'GHS': 16.0})
+
+    def test_invalid_conversions_are_rejected(self):
+        for query in ('from=USD&to=XXX', 'from=USD&to=NGN&amount=nan', 'from=USD&to=NGN&amount=abc'):
+            self.assertEqual(self.client.get(f'/convert?{query}', secure=True).status_code, 400)
+        response = self.client.post('/convert', {'conversions': 'x'}, content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_currencies_are_named(self):
+        for query, missing in (('', 'from, to'), ('from=USD', 'to'), ('to=NGN&from=', 'from')):
+            response = self.client.get(f'/convert?{query}', secure=True)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': f'Missing required parameter(s): {missing}'})
+        response = self.client.post(
+            '/convert', {'conversions': [{'from': 'USD', 'to': 'NGN'}, {'from': 'USD'}]},
+            content_type='application/json', secure=True,
+        )
+        self.assertEqual(response.json(), {'error': 'Missing required parameter(s): to'})
+
+
+class LoadCountriesCommandTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seed_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, seed_dir, ignore_errors=True)
+        self.seed_path = os.path.join(seed_dir, 'seed.jsonl.gz')
+        recordings.write(self.seed_path, COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+    def load(self, *args):
+        out = io.StringIO()
+        call_command('load_countries', '--path', self.seed_path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_seed_goes_through_the_refresh_pipeline(self):
+        self.assertIn('new=2', self.load())
+
+        nigeria = Country.objects.get(name='Nigeria')
+        self.assertEqual(nigeria.exchange_rate, Decimal('1600.5'))
+        self.assertIsNotNone(nigeria.estimated_gdp)
+        self.assertEqual(CountryStats.objects.get().total_countries, 2)
+
+    def test_database_at_the_seed_version_is_skipped(self):
+        self.load()
+
+        with self.assertNumQueries(1):
+            self.assertIn('already up to date', self.load())
+
+    def test_live_mode_falls_back_to_the_seed(self):
+        with mock.patch.object(RefreshService, 'run_refresh', side_effect=Exception('upstream down')):
+            output = self.load('--live')
+
+        self.assertIn('upstream down', output)
+        self.assertEqual(Country.objects.count(), 2)
+
+    def test_bundled_seed_is_readable(self):
+        meta = recordings.read_meta(SeedService.path())
+        self.assertTrue(meta.exchange_rates)
+        self.assertTrue(next(recordings.iter_countries(SeedService.path()))['name'])
+
+
+class DatasetVersionTests(CountriesTestCase):
+
+    def test_bump_in_another_worker_process_is_seen_on_the_next_read(self):
+        before = get_dataset_version()
+
+        worker = multiprocessing.get_context('fork').Process(target=bump_dataset_version)
+        worker.start()
+        worker.join()
+
+        self.assertEqual(worker.exitcode, 0)
+        self.assertGreater(get_dataset_version(), before)
+
+    def test_new_version_drops_state_rendered_for_older_ones(self):
+        version = get_dataset_version()
+        CountrySerializer._row_cache.set((version, COUNTRY_FIELDS, 1), b'{}')
+
+        bump_dataset_version()
+        get_dataset_version()
+
+        self.assertEqual(len(CountrySerializer._row_cache), 0)
+
+
+@override_settings(COUNTRY_LIST_CACHE_ENABLED=True)
+class ListCacheTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+    def test_etag_revalidation_returns_304(self):
+        first = self.client.get('/countries?region=Africa', secure=True)
+        etag = first['ETag']
+
+        second = self.client.get('/countries?region=africa', secure=True, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], etag)
+
+    def test_cached_response_matches_uncached_response(self):
+        cached = self.client.get('/countries?sort=gdp_desc', secure=True)
+        with self.settings(COUNTRY_LIST_CACHE_ENABLED=False):
+            uncached = self.client.get('/countries?sort=gdp_desc', secure=True)
+
+        self.assertEqual(cached.content, uncached.content)
+
+    def test_delete_invalidates_cached_list(self):
+        etag = self.client.get('/countries', secure=True)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/countries/Ghana/delete', secure=True)
+        response = self.client.get('/countries', secure=True, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['name'] for c in response.json()], ['Nigeria'])
+
+
+class AsyncViewTests(CountriesTestCase):
+    """The async read views answer exactly like the DRF views they replace under ASGI"""
+
+    def setUp(self):
+        super().setUp()
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+        bump_dataset_version()
+        self.factory = AsyncRequestFactory()
+
+    async def assertSameResponse(self, view, path, *args, headers=None):
+        expected = await self.async_client.get(path, secure=True, headers=headers)
+        actual = await view(self.factory.get(path, secure=True, headers=headers), *args)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.content, expected.content)
+        return actual
+
+    async def test_list_matches_the_sync_view(self):
+        paths = (
+            '/countries?sort=gdp_desc', '/countries?limit=1', '/countries?as_of=99', '/countries?as_of=99&region=x',
+            '/countries?limit=x',
+        )
+        for path in paths:
+            for enabled in (False, True):
+                with self.subTest(path=path, cache=enabled), self.settings(COUNTRY_LIST_CACHE_ENABLED=enabled):
+                    await self.assertSameResponse(async_views.list_countries, path)
+
+        response = await self.assertSameResponse(async_views.list_countries, '/countries')
+        revalidated = await async_views.list_countries(
+            self.factory.get('/countries', secure=True, headers={'If-None-Match': response['ETag']})
+        )
+        self.assertEqual(revalidated.status_code, 304)
+
+    async def test_country_and_status_match_the_sync_views(self):
+        await self.assertSameResponse(async_views.get_country_by_name, '/countries/nigeria', 'nigeria')
+        await self.assertSameResponse(async_views.get_country_by_name, '/countries/Atlantis', 'Atlantis')
+        job = await RefreshJob.objects.acreate(status=RefreshJob.STATUS_SUCCEEDED, result={'countries_processed': 2})
+        await self.assertSameResponse(async_views.get_status, '/status')
+        await self.assertSameResponse(async_views.get_status, f'/status?job={job.pk}')
+        await self.assertSameResponse(async_views.get_status, '/status?job=404')
+        for job_id in ('abc', '%C2%B2', '9' * 30):
+            response = await self.assertSameResponse(async_views.get_status, f'/status?job={job_id}')
+            self.assertEqual(response.status_code, 400)
+
+    async def test_image_is_served_with_validators(self):
+        response = await async_views.get_countries_image(self.factory.get('/countries/image', secure=True))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content[:8], b'\x89PNG\r\n\x1a\n')
+
+        await self.assertSameResponse(async_views.get_countries_image, '/countries/image?format=svg&width=300')
+        revalidated = await self.assertSameResponse(
+            async_views.get_countries_image, '/countries/image', headers={'If-None-Match': response['ETag']}
+        )
+        self.assertEqual(revalidated.status_code, 304)
+
+    async def test_other_methods_are_rejected(self):
+        response = await async_views.list_countries(self.factory.post('/countries', secure=True))
+        expected = await self.async_client.post('/countries', secure=True)
+
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response.content, expected.content)
+
+
+class QueryPlanTests(CountriesTestCase):
+    """The filters and sorts used by the views must be served by an index"""
+
+    def setUp(self):
+        super().setUp()
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+        if connection.vendor == 'postgresql':
+            # The table is tiny; make the planner show which index it would use
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_name_lookup_uses_upper_name_index(self):
+        self.assertUsesIndex(Country.objects.iexact('name', 'ghana').order_by(), 'countries_upper_name_idx')
+
+    def test_region_filter_uses_upper_region_index(self):
+        self.assertUsesIndex(
+            Country.objects.iexact('region', 'africa').order_by('name'),
+            'countries_upper_region_idx',
+        )
+
+    def test_currency_filter_joins_through_currency_index(self):
+        plan = Country.objects.filter(currencies__code='NGN').order_by('name').explain()
+        # SQLite builds inline unique constraints as an automatic index
+        self.assertRegex(plan, 'country_currency_uniq|sqlite_autoindex_country_currencies')
+
+    def test_gdp_sort_uses_gdp_index(self):
+        self.assertUsesIndex(
+            Country.objects.exclude(estimated_gdp__isnull=True).order_by('-estimated_gdp', '-id'),
+            'countries_gdp_idx',
+        )
+
+    def test_population_sort_uses_population_index(self):
+        self.assertUsesIndex(Country.objects.order_by('population', 'id'), 'countries_population_idx')
+
+    def test_latest_refresh_uses_refreshed_index(self):
+        self.assertUsesIndex(Country.objects.order_by('-last_refreshed_at')[:1], 'countries_refreshed_idx')
+
+
+@override_settings(COUNTRY_LIST_CACHE_ENABLED=False)
+class ListPaginationTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        payload = [
+            {'name': f'Country {i:02d}', 'region': 'Africa', 'population': 1000 + (i % 4),
+             'currencies': [{'code': 'NGN' if i % 3 else 'XYZ'}]}
+            for i in range(23)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            RefreshService.upsert_countries(payload, RATES_PAYLOAD['rates'])
+
+    def collect_pages(self, query, limit):
+        names, cursor = [], None
+        while True:
+            url = f'/countries?{query}&limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+            page = self.client.get(url, secure=True).json()
+            self.assertLessEqual(len(page['results']), limit)
+            names.extend(row['name'] for row in page['results'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                return names
+
+    def test_keyset_pages_match_unpaginated_order_for_every_sort(self):
+        for sort in SORTS:
+            with self.subTest(sort=sort):
+                expected = [row['name'] for row in self.client.get(f'/countries?sort={sort}', secure=True).json()]
+                self.assertEqual(self.collect_pages(f'sort={sort}', limit=4), expected)
+
+    def test_fields_limits_the_returned_keys(self):
+        rows = self.client.get('/countries?fields=name,estimated_gdp&sort=gdp_desc', secure=True).json()
+
+        self.assertEqual(set(rows[0]), {'name', 'estimated_gdp'})
+        self.assertIsInstance(rows[0]['estimated_gdp'], float)
+
+    def test_invalid_parameters_are_rejected(self):
+        for query in ('fields=name,secret', 'limit=0', 'limit=abc', 'cursor=not-a-cursor'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'/countries?{query}', secure=True).status_code, 400)
+
+    def test_non_finite_and_non_integer_cursor_values_are_rejected(self):
+        for sort, value in (('gdp_desc', 'NaN'), ('gdp_asc', 'Infinity'), ('gdp_desc', '-inf'),
+                            ('population_asc', float('inf')), ('population_desc', float('nan')),
+                            ('population_asc', 1.9), ('population_desc', '12'), ('population_asc', True)):
+            cursor = encode_cursor(sort, {'estimated_gdp': value, 'population': value, 'id': 1})
+            with self.subTest(sort=sort, value=value):
+                response = self.client.get(f'/countries?sort={sort}&limit=1&cursor={cursor}', secure=True)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid cursor for this sort order'})
+
+    def test_cursor_from_another_sort_is_rejected(self):
+        cursor = self.client.get('/countries?sort=gdp_desc&limit=2', secure=True).json()['next_cursor']
+
+        response = self.client.get(f'/countries?sort=name_asc&cursor={cursor}', secure=True)
+
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(COUNTRY_LIST_CACHE_ENABLED=False)
+class CountryReplicaTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        payload = COUNTRIES_PAYLOAD + [
+            {'name': f'Country {i:02d}', 'region': 'Europe' if i % 2 else 'Africa', 'population': 1000 + (i % 4),
+             'currencies': [{'code': 'NGN' if i % 3 else 'GHS'}, {'code': 'EUR'}] if i % 5 else []}
+            for i in range(20)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            RefreshService.upsert_countries(payload, dict(RATES_PAYLOAD['rates'], EUR=0.9))
+
+    def test_every_filter_and_sort_matches_the_database(self):
+        for sort in SORTS:
+            for query in ('', '&region=africa', '&currency=eur', '&region=Europe&currency=NGN', '&limit=3'):
+                with self.subTest(sort=sort, query=query):
+                    path = f'/countries?sort={sort}{query}'
+                    with self.settings(COUNTRY_REPLICA_ENABLED=False):
+                        expected = self.client.get(path, secure=True).content
+                    self.assertEqual(self.client.get(path, secure=True).content, expected)
+
+    def test_reads_do_not_query_until_the_dataset_changes(self):
+        self.client.get('/countries', secure=True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/countries/NIGERIA', secure=True).json()['name'], 'Nigeria')
+            self.assertEqual(len(self.client.get('/countries?region=africa', secure=True).json()), 12)
+            self.assertEqual(self.client.get('/countries/Atlantis', secure=True).status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/countries/Nigeria/delete', secure=True)
+
+        self.assertEqual(self.client.get('/countries/Nigeria', secure=True).status_code, 404)
+        self.assertEqual(CountryReplica.current().stats.total_countries, 21)
+
+    def test_name_order_and_cursors_follow_the_database_collation(self):
+        names = ['Åland Islands', 'Zambia', 'Österreich', "Côte d'Ivoire", 'curaçao', 'Ísland', 'Cuba']
+        with self.captureOnCommitCallbacks(execute=True):
+            RefreshService.upsert_countries(
+                [{'name': name, 'population': 10, 'currencies': [{'code': 'EUR'}]} for name in names],
+                {'EUR': 0.9},
+            )
+        expected = list(Country.objects.order_by('name', 'id').values_list('name', flat=True))
+        self.assertEqual([record.name for record in CountryReplica.current().records], expected)
+
+        in_euros = list(Country.objects.filter(currencies__code='EUR').order_by('name').values_list('name', flat=True))
+        for sort, order in (('name_asc', in_euros), ('name_desc', in_euros[::-1])):
+            with self.subTest(sort=sort):
+                seen, cursor = [], ''
+                while cursor is not None:
+                    path = f'/countries?sort={sort}&currency=EUR&limit=2&cursor={cursor}'
+                    page = self.client.get(path, secure=True).json()
+                    seen += [row['name'] for row in page['results']]
+                    cursor = page['next_cursor']
+                self.assertEqual(seen, order)
+
+    def test_cursor_for_a_deleted_name_falls_back_to_sql(self):
+        page = self.client.get('/countries?limit=3', secure=True).json()
+        last = page['results'][-1]['name']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/countries/{last}/delete', secure=True)
+
+        path = f"/countries?limit=3&cursor={page['next_cursor']}"
+        with self.settings(COUNTRY_REPLICA_ENABLED=False):
+            expected = self.client.get(path, secure=True).content
+        self.assertEqual(self.client.get(path, secure=True).content, expected)
+
+
+class CountrySerializerTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+    def test_output_matches_drf_rendering_of_model_dicts(self):
+        expected = JSONRenderer().render([
+            {
+                'id': country.id,
+                'name': country.name,
+                'capital': country.capital,
+                'region': country.region,
+                'population': country.population,
+                'currency_code': country.currency_code,
+                'exchange_rate': float(country.exchange_rate) if country.exchange_rate else None,
+                'estimated_gdp': float(country.estimated_gdp) if country.estimated_gdp else None,
+                'flag_url': country.flag_url,
+                'last_refreshed_at': country.last_refreshed_at,
+            }
+            for country in Country.objects.order_by('name')
+        ])
+        columns = CountrySerializer.columns(COUNTRY_FIELDS)
+        rows = Country.objects.order_by('name').values_list(*columns)
+
+        self.assertEqual(json.loads(CountrySerializer.render_list(COUNTRY_FIELDS, columns, rows)), json.loads(expected))
+        self.assertEqual(CountrySerializer.render_list(COUNTRY_FIELDS, columns, rows, version=1), expected)
+
+    def test_get_country_by_name_is_case_insensitive(self):
+        response = self.client.get('/countries/gHaNa', secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'Ghana')
+        self.assertEqual(self.client.get('/countries/Atlantis', secure=True).status_code, 404)
+
+
+class CountryWriteTests(CountriesTestCase):
+
+    def test_bulk_create_computes_gdp_and_rounds_exchange_rate(self):
+        Country.objects.bulk_create([Country(name='Ghana', population=1000, exchange_rate=15.1234567)])
+
+        country = Country.objects.get(name='Ghana')
+        self.assertEqual(country.exchange_rate, Decimal('15.123457'))
+        self.assertIsNotNone(country.estimated_gdp)
+
+    def test_bulk_update_keeps_gdp_in_step_with_population(self):
+        Country.objects.bulk_create([Country(name='Ghana', population=1000, exchange_rate=1)])
+        country = Country.objects.get(name='Ghana')
+        country.population = 0
+
+        Country.objects.bulk_update([country], ['population'])
+
+        self.assertIsNone(Country.objects.get(name='Ghana').estimated_gdp)
+
+    @override_settings(GDP_MULTIPLIER_SEED='')
+    def test_gdp_is_computed_in_decimal_and_rounded_to_cents(self):
+        small = Country(name='Ghana', population=3, exchange_rate=Decimal('7'))
+        # float64 arithmetic would give ...162.40 here
+        large = Country(name='China', population=1380004385, exchange_rate=Decimal('0.0133'))
+
+        small.prepare_for_write()
+        large.prepare_for_write()
+
+        self.assertEqual(small.estimated_gdp, Decimal('765.23'))
+        self.assertEqual(large.estimated_gdp, Decimal('143374747578162.41'))
+
+    def test_interactive_save_keeps_unique_validation(self):
+        Country.objects.create(name='Ghana', population=1)
+
+        with self.assertRaises(ValidationError):
+            Country(name='Ghana', population=2).save()
+
+    def test_validate_for_write_runs_no_queries(self):
+        Country.objects.create(name='Ghana', population=1)
+        country = Country(name='Ghana', population=2, exchange_rate=1.5)
+        country.prepare_for_write()
+
+        with self.assertNumQueries(0):
+            country.validate_for_write()
+
+    def test_validate_for_write_rejects_invalid_values(self):
+        for country in (
+            Country(name='x' * 101, population=1),
+            Country(name='', population=1),
+            Country(name='Ghana', population=1, flag_url='ftp://flags/gh.svg'),
+            Country(name='Ghana', population=1, exchange_rate=Decimal('1e15')),
+        ):
+            with self.subTest(country=country.name[:10]), self.assertRaises(ValidationError):
+                country.validate_for_write()
+
+
+class GdpComputationTests(CountriesTestCase):
+
+    names = ['Ghana', 'Nigeria', 'Togo', 'Benin', 'Niger']
+    populations = [31072945, 206139587, 0, 12123198, 24206636]
+    rates = [Decimal('15.2'), Decimal('1600.5'), Decimal('655.9'), None, Decimal('655.957')]
+
+    def test_same_inputs_give_same_gdp(self):
+        first = gdp.compute_gdp_batch(self.names, self.populations, self.rates)
+        second = gdp.compute_gdp_batch(self.names, self.populations, self.rates)
+
+        self.assertEqual(first, second)
+        self.assertIsNone(first[2])
+        self.assertIsNone(first[3])
+
+    def test_batch_multipliers_match_single_ones(self):
+        self.assertEqual(gdp.gdp_multipliers(self.names), [gdp.gdp_multiplier(name) for name in self.names])
+
+    def test_single_row_matches_batch(self):
+        batch = gdp.compute_gdp_batch(self.names, self.populations, self.rates)
+        country = Country(name='Ghana', population=31072945, exchange_rate=Decimal('15.2'))
+
+        self.assertEqual(country.calculate_estimated_gdp(), batch[0])
+
+    def test_seed_changes_multipliers(self):
+        with self.settings(GDP_MULTIPLIER_SEED='a'):
+            seeded_a = gdp.gdp_multiplier('Ghana')
+        with self.settings(GDP_MULTIPLIER_SEED='b'):
+            seeded_b = gdp.gdp_multiplier('Ghana')
+
+        self.assertNotEqual(seeded_a, seeded_b)
+        self.assertTrue(1000 <= seeded_a < 2000)
+        self.assertEqual(gdp.gdp_multiplier('Ghana', seed='a'), gdp.gdp_multiplier(' ghana ', seed='a'))
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='scrape-token', METRICS_ALLOWED_IPS=[])
+class MetricsTests(CountriesTestCase):
+
+    AUTH = {'Authorization': 'Bearer scrape-token'}
+
+    def setUp(self):
+        super().setUp()
+        for metric in metrics.REGISTRY:
+            metric.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+    def test_requests_are_recorded_per_route(self):
+        with self.settings(COUNTRY_REPLICA_ENABLED=False):
+            self.client.get('/countries/Ghana', secure=True)
+            self.client.get('/countries/Togo', secure=True)
+            self.client.get('/countries/Nigeria', secure=True)
+
+        response = self.client.get('/metrics', secure=True, headers=self.AUTH)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn(
+            'countries_request_duration_seconds_count{method="GET",route="/countries/<str:name>",status="200"} 2',
+            body,
+        )
+        self.assertIn(
+            'countries_request_duration_seconds_count{method="GET",route="/countries/<str:name>",status="404"} 1',
+            body,
+        )
+        self.assertIn('countries_request_queries_bucket{method="GET",route="/countries/<str:name>",le="1.0"} 3', body)
+        self.assertIn('countries_span_duration_seconds_count{span="refresh.write"} 1', body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('h', 'Help.', ('kind',), (1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value, 'a')
+
+        self.assertEqual(list(histogram.collect())[2:], [
+            'h_bucket{kind="a",le="1.0"} 2',
+            'h_bucket{kind="a",le="5.0"} 3',
+            'h_bucket{kind="a",le="+Inf"} 4',
+            'h_sum{kind="a"} 14.5',
+            'h_count{kind="a"} 4',
+        ])
+
+    def test_sampling_profiler_reports_folded_stacks(self):
+        def busy_loop():
+            deadline = time.perf_counter() + 0.2
+            while time.perf_counter() < deadline:
+                pass
+
+        profiler = metrics.SamplingProfiler(interval=0.001)
+        profiler.start()
+        busy_loop()
+        profiler.stop()
+
+        self.assertIn('busy_loop (', profiler.folded())
+        self.assertEqual(self.client.get('/metrics/profile', secure=True, headers=self.AUTH).status_code, 404)
+
+    def test_endpoints_need_the_token_or_an_allowed_address(self):
+        self.assertEqual(self.client.get('/metrics', secure=True).status_code, 403)
+        self.assertEqual(
+            self.client.get('/metrics', secure=True, headers={'Authorization': 'Bearer wrong'}).status_code, 403
+        )
+        # Plain HTTP is redirected like everywhere else
+        self.assertEqual(self.client.get('/metrics', headers=self.AUTH).status_code, 301)
+
+        with self.settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/metrics', secure=True).status_code, 200)
+            self.assertEqual(self.client.get('/metrics', secure=True, REMOTE_ADDR='10.0.0.9').status_code, 403)
+
+        with self.settings(METRICS_ENABLED=False):
+            self.assertEqual(self.client.get('/metrics', secure=True, headers=self.AUTH).status_code, 404)
+
+    def test_profile_is_only_reset_by_post(self):
+        sampler = metrics.SamplingProfiler()
+        sampler.samples['main;work'] = 3
+
+        with mock.patch.object(metrics, 'profiler', return_value=sampler):
+            self.assertEqual(self.client.get('/metrics/profile', secure=True).status_code, 403)
+            self.assertEqual(self.client.post('/metrics/profile', secure=True).status_code, 403)
+
+            read = self.client.get('/metrics/profile?reset=1', secure=True, headers=self.AUTH)
+            self.assertEqual(read.content, b'main;work 3\n')
+            self.assertEqual(sampler.samples['main;work'], 3)
+
+            reset = self.client.post('/metrics/profile', secure=True, headers=self.AUTH)
+            self.assertEqual(reset.content, b'main;work 3\n')
+            self.assertEqual(sampler.samples, {})
+
+
+class SummaryImageTests(CountriesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+    def test_image_is_only_rendered_when_inputs_change(self):
+        first_path = SummaryImageGenerator.generate_summary_image()
+
+        with mock.patch.object(SummaryImageGenerator, 'render', wraps=SummaryImageGenerator.render) as render:
+            self.assertEqual(SummaryImageGenerator.generate_summary_image(), first_path)
+            render.assert_not_called()
+
+            self.client.delete('/countries/Ghana/delete', secure=True)
+            second_path = SummaryImageGenerator.generate_summary_image()
+            render.assert_called_once()
+
+        self.assertNotEqual(first_path, second_path)
+        self.assertFalse(os.path.exists(first_path))
+        self.assertEqual([f for f in os.listdir(self.cache_dir) if f.endswith('.png')], [os.path.basename(second_path)])
+
+    def test_image_endpoint_supports_conditional_requests(self):
+        response = self.client.get('/countries/image', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content[:8], b'\x89PNG\r\n\x1a\n')
+
+        by_etag = self.client.get('/countries/image', secure=True, HTTP_IF_NONE_MATCH=response['ETag'])
+        by_date = self.client.get('/countries/image', secure=True, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(by_date.status_code, 304)
+
+    def test_waiting_for_a_render_in_another_process_returns_503(self):
+        with file_lock(SummaryImageGenerator.lock_path(), timeout=0), self.settings(SUMMARY_IMAGE_RENDER_WAIT=0.1):
+            response = self.client.get('/countries/image', secure=True)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_served_bytes_are_cached_until_the_file_changes(self):
+        path = SummaryImageGenerator.generate_summary_image()
+        body = SummaryImageGenerator.image_bytes(path)
+
+        with mock.patch('builtins.open', side_effect=AssertionError('file re-read')):
+            self.assertIs(SummaryImageGenerator.image_bytes(path), body)
+
+    def test_image_formats_and_widths(self):
+        svg = self.client.get('/countries/image?format=svg', secure=True)
+        webp = self.client.get('/countries/image?format=webp&width=300', secure=True)
+        png = self.client.get('/countries/image?width=1200', secure=True)
+
+        self.assertEqual(svg['Content-Type'], 'image/svg+xml')
+        self.assertTrue(svg.content.startswith(b'<svg '))
+        self.assertIn(b'Total Countries: 2', svg.content)
+        self.assertEqual(webp['Content-Type'], 'image/webp')
+        self.assertEqual(Image.open(io.BytesIO(webp.content)).size, (300, 200))
+        self.assertEqual(Image.open(io.BytesIO(png.content)).size, (1200, 800))
+
+        revalidated = self.client.get('/countries/image?format=svg', secure=True, HTTP_IF_NONE_MATCH=svg['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        for query in ('format=gif', 'width=10', 'width=abc', 'width=%C2%B2', 'width=' + '9' * 30):
+            self.assertEqual(self.client.get(f'/countries/image?{query}', secure=True).status_code, 400)
+
+    def test_variants_are_rendered_once_and_spilled_to_disk(self):
+        image = SummaryImageGenerator.ensure_image()
+        first = SummaryImageGenerator.variant(image, 'webp', 400)
+
+        with mock.patch.object(SummaryImageGenerator, 'render', side_effect=AssertionError('re-rendered')):
+            self.assertIs(SummaryImageGenerator.variant(image, 'webp', 400), first)
+            SummaryImageGenerator._variants.clear()
+            self.assertEqual(SummaryImageGenerator.variant(image, 'webp', 400)['body'], first['body'])
+
+
+class BenchmarkTests(CountriesTestCase):
+
+    def test_api_suite_saves_and_compares_reports(self):
+        out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out_dir, ignore_errors=True)
+        path = os.path.join(out_dir, 'baseline.json')
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+        call_command('benchmark', 'api', '--countries', '20', '--requests', '3', '--save', path, stdout=io.StringIO())
+
+        with open(path) as f:
+            report = json.load(f)
+        scenarios = [row['scenario'] for row in report['results']]
+        self.assertEqual(len(scenarios), 4 * len(SORTS) + 6)
+        self.assertIn('GET /countries?region=Africa&currency=EUR&sort=gdp_desc', scenarios)
+        self.assertEqual(scenarios[-2:], ['refresh create', 'refresh unchanged'])
+        for row in report['results']:
+            self.assertEqual(row.get('errors', 0), 0, row['scenario'])
+            self.assertGreater(row['peak_kb'], 0)
+        self.assertEqual(report['results'][-2]['countries'], 20)
+        # Everything was rolled back
+        self.assertEqual(set(Country.objects.values_list('name', flat=True)), {'Ghana', 'Nigeria'})
+
+        slower = json.loads(json.dumps(report))
+        slower['results'][0]['requests_per_second'] /= 2
+        changes = benchmarks.compare_reports(report, slower)
+        self.assertEqual(
+            [(c['scenario'], c['metric']) for c in changes if c['regressed']],
+            [(scenarios[0], 'requests_per_second')],
+        )
+
+    def test_serialize_suite_renders_the_requested_size(self):
+        out = io.StringIO()
+        call_command('benchmark', 'serialize', '--countries', '30', stdout=out)
+
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual([row[0] for row in rows], ['legacy', 'fast', 'fast+row-cache'])
+        self.assertEqual({row[1] for row in rows}, {'30'})
+
+    def test_benchmarks_leave_the_cache_dir_alone(self):
+        # Production layout: the Django cache lives under CACHE_DIR
+        cache_location = os.path.join(settings.CACHE_DIR, 'django')
+        before = sorted(os.walk(settings.CACHE_DIR))
+        RefreshService.upsert_countries(COUNTRIES_PAYLOAD, RATES_PAYLOAD['rates'])
+
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': cache_location,
+        }}):
+            call_command('benchmark', 'api', '--countries', '20', '--requests', '3', stdout=io.StringIO())
+
+        self.assertEqual(sorted(os.walk(settings.CACHE_DIR)), before)
@@ -1,11 +1,27 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import metrics, views
+
+# Under uvicorn workers the read endpoints are served by async views
+if settings.SERVER_MODE == 'asgi':
+    from . import async_views as read_views
+else:
+    read_views = views
 
 urlpatterns = [
-    path('countries/image', views.get_countries_image, name='countries-image'),
+    path('countries/image', read_views.get_countries_image, name='countries-image'),
     path('countries/refresh', views.refresh_countries, name='refresh-countries'),
-    path('countries', views.list_countries, name='list-countries'),
-    path('countries/<str:name>', views.get_country_by_name, name='get-country'),
+    path('countries', read_views.list_countries, name='list-countries'),
+    path('countries/<str:name>', read_views.get_country_by_name, name='get-country'),
     path('countries/<str:name>/delete', views.delete_country, name='delete-country'),
-    path('status', views.get_status, name='status'),
+    path('status', read_views.get_status, name='status'),
+    path('rates', views.get_rates, name='rates'),
+    path('convert', views.convert_currency, name='convert'),
+    path('snapshots', views.list_snapshots, name='snapshots'),
+    path('snapshots/<int:snapshot_id>/diff', views.snapshot_diff, name='snapshot-diff'),
+    path('stats', views.get_stats, name='stats'),
+    path('stats/regions', views.get_region_stats, name='stats-regions'),
+    path('stats/currencies', views.get_currency_stats, name='stats-currencies'),
+    path('metrics', metrics.metrics_view, name='metrics'),
+    path('metrics/profile', metrics.profile_view, name='metrics-profile'),
 ]
\ No newline at end of file
@@ -1,213 +1,452 @@
+import logging
+import re
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.db import transaction
 from django.shortcuts import get_object_or_404
-from django.http import FileResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
 import os
 from django.conf import settings
-from .models import Country
-from .services import CountryService
-from .image_service import SummaryImageGenerator
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+from .cache import bump_dataset_version, etag_matches, get_dataset_version, list_response_cache
+from .models import Country, CountryStats, RefreshJob, Snapshot
+from .pagination import (
+    COUNTRY_FIELDS, DEFAULT_SORT, SORTS, InvalidPageParameter, decode_cursor, encode_cursor,
+    keyset_filter, order_fields, parse_fields, parse_limit,
+)
+from .jobs import RefreshJobRunner
+from .replica import COLUMNS as REPLICA_COLUMNS, CountryReplica
+from .serializers import CountrySerializer
+from .snapshot_service import SnapshotNotFound, SnapshotService
+from .rate_service import BASE_CURRENCY, MAX_BATCH, RateTable, UnknownCurrency, parse_amount
+from .image_service import ImageNotReady, SummaryImageGenerator
+
+logger = logging.getLogger(__name__)
 
 @api_view(['POST'])
 def refresh_countries(request):
-    try:
-        countries_data = CountryService.fetch_countries_data()
-        exchange_rates = CountryService.fetch_exchange_rates()
-        
-        processed_count = 0
-        created_count = 0
-        updated_count = 0
-        error_count = 0
-        error_samples = []  # Store sample errors
-        
-        with transaction.atomic():
-            for country_data in countries_data:
-                try:
-                    processed_count += 1
-                    
-                    # Process country data
-                    processed_data = CountryService.process_country_data(country_data, exchange_rates)
-                    country_name = processed_data['name']
-                    
-                    # Show first 5 countries being processed
-                    if processed_count <= 5:
-                        print(f"✓ Processing {processed_count}: {country_name}")
-                        print(f"  Population: {processed_data['population']}")
-                        print(f"  Currency: {processed_data['currency_code']}")
-                        print(f"  Exchange Rate: {processed_data['exchange_rate']}")
-                    
-                    # Use update_or_create
-                    country, created = Country.objects.update_or_create(
-                        name=country_name,
-                        defaults={
-                            'capital': processed_data['capital'],
-                            'region': processed_data['region'],
-                            'population': processed_data['population'] or 0,
-                            'currency_code': processed_data['currency_code'],
-                            'exchange_rate': processed_data['exchange_rate'],
-                            'flag_url': processed_data['flag_url']
-                        }
-                    )
-                    
-                    if created:
-                        created_count += 1
-                        if created_count <= 3:
-                            print(f"🎉 CREATED: {country_name}")
-                    else:
-                        updated_count += 1
-                        if updated_count <= 3:
-                            print(f"🔄 UPDATED: {country_name}")
-                        
-                except Exception as e:
-                    error_count += 1
-                    error_msg = f"{country_data.get('name')}: {str(e)}"
-                    error_samples.append(error_msg)
-                    
-                    # Show first 10 errors
-                    if error_count <= 10:
-                        print(f"❌ ERROR #{error_count}: {error_msg}")
-                    continue
-        
-        # Generate summary image
-        SummaryImageGenerator.generate_summary_image()
-        
-        response_data = {
-            'message': 'Countries data refreshed successfully',
-            'countries_processed': processed_count,
-            'countries_created': created_count,
-            'countries_updated': updated_count,
-            'countries_with_errors': error_count,
-            'total_countries_in_db': Country.objects.count(),
-            'sample_errors': error_samples[:5]  # Include sample errors in response
-        }
-        
-        print(f"\n=== FINAL RESULTS ===")
-        print(f"✅ Processed: {processed_count}")
-        print(f"✅ Created: {created_count}") 
-        print(f"✅ Updated: {updated_count}")
-        print(f"❌ Errors: {error_count}")
-        print(f"📊 Total in DB: {Country.objects.count()}")
-        
-        if error_samples:
-            print(f"\n=== SAMPLE ERRORS ===")
-            for i, error in enumerate(error_samples[:5], 1):
-                print(f"{i}. {error}")
-        
-        return Response(response_data)
-        
-    except Exception as e:
-        return Response(
-            {'error': 'External data source unavailable', 'details': str(e)},
-            status=status.HTTP_503_SERVICE_UNAVAILABLE
-        )
+    force = request.GET.get('force', '').lower() in ('1', 'true', 'yes')
+    prune = request.GET.get('prune', '').lower() in ('1', 'true', 'yes')
+    
+    job, created = RefreshJobRunner.submit(force=force, prune=prune)
+    
+    return Response(
+        {
+            'message': 'Refresh started' if created else 'Refresh already in progress',
+            'job_id': job.pk,
+            'status': job.status,
+            'status_url': f'/status?job={job.pk}',
+        },
+        status=status.HTTP_202_ACCEPTED
+    )
+
+def _current_stats():
+    """CountryStats, from the in-memory replica when it is enabled"""
+    if settings.COUNTRY_REPLICA_ENABLED:
+        return CountryReplica.current().stats
+    return CountryStats.current()
+
+def _job_data(job):
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'stage': job.stage,
+        'progress': job.progress,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'timings': job.timings,
+        'result': job.result,
+        'error': job.error or None,
+    }
                 
-@api_view(['GET'])
-def list_countries(request):
+def _list_params(request):
+    """
+    Normalized list parameters; equivalent queries share a cache entry.
+    
+    Raises InvalidPageParameter for unknown fields or a bad limit/cursor.
+    """
+    region = (request.GET.get('region') or '').strip().lower()
+    currency = (request.GET.get('currency') or '').strip().upper()
+    sort = request.GET.get('sort')
+    if sort not in SORTS:
+        sort = DEFAULT_SORT
+    fields = parse_fields(request.GET.get('fields'))
+    
+    limit = request.GET.get('limit')
+    cursor = request.GET.get('cursor')
+    if limit is None and cursor is None:
+        return region, currency, sort, fields, None, None
+    
+    after = decode_cursor(sort, cursor) if cursor else None
+    return region, currency, sort, fields, parse_limit(limit), after
+
+def _list_query(region, currency, sort, fields, limit=None, after=None):
+    """(values_list queryset, columns) for a list request; a page fetches limit + 1 rows"""
     countries = Country.objects.all()
     
-    region = request.GET.get('region')
     if region:
-        countries = countries.filter(region__iexact=region)
+        countries = countries.iexact('region', region)
     
-    currency = request.GET.get('currency')
     if currency:
-        countries = countries.filter(currency_code__iexact=currency)
+        # Indexed join through country_currencies; matches every currency
+        # a country uses, not only its primary one
+        countries = countries.filter(currencies__code=currency)
+    
+    sort_field, _ = SORTS[sort]
+    if sort_field == 'estimated_gdp':
+        countries = countries.exclude(estimated_gdp__isnull=True)
+    countries = countries.order_by(*order_fields(sort))
     
+    if after is not None:
+        countries = countries.filter(keyset_filter(sort, *after))
+    
+    # Only the requested columns (plus what the cursor needs) are loaded
+    columns = CountrySerializer.columns(fields, extra=(sort_field,) if limit is not None else ())
+    countries = countries.values_list(*columns)
+    if limit is not None:
+        countries = countries[:limit + 1]
+    return countries, columns
+
+def _render_list(version, sort, fields, columns, rows, limit=None):
+    if limit is None:
+        return CountrySerializer.render_list(fields, columns, rows, version)
+    
+    rows = list(rows)
+    next_cursor = None
+    if len(rows) > limit:
+        sort_field, _ = SORTS[sort]
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, {'id': last[0], sort_field: last[columns.index(sort_field)]})
+    return CountrySerializer.render_page(fields, columns, rows, next_cursor, version)
+
+def _list_countries_body(version, region, currency, sort, fields, limit=None, after=None):
+    if settings.COUNTRY_REPLICA_ENABLED:
+        rows = CountryReplica.for_version(version).query(region, currency, sort, limit, after)
+        if rows is not None:
+            return _render_list(version, sort, fields, REPLICA_COLUMNS, rows, limit)
+    countries, columns = _list_query(region, currency, sort, fields, limit, after)
+    return _render_list(version, sort, fields, columns, countries, limit)
+
+# Snapshots keep neither regions nor currency links, and are not paged
+AS_OF_UNSUPPORTED = ('region', 'currency', 'limit', 'cursor')
+
+def _as_of_params(request):
+    """(snapshot, fields) for ?as_of=; raises ValueError, InvalidPageParameter or SnapshotNotFound"""
+    unsupported = [name for name in AS_OF_UNSUPPORTED if name in request.GET]
+    if unsupported:
+        raise InvalidPageParameter(f"as_of cannot be combined with: {', '.join(unsupported)}")
+    snapshot = SnapshotService.resolve(request.GET['as_of'])
+    fields = parse_fields(request.GET.get('fields') or ','.join(('id',) + SnapshotService.TRACKED_FIELDS))
+    unknown = [field for field in fields if field != 'id' and field not in SnapshotService.TRACKED_FIELDS]
+    if unknown:
+        raise InvalidPageParameter(
+            f"Snapshots only keep: id, {', '.join(SnapshotService.TRACKED_FIELDS)}"
+        )
+    return snapshot, fields
+
+def _as_of_response(request, snapshot, fields):
     sort = request.GET.get('sort')
-    if sort == 'gdp_desc':
-        countries = countries.exclude(estimated_gdp__isnull=True).order_by('-estimated_gdp')
-    elif sort == 'gdp_asc':
-        countries = countries.exclude(estimated_gdp__isnull=True).order_by('estimated_gdp')
-    elif sort == 'population_desc':
-        countries = countries.order_by('-population')
-    elif sort == 'population_asc':
-        countries = countries.order_by('population')
-    elif sort == 'name_desc':
-        countries = countries.order_by('-name')
+    if sort not in SORTS:
+        sort = DEFAULT_SORT
+    rows = SnapshotService.countries_as_of(snapshot, *SORTS[sort])
+    
+    columns = ('id',) + SnapshotService.TRACKED_FIELDS
+    body = CountrySerializer.render_list(fields, columns, (tuple(row[c] for c in columns) for row in rows))
+    response = HttpResponse(body, content_type='application/json')
+    response['X-Snapshot-Id'] = str(snapshot.pk)
+    response['X-Snapshot-Created-At'] = http_date(snapshot.created_at.timestamp())
+    return response
+
+def _list_countries_as_of(request):
+    """GET /countries?as_of=: the tracked values of every country as of a snapshot"""
+    try:
+        snapshot, fields = _as_of_params(request)
+    except (ValueError, InvalidPageParameter) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except SnapshotNotFound as e:
+        return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+    return _as_of_response(request, snapshot, fields)
+
+@api_view(['GET'])
+def list_countries(request):
+    if 'as_of' in request.GET:
+        return _list_countries_as_of(request)
+    
+    try:
+        params = _list_params(request)
+    except InvalidPageParameter as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    version = get_dataset_version()
+    
+    if not settings.COUNTRY_LIST_CACHE_ENABLED:
+        body = _list_countries_body(version, *params)
+        return HttpResponse(body, content_type='application/json')
+    
+    entry = list_response_cache.get(version, params)
+    if entry is None:
+        entry = list_response_cache.set(version, params, _list_countries_body(version, *params))
+    etag, body = entry
+    
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
     else:
-        countries = countries.order_by('name')
-    
-    data = []
-    for country in countries:
-        data.append({
-            'id': country.id,
-            'name': country.name,
-            'capital': country.capital,
-            'region': country.region,
-            'population': country.population,
-            'currency_code': country.currency_code,
-            'exchange_rate': float(country.exchange_rate) if country.exchange_rate else None,
-            'estimated_gdp': float(country.estimated_gdp) if country.estimated_gdp else None,
-            'flag_url': country.flag_url,
-            'last_refreshed_at': country.last_refreshed_at,
-        })
-    
-    return Response(data)
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
 
 @api_view(['GET'])
 def get_country_by_name(request, name):
-    country = get_object_or_404(Country, name__iexact=name)
-    data = {
-        'id': country.id,
-        'name': country.name,
-        'capital': country.capital,
-        'region': country.region,
-        'population': country.population,
-        'currency_code': country.currency_code,
-        'exchange_rate': float(country.exchange_rate) if country.exchange_rate else None,
-        'estimated_gdp': float(country.estimated_gdp) if country.estimated_gdp else None,
-        'flag_url': country.flag_url,
-        'last_refreshed_at': country.last_refreshed_at,
-    }
-    return Response(data)
+    version = get_dataset_version()
+    if settings.COUNTRY_REPLICA_ENABLED:
+        columns = REPLICA_COLUMNS
+        row = CountryReplica.for_version(version).get(name)
+    else:
+        columns = CountrySerializer.columns(COUNTRY_FIELDS)
+        row = Country.objects.iexact('name', name).order_by().values_list(*columns).first()
+    if row is None:
+        raise Http404
+    body = CountrySerializer.render_one(COUNTRY_FIELDS, columns, row, version)
+    return HttpResponse(body, content_type='application/json')
 
 @api_view(['DELETE'])
 def delete_country(request, name):
-    country = get_object_or_404(Country, name__iexact=name)
-    country.delete()
+    with transaction.atomic():
+        country = get_object_or_404(Country.objects.iexact('name', name))
+        country_id = country.pk
+        country.delete()
+        CountryStats.rebuild()
+        SnapshotService.record(removed_ids=[country_id])
+        transaction.on_commit(bump_dataset_version)
     return Response({'message': f'Country {name} deleted successfully'})
 
+def _is_number(value):
+    """ASCII digits only (str.isdigit() also takes '²'), and few enough for a bigint"""
+    return re.fullmatch(r'\d{1,18}', value, re.ASCII) is not None
+
 @api_view(['GET'])
 def get_status(request):
-    total_countries = Country.objects.count()
-    last_country = Country.objects.order_by('-last_refreshed_at').first()
+    stats = _current_stats()
+    
+    job_id = request.GET.get('job')
+    if job_id is not None:
+        if not _is_number(job_id):
+            return Response({'error': 'Invalid job id'}, status=status.HTTP_400_BAD_REQUEST)
+        job = get_object_or_404(RefreshJob, pk=job_id)
+    else:
+        job = RefreshJob.objects.first()
     
     status_data = {
-        'total_countries': total_countries,
-        'last_refreshed_at': last_country.last_refreshed_at if last_country else None
+        'total_countries': stats.total_countries,
+        'last_refreshed_at': stats.last_refreshed_at,
+        'refresh_job': _job_data(job) if job else None
     }
     
     return Response(status_data)
 
+def _snapshot_data(snapshot):
+    return {
+        'id': snapshot.pk,
+        'created_at': snapshot.created_at,
+        'total_countries': snapshot.total_countries,
+        'changed_countries': snapshot.changed_countries,
+    }
+
 @api_view(['GET'])
-def get_countries_image(request):
-    """Serve the generated summary image"""
-    image_path = os.path.join(settings.CACHE_DIR, 'summary.png')
-    
-    print(f"Looking for image at: {image_path}")  # Debug
-    print(f"Image exists: {os.path.exists(image_path)}")  # Debug
+def list_snapshots(request):
+    """Most recent snapshots first"""
+    return Response([_snapshot_data(snapshot) for snapshot in Snapshot.objects.all()[:100]])
+
+@api_view(['GET'])
+def snapshot_diff(request, snapshot_id):
+    """What changed between ?from= (default: the previous snapshot) and snapshot_id"""
+    snapshot = get_object_or_404(Snapshot, pk=snapshot_id)
+    try:
+        if request.GET.get('from'):
+            from_snapshot = SnapshotService.resolve(request.GET['from'])
+        else:
+            from_snapshot = Snapshot.objects.filter(pk__lt=snapshot.pk).first()
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except SnapshotNotFound as e:
+        return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
     
-    if os.path.exists(image_path):
-        try:
-            return FileResponse(open(image_path, 'rb'), content_type='image/png')
-        except Exception as e:
-            print(f"Error opening image: {e}")
+    return Response({
+        'from': _snapshot_data(from_snapshot) if from_snapshot else None,
+        'to': _snapshot_data(snapshot),
+        **SnapshotService.diff(from_snapshot, snapshot),
+    })
+
+def _currency(value):
+    return (value or '').strip().upper()
+
+@api_view(['GET'])
+def get_rates(request):
+    """Rates against ?base= (default USD), optionally limited to ?symbols=EUR,GBP"""
+    base = _currency(request.GET.get('base')) or BASE_CURRENCY
+    symbols = [_currency(code) for code in request.GET.get('symbols', '').split(',') if code.strip()]
+    try:
+        rates = RateTable.current().rates_for(base, symbols)
+    except UnknownCurrency as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'base': base, 'rates': rates})
+
+@api_view(['GET', 'POST'])
+def convert_currency(request):
+    """
+    GET ?from=USD&to=EUR&amount=10 converts one amount; POST
+    {"conversions": [{"from", "to", "amount"}, ...]} converts a batch.
+    """
+    if request.method == 'GET':
+        items = [{'from': request.GET.get('from'), 'to': request.GET.get('to'), 'amount': request.GET.get('amount', 1)}]
+    else:
+        items = request.data.get('conversions') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
             return Response(
-                {'error': 'Could not open image file'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'Expected {"conversions": [{"from": ..., "to": ..., "amount": ...}, ...]}'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-    else:
-        print("Image not found, generating now...")
-        # Generate image on the fly if missing
-        from .image_service import SummaryImageGenerator
-        new_image_path = SummaryImageGenerator.generate_summary_image()
-        
-        if new_image_path and os.path.exists(new_image_path):
-            return FileResponse(open(new_image_path, 'rb'), content_type='image/png')
-        else:
+        if len(items) > MAX_BATCH:
             return Response(
-                {'error': 'Summary image not found and could not be generated'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
\ No newline at end of file
+                {'error': f'At most {MAX_BATCH} conversions per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    from_codes = [_currency(item.get('from')) for item in items]
+    to_codes = [_currency(item.get('to')) for item in items]
+    missing = [name for name, codes in (('from', from_codes), ('to', to_codes)) if not all(codes)]
+    if missing:
+        return Response(
+            {'error': f"Missing required parameter(s): {', '.join(missing)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        amounts = [parse_amount(item.get('amount', 1)) for item in items]
+    except (TypeError, ValueError):
+        return Response({'error': 'amount must be a finite number'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    table = RateTable.current()
+    try:
+        results = table.convert_batch(from_codes, to_codes, amounts)
+    except UnknownCurrency as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    conversions = [
+        {'from': from_code, 'to': to_code, 'amount': amount, 'result': result}
+        for from_code, to_code, amount, result in zip(from_codes, to_codes, amounts, results)
+    ]
+    if request.method == 'GET':
+        return Response({**conversions[0], 'rate': table.cross_rate(from_codes[0], to_codes[0])})
+    return Response({'conversions': conversions})
+
+def _amount(value):
+    """Decimal string from CountryStats -> number, like estimated_gdp on /countries"""
+    return float(value) if value else None
+
+def _rollup_data(rollup):
+    return {
+        key: {**entry, 'estimated_gdp': _amount(entry['estimated_gdp'])}
+        for key, entry in rollup.items()
+    }
+
+@api_view(['GET'])
+def get_stats(request):
+    """Totals and top countries, read from the precomputed CountryStats row"""
+    stats = _current_stats()
+    return Response({
+        'total_countries': stats.total_countries,
+        'total_population': stats.total_population,
+        'total_estimated_gdp': _amount(stats.total_estimated_gdp),
+        'last_refreshed_at': stats.last_refreshed_at,
+        'top_by_gdp': [
+            {**entry, 'estimated_gdp': _amount(entry['estimated_gdp'])} for entry in stats.top_by_gdp
+        ],
+        'top_by_population': stats.top_by_population,
+        'updated_at': stats.updated_at,
+    })
+
+@api_view(['GET'])
+def get_region_stats(request):
+    """Country count, population and estimated GDP per region"""
+    return Response(_rollup_data(_current_stats().regions))
+
+@api_view(['GET'])
+def get_currency_stats(request):
+    """Country count, population and estimated GDP per currency code"""
+    return Response(_rollup_data(_current_stats().currencies))
+
+def _image_params(request):
+    """(format, width) for the image endpoint; raises ValueError when invalid"""
+    image_format = (request.GET.get('format') or 'png').lower()
+    if image_format not in SummaryImageGenerator.CONTENT_TYPES:
+        raise ValueError(f"format must be one of: {', '.join(SummaryImageGenerator.CONTENT_TYPES)}")
+    
+    width = request.GET.get('width')
+    if width is None:
+        return image_format, SummaryImageGenerator.BASE_WIDTH
+    min_width, max_width = SummaryImageGenerator.MIN_WIDTH, SummaryImageGenerator.MAX_WIDTH
+    if not _is_number(width) or not min_width <= int(width) <= max_width:
+        raise ValueError(f'width must be an integer between {min_width} and {max_width}')
+    return image_format, int(width)
+
+def _image_response(request, image, image_format, width):
+    """Serve the summary image (or a variant of it) with ETag/Last-Modified validation"""
+    last_modified = os.path.getmtime(image['path'])
+    default = image_format == 'png' and width == SummaryImageGenerator.BASE_WIDTH
+    variant = None if default else SummaryImageGenerator.variant(image, image_format, width)
+    etag = f'"{image["etag"] if default else variant["etag"]}"'
+    content_type = SummaryImageGenerator.CONTENT_TYPES[image_format]
+    
+    if etag_matches(request, etag) or (
+        'HTTP_IF_NONE_MATCH' not in request.META
+        and not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), int(last_modified))
+    ):
+        response = HttpResponseNotModified()
+    elif variant is not None:
+        response = HttpResponse(variant['body'], content_type=content_type)
+    elif 'wsgi.file_wrapper' in request.META:
+        # The server can sendfile() straight from the file: zero copies
+        response = FileResponse(open(image['path'], 'rb'), content_type=content_type)
+    else:
+        response = HttpResponse(SummaryImageGenerator.image_bytes(image['path']), content_type=content_type)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+@api_view(['GET'])
+def get_countries_image(request):
+    """Serve the generated summary image; ?format=png|webp|svg and ?width= select a variant"""
+    try:
+        image_format, width = _image_params(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        # Renders once (single-flight across workers) if no image exists yet
+        image = SummaryImageGenerator.ensure_image(wait=settings.SUMMARY_IMAGE_RENDER_WAIT)
+    except ImageNotReady:
+        response = Response(
+            {'error': 'Summary image is being generated, try again shortly'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = '2'
+        return response
+    
+    if image is None:
+        return Response(
+            {'error': 'Summary image not found and could not be generated'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    try:
+        return _image_response(request, image, image_format, width)
+    except OSError:
+        logger.exception("Could not open summary image %s", image['path'])
+        return Response(
+            {'error': 'Could not open image file'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )